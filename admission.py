@@ -0,0 +1,142 @@
+
+import math
+import time
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+logger = logging.getLogger("Admission")
+
+
+class AdmissionRejected(Exception):
+    """Тяжелый запрос не может быть принят сейчас"""
+
+    def __init__(self, message: str, retry_after: int = 1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def available_memory_mb():
+    """Доступная память по /proc/meminfo (MemAvailable), None если недоступно"""
+    try:
+        with open('/proc/meminfo') as meminfo:
+            for line in meminfo:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) / 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+class AdmissionController:
+    """Ограничивает число одновременных тяжелых запросов (анализ видео).
+
+    Запрос выполняется, если занято меньше max_concurrent мест, зарезервированная
+    память с учетом нового запроса укладывается в memory_budget_mb (0 - без бюджета)
+    и в системе есть job_memory_mb свободной памяти. Иначе запрос ждет в очереди
+    до queue_timeout секунд; если очередь уже содержит max_queue запросов или время
+    ожидания вышло, выбрасывается AdmissionRejected с оценкой Retry-After по длине
+    очереди и средней длительности последних запросов. Ждущие запросы получают
+    место строго в порядке очереди.
+    """
+
+    def __init__(self, max_concurrent: int = 2, max_queue: int = 8, queue_timeout: float = 30.0,
+                 memory_budget_mb: float = 0, job_memory_mb: float = 600,
+                 memory_probe=available_memory_mb):
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.memory_budget_mb = memory_budget_mb
+        self.job_memory_mb = job_memory_mb
+        self.memory_probe = memory_probe
+        self._cond = threading.Condition()
+        self._active = 0
+        self._reserved_mb = 0.0
+        self._queue = deque()
+        self._durations = deque(maxlen=20)
+        self.admitted = 0
+        self.rejected = 0
+
+    def _average_duration(self) -> float:
+        # Пока нет истории, считаем, что запрос занимает время ожидания в очереди
+        return sum(self._durations) / len(self._durations) if self._durations else self.queue_timeout
+
+    @property
+    def _waiting(self) -> int:
+        return len(self._queue)
+
+    def _retry_after(self) -> int:
+        ahead = self._active + self._waiting
+        rounds = ahead / self.max_concurrent
+        return max(1, math.ceil(rounds * self._average_duration()))
+
+    def _can_start(self, memory_mb: float) -> bool:
+        if self._active >= self.max_concurrent:
+            return False
+        # Первый запрос допускается всегда, иначе слишком большой запрос не выполнится никогда
+        if self._active == 0:
+            return True
+        if self.memory_budget_mb and self._reserved_mb + memory_mb > self.memory_budget_mb:
+            return False
+        if self.memory_probe is not None:
+            available = self.memory_probe()
+            if available is not None and available < memory_mb:
+                return False
+        return True
+
+    def _reject(self, message: str):
+        self.rejected += 1
+        retry_after = self._retry_after()
+        logger.warning(f"{message}: {self._active} running, {self._waiting} waiting, "
+                       f"retry after {retry_after}s")
+        raise AdmissionRejected(message, retry_after=retry_after)
+
+    @contextmanager
+    def admit(self, memory_mb: float = None):
+        """Занимает место на время блока или выбрасывает AdmissionRejected"""
+        memory_mb = self.job_memory_mb if memory_mb is None else memory_mb
+        with self._cond:
+            # Если очередь не пуста, новый запрос встает в нее, а не обгоняет ждущих
+            if self._queue or not self._can_start(memory_mb):
+                if len(self._queue) >= self.max_queue:
+                    self._reject('Server is busy analyzing other videos')
+                ticket = object()
+                self._queue.append(ticket)
+                deadline = time.monotonic() + self.queue_timeout
+                try:
+                    # Место достается только первому в очереди: notify_all будит всех,
+                    # остальные снова засыпают
+                    while self._queue[0] is not ticket or not self._can_start(memory_mb):
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self._reject('Timed out waiting for an analysis slot')
+                        # Свободная память может появиться и без освобождения места,
+                        # поэтому проверяем периодически
+                        self._cond.wait(min(remaining, 1.0))
+                finally:
+                    self._queue.remove(ticket)
+                    # Следующий в очереди мог ждать только своей очереди
+                    self._cond.notify_all()
+            self._active += 1
+            self._reserved_mb += memory_mb
+            self.admitted += 1
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._active -= 1
+                self._reserved_mb -= memory_mb
+                self._durations.append(time.monotonic() - started)
+                self._cond.notify_all()
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                'active': self._active, 'waiting': self._waiting,
+                'max_concurrent': self.max_concurrent, 'max_queue': self.max_queue,
+                'reserved_mb': round(self._reserved_mb), 'admitted': self.admitted,
+                'rejected': self.rejected,
+                'avg_duration_sec': round(self._average_duration(), 2) if self._durations else None
+            }
@@ -0,0 +1,200 @@
+
+import os
+import time
+import sqlite3
+import logging
+import argparse
+
+from video_storage import VideoStorage
+from neural_network.logging_setup import setup_logging
+
+logger = logging.getLogger("AnalysisBackfill")
+
+ANALYSIS_TABLE = 'fatigue_analysis'
+
+# Таблица анализов, в которую пишут маршруты API, воркеры и backfill
+ANALYSIS_SCHEMA = f'''
+    CREATE TABLE IF NOT EXISTS {ANALYSIS_TABLE} (
+        analysis_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        flight_id INTEGER,
+        fatigue_level TEXT,
+        neural_network_score REAL,
+        feedback_score REAL,
+        analysis_date TEXT,
+        video_path TEXT,
+        notes TEXT,
+        model_version TEXT
+    )
+'''
+
+# Источники видео, для которых поддерживается актуальный анализ; user_id - владелец
+# результата, если у видео еще нет анализа (у записи он известен, у рейса - нет)
+VIDEO_SOURCES = [
+    ('flight', 'Flights', "SELECT video_path, flight_id, NULL AS user_id FROM Flights "
+                          "WHERE video_path IS NOT NULL AND video_path != ''"),
+    ('recording', 'recordings', 'SELECT video_path, NULL AS flight_id, user_id FROM recordings '
+                                'WHERE video_path IS NOT NULL'),
+]
+
+
+def ensure_model_version_column(conn: sqlite3.Connection):
+    """Создает таблицу анализов, если ее нет, добавляет колонку с версией модели
+    и индекс для поиска последнего анализа видео"""
+    conn.execute(ANALYSIS_SCHEMA)
+    columns = [row[1] for row in conn.execute(f'PRAGMA table_info({ANALYSIS_TABLE})')]
+    if 'model_version' not in columns:
+        conn.execute(f'ALTER TABLE {ANALYSIS_TABLE} ADD COLUMN model_version TEXT')
+    conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{ANALYSIS_TABLE}_video '
+                 f'ON {ANALYSIS_TABLE} (video_path, analysis_date)')
+    conn.commit()
+
+
+def _existing_tables(conn: sqlite3.Connection) -> set:
+    return {row[0].lower() for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+
+
+def find_outdated(conn: sqlite3.Connection, model_version: str, include_unanalyzed: bool = False) -> list:
+    """Возвращает видео, последний анализ которых сделан другой версией модели.
+
+    Выполняется одним запросом: последний анализ каждого видео выбирается оконной функцией.
+    """
+    tables = _existing_tables(conn)
+    sources = [f"SELECT '{kind}' AS source, * FROM ({query})" for kind, table, query in VIDEO_SOURCES
+               if table.lower() in tables]
+    if not sources or ANALYSIS_TABLE not in tables:
+        return []
+
+    condition = 'latest.model_version IS NULL OR latest.model_version != ?'
+    if not include_unanalyzed:
+        condition = f'latest.video_path IS NOT NULL AND ({condition})'
+    rows = conn.execute(f'''
+        WITH videos AS ({' UNION ALL '.join(sources)}),
+        latest AS (
+            SELECT video_path, user_id, flight_id, model_version,
+                   ROW_NUMBER() OVER (PARTITION BY video_path
+                                      ORDER BY analysis_date DESC, analysis_id DESC) AS rn
+            FROM {ANALYSIS_TABLE}
+        )
+        SELECT videos.source, videos.video_path,
+               COALESCE(videos.flight_id, latest.flight_id) AS flight_id,
+               COALESCE(latest.user_id, videos.user_id) AS user_id, latest.model_version
+        FROM videos
+        LEFT JOIN latest ON latest.video_path = videos.video_path AND latest.rn = 1
+        WHERE {condition}
+        GROUP BY videos.video_path
+    ''', (model_version,)).fetchall()
+    return [dict(zip(('source', 'video_path', 'flight_id', 'user_id', 'model_version'), row))
+            for row in rows]
+
+
+def _save_results(conn: sqlite3.Connection, rows: list):
+    # Одна транзакция на пачку результатов
+    with conn:
+        conn.executemany(
+            f'''INSERT INTO {ANALYSIS_TABLE}
+               (user_id, fatigue_level, neural_network_score, video_path, analysis_date,
+                flight_id, model_version)
+               VALUES (?, ?, ?, ?, datetime('now'), ?, ?)''',
+            rows
+        )
+
+
+def run_backfill(db_path: str, video_root: str, model_path: str = None, workers: int = 1,
+                 batch_size: int = 20, pause: float = 5.0, nice: int = 10,
+                 include_unanalyzed: bool = False, limit: int = 0, dry_run: bool = False,
+                 detection_cache: str = None) -> dict:
+    """Переанализирует видео с устаревшей версией модели пачками в фоновых процессах.
+
+    С detection_cache новая модель оценивает сохраненные кропы лиц без повторной детекции.
+    """
+    from neural_network.predict import MODEL_PATH, model_fingerprint
+    from neural_network.batch import analysis_pool, _analyze_one
+
+    model_path = model_path or MODEL_PATH
+    # Без модели воркеры пула не запустятся: ошибка сразу, до выборки видео
+    if not os.path.exists(model_path):
+        logger.error(f"Model file not found: {model_path}")
+        raise FileNotFoundError(f"Model file not found: {model_path}")
+    model_version = model_fingerprint(model_path)
+    storage = VideoStorage(video_root, db_path)
+
+    conn = sqlite3.connect(db_path, timeout=30)
+    ensure_model_version_column(conn)
+    targets = find_outdated(conn, model_version, include_unanalyzed=include_unanalyzed)
+    if limit:
+        targets = targets[:limit]
+
+    summary = {'model_version': model_version, 'outdated': len(targets), 'reanalyzed': 0,
+               'missing': 0, 'errors': 0, 'wall_sec': 0.0,
+               # Анализ без владельца не виден ни одному пользователю: такие видео пропускаются
+               'no_owner': sum(1 for target in targets if target['user_id'] is None)}
+    logger.info(f"Backfill to model {model_version}: {len(targets)} outdated videos")
+    if dry_run or not targets:
+        conn.close()
+        return summary
+
+    jobs = {}
+    for target in targets:
+        if target['user_id'] is None:
+            logger.warning(f"Skipping {target['video_path']}: no owner for the analysis")
+            continue
+        path = storage.resolve(target['video_path'])
+        if not path:
+            summary['missing'] += 1
+            logger.warning(f"Video file not found: {target['video_path']}")
+            continue
+        jobs[path] = target
+
+    started = time.time()
+    paths = list(jobs)
+    options = {'detection_cache': detection_cache} if detection_cache else {}
+    with analysis_pool(max(1, min(workers, len(paths) or 1)), model_path, options, nice=nice) as pool:
+        for offset in range(0, len(paths), batch_size):
+            batch = paths[offset:offset + batch_size]
+            rows = []
+            for report in pool.imap_unordered(_analyze_one, batch):
+                target = jobs[report['input']]
+                if report['level'] == 'Error' or report['model_version'] != model_version:
+                    summary['errors'] += 1
+                    logger.error(f"Re-analysis failed for {target['video_path']}: "
+                                 f"{report.get('error', report['level'])}")
+                    continue
+                rows.append((target['user_id'], report['level'], report['score'],
+                             target['video_path'], target['flight_id'], report['model_version']))
+            _save_results(conn, rows)
+            summary['reanalyzed'] += len(rows)
+            logger.info(f"Backfill progress: {offset + len(batch)}/{len(paths)}")
+            # Пауза между пачками оставляет ресурсы живому трафику
+            if pause and offset + batch_size < len(paths):
+                time.sleep(pause)
+
+    conn.close()
+    summary['wall_sec'] = round(time.time() - started, 2)
+    return summary
+
+
+if __name__ == '__main__':
+    import json
+    parser = argparse.ArgumentParser(description='Re-analyze videos analyzed with an outdated model')
+    parser.add_argument('--db', default='database/database.db')
+    parser.add_argument('--videos', default='neural_network/data/video')
+    parser.add_argument('--model', default=None, help='Path to the current model')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--batch-size', type=int, default=20)
+    parser.add_argument('--pause', type=float, default=5.0, help='Seconds to sleep between batches')
+    parser.add_argument('--nice', type=int, default=10, help='Niceness increment for worker processes')
+    parser.add_argument('--include-unanalyzed', action='store_true',
+                        help='Also analyze videos that have no analysis yet')
+    parser.add_argument('--limit', type=int, default=0)
+    parser.add_argument('--dry-run', action='store_true', help='Only report outdated videos')
+    parser.add_argument('--detection-cache', metavar='DIR', default=os.environ.get('DETECTION_CACHE_DIR') or None,
+                        help='Reuse cached face detections and crops (default: DETECTION_CACHE_DIR)')
+    args = parser.parse_args()
+
+    setup_logging()
+    result = run_backfill(args.db, args.videos, model_path=args.model, workers=args.workers,
+                          batch_size=args.batch_size, pause=args.pause, nice=args.nice,
+                          include_unanalyzed=args.include_unanalyzed, limit=args.limit,
+                          dry_run=args.dry_run, detection_cache=args.detection_cache)
+    print(json.dumps(result, indent=2))
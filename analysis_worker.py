@@ -0,0 +1,249 @@
+
+import os
+import time
+import signal
+import socket
+import sqlite3
+import logging
+import threading
+
+from video_storage import VideoStorage
+from timeline import ensure_timeline_table, save_timeline
+from analysis_backfill import ensure_model_version_column
+from work_queue import LeaseLost, SQLiteWorkQueue, open_work_queue
+from neural_network.logging_setup import setup_logging, log_context
+
+logger = logging.getLogger("AnalysisWorker")
+
+ANALYSIS_TABLE = 'fatigue_analysis'
+ANALYSIS_KIND = 'analysis'
+
+# Ошибки, которые не исправит повторная попытка
+NO_FACES_ERROR = 'No faces detected in video'
+MISSING_VIDEO_ERROR = 'Video file not found'
+
+# Параметры analyze_source, которые можно передать в задаче
+ANALYSIS_OPTIONS = ('sequential', 'multi_face', 'pipelined', 'motion_threshold',
+                    'motion_max_reuse', 'scoring', 'detection_cache')
+
+
+def analysis_payload(video_path: str, user_id: int, flight_id=None, **options) -> dict:
+    """Задача анализа: имя видео в хранилище, владелец результата и параметры анализа"""
+    return {'video_path': video_path, 'user_id': user_id, 'flight_id': flight_id,
+            'options': {name: value for name, value in options.items() if name in ANALYSIS_OPTIONS}}
+
+
+def save_analysis(conn: sqlite3.Connection, payload: dict, report: dict) -> dict:
+    """Записывает результат в fatigue_analysis и ряд оценок; коммит выполняет вызывающий код"""
+    cursor = conn.execute(
+        f'''INSERT INTO {ANALYSIS_TABLE}
+           (user_id, fatigue_level, neural_network_score, video_path, analysis_date, flight_id, model_version)
+           VALUES (?, ?, ?, ?, datetime('now'), ?, ?)''',
+        (payload['user_id'], report['level'], report['score'], payload['video_path'],
+         payload.get('flight_id'), report['model_version'])
+    )
+    save_timeline(conn, cursor.lastrowid, report.get('timeline', []))
+    return {'analysis_id': cursor.lastrowid}
+
+
+def analysis_summary(report: dict) -> dict:
+    return {
+        'fatigue_level': report['level'],
+        'neural_network_score': report['score'],
+        'analyzed_fraction': report['analyzed_fraction'],
+        'stopped_early': report['stopped_early'],
+        'identities': report.get('identities', []),
+        'model_version': report['model_version'],
+        'elapsed_sec': report['elapsed_sec'],
+    }
+
+
+class AnalysisWorker:
+    """Забирает задачи анализа из очереди и записывает результаты в fatigue_analysis.
+
+    Пока идет анализ, фоновый поток продлевает аренду каждые lease_sec / 3
+    секунд. Если воркер упадет или зависнет, аренда истечет, и задачу
+    возьмет другой воркер. Модель загружается один раз на процесс.
+    """
+
+    def __init__(self, queue, db_path: str, video_root: str, model_path: str = None,
+                 worker_id: str = None, lease_sec: float = 120.0, poll_interval: float = 1.0):
+        self.queue = queue
+        self.db_path = db_path
+        self.storage = VideoStorage(video_root, db_path)
+        self.model_path = model_path
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        self.lease_sec = lease_sec
+        self.poll_interval = poll_interval
+        self.stop_event = threading.Event()
+        self.analyzer = None
+        self.processed = 0
+        self.failed = 0
+        # Воркер может запуститься раньше API, который обычно выполняет миграции
+        conn = sqlite3.connect(db_path, timeout=30)
+        try:
+            ensure_model_version_column(conn)
+            ensure_timeline_table(conn)
+        finally:
+            conn.close()
+        # Результат и статус задачи пишутся одной транзакцией, если очередь в той же БД
+        self.shares_database = isinstance(queue, SQLiteWorkQueue) and \
+            os.path.abspath(queue.db_path) == os.path.abspath(db_path)
+
+    def _load_analyzer(self):
+        if self.analyzer is None:
+            from neural_network.predict import FatigueAnalyzer, MODEL_PATH
+            self.analyzer = FatigueAnalyzer(self.model_path or MODEL_PATH)
+        return self.analyzer
+
+    def _heartbeat(self, job, finished: threading.Event, lost: threading.Event):
+        while not finished.wait(self.lease_sec / 3):
+            try:
+                if not self.queue.heartbeat(job, self.lease_sec):
+                    logger.warning(f"Lease on job {job.job_id} lost, result will be discarded")
+                    lost.set()
+                    return
+            except Exception as e:
+                # Временная ошибка хранилища: следующая попытка до истечения аренды
+                logger.warning(f"Heartbeat for job {job.job_id} failed: {str(e)}")
+
+    def _record(self, job, report: dict) -> dict:
+        summary = analysis_summary(report)
+        record = lambda conn: save_analysis(conn, job.payload, report)
+        if self.shares_database:
+            return self.queue.complete(job, summary, record=record)
+        # Очередь в другом хранилище: результат пишется до отметки о выполнении,
+        # поэтому при потере аренды в этот момент возможна повторная запись
+        if not self.queue.heartbeat(job, self.lease_sec):
+            raise LeaseLost(f"Lease on job {job.job_id} was lost")
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            with conn:
+                summary.update(record(conn))
+        finally:
+            conn.close()
+        return self.queue.complete(job, summary)
+
+    def process(self, job):
+        from neural_network.predict import analyze_source
+
+        payload = job.payload
+        path = self.storage.resolve(payload['video_path'])
+        if not path:
+            self.failed += 1
+            self.queue.fail(job, MISSING_VIDEO_ERROR, retry=False)
+            return
+
+        finished = threading.Event()
+        lost = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(job, finished, lost),
+                                     name=f'lease-{job.job_id}', daemon=True)
+        heartbeat.start()
+        try:
+            with log_context(job_id=job.job_id):
+                report = analyze_source(path, is_video_file=True, analyzer=self._load_analyzer(),
+                                        return_report=True, record_timeline=True, display=False,
+                                        **payload.get('options', {}))
+        finally:
+            finished.set()
+            heartbeat.join()
+
+        if lost.is_set():
+            return
+        if report['level'] == 'Error':
+            self.failed += 1
+            self.queue.fail(job, report.get('error', 'Analysis error'))
+        elif not report['samples']:
+            self.failed += 1
+            self.queue.fail(job, NO_FACES_ERROR, retry=False)
+        else:
+            try:
+                result = self._record(job, report)
+            except LeaseLost as e:
+                logger.warning(str(e))
+                return
+            self.processed += 1
+            logger.info(f"Job {job.job_id} done: analysis {result.get('analysis_id')}, "
+                        f"{report['level']} in {report['elapsed_sec']:.1f}s")
+
+    def run(self, max_jobs: int = 0, exit_when_idle: bool = False) -> dict:
+        """Обрабатывает задачи до stop(), max_jobs задач или, при exit_when_idle, пустой очереди"""
+        logger.info(f"Worker {self.worker_id} started")
+        started = time.time()
+        while not self.stop_event.is_set():
+            job = self.queue.claim(self.worker_id, self.lease_sec, kinds=[ANALYSIS_KIND])
+            if job is None:
+                if exit_when_idle:
+                    break
+                self.stop_event.wait(self.poll_interval)
+                continue
+            try:
+                self.process(job)
+            except Exception as e:
+                logger.error(f"Job {job.job_id} failed: {str(e)}", exc_info=True)
+                self.failed += 1
+                self.queue.fail(job, str(e))
+            if max_jobs and self.processed + self.failed >= max_jobs:
+                break
+        logger.info(f"Worker {self.worker_id} stopped: {self.processed} done, {self.failed} failed")
+        return {'worker_id': self.worker_id, 'processed': self.processed, 'failed': self.failed,
+                'wall_sec': round(time.time() - started, 2)}
+
+    def stop(self):
+        """Останавливает воркер после текущей задачи"""
+        self.stop_event.set()
+
+
+def run_worker(db_path: str, video_root: str, queue_url: str = None, model_path: str = None,
+               lease_sec: float = 120.0, exit_when_idle: bool = False, log_file=None) -> dict:
+    """Запускает воркер в текущем процессе; SIGTERM и SIGINT завершают его после текущей задачи"""
+    setup_logging(log_file=log_file)
+    queue = open_work_queue(queue_url, default_db=db_path)
+    worker = AnalysisWorker(queue, db_path, video_root, model_path=model_path, lease_sec=lease_sec)
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *_: worker.stop())
+    return worker.run(exit_when_idle=exit_when_idle)
+
+
+def _worker_process(results, db_path: str, video_root: str, kwargs: dict):
+    results.put(run_worker(db_path, video_root, **kwargs))
+
+
+def run_workers(workers: int, db_path: str, video_root: str, **kwargs) -> list:
+    """Запускает несколько процессов-воркеров на этом хосте и ждет их завершения.
+
+    SIGTERM родителю передается воркерам, и они останавливаются после текущей задачи.
+    """
+    import queue
+    import multiprocessing
+    if workers <= 1:
+        return [run_worker(db_path, video_root, **kwargs)]
+    # spawn: TensorFlow и MediaPipe плохо переносят fork после инициализации
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    processes = [context.Process(target=_worker_process, name=f'analysis-worker-{i}',
+                                 args=(results, db_path, video_root, dict(kwargs, log_file=False)))
+                 for i in range(workers)]
+    for process in processes:
+        process.start()
+    signal.signal(signal.SIGTERM, lambda *_: [process.terminate() for process in processes])
+
+    summaries = []
+    pending = processes
+    while pending:
+        try:
+            summaries.append(results.get(timeout=1))
+        except queue.Empty:
+            pass
+        except KeyboardInterrupt:
+            # SIGINT из терминала получили и воркеры: они завершат текущие задачи
+            continue
+        pending = [process for process in pending if process.is_alive()]
+    while True:
+        try:
+            summaries.append(results.get_nowait())
+        except queue.Empty:
+            break
+    for process in processes:
+        process.join()
+    return summaries
@@ -0,0 +1,145 @@
+
+import time
+import secrets
+import sqlite3
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+from werkzeug.security import generate_password_hash, check_password_hash
+
+REFRESH_TOKEN_TABLE = 'refresh_tokens'
+
+
+class PasswordHasherBusy(Exception):
+    """Слишком много проверок пароля в очереди или от одного пользователя/адреса"""
+
+    def __init__(self, message: str, retry_after: int = 1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class PasswordHasher:
+    """Выполняет хеширование паролей в отдельном ограниченном пуле потоков.
+
+    scrypt/pbkdf2 отпускают GIL, поэтому пул из workers потоков занимает не больше
+    workers ядер, а остальные потоки сервера продолжают обслуживать другие маршруты.
+    Очередь ограничена max_pending, на один логин одновременно допускается не больше
+    per_user_limit проверок, на один IP-адрес - per_ip_limit; лишние запросы сразу отклоняются.
+    """
+
+    def __init__(self, workers: int = 2, max_pending: int = 32, per_user_limit: int = 2,
+                 per_ip_limit: int = 8, timeout: float = 10.0):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hash')
+        self.workers = workers
+        self.max_pending = max_pending
+        self.limits = {'user': per_user_limit, 'ip': per_ip_limit}
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._active_keys = {}
+
+    def _acquire(self, keys: list):
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise PasswordHasherBusy('Too many login attempts in progress, try again later',
+                                         retry_after=max(1, self._pending // max(1, self.workers)))
+            for key in keys:
+                if self._active_keys.get(key, 0) >= self.limits[key[0]]:
+                    raise PasswordHasherBusy('Too many concurrent login attempts')
+            self._pending += 1
+            for key in keys:
+                self._active_keys[key] = self._active_keys.get(key, 0) + 1
+
+    def _release(self, keys: list):
+        with self._lock:
+            self._pending -= 1
+            for key in keys:
+                count = self._active_keys.get(key, 0) - 1
+                if count > 0:
+                    self._active_keys[key] = count
+                else:
+                    self._active_keys.pop(key, None)
+
+    def _run(self, keys: list, fn, *args):
+        keys = [key for key in keys if key[1]]
+        self._acquire(keys)
+        try:
+            future = self.executor.submit(fn, *args)
+        except Exception:
+            self._release(keys)
+            raise
+        # Слот освобождается только когда работа действительно завершилась (или снята
+        # с очереди), иначе после таймаута пул продолжал бы считать её и принимать новые
+        future.add_done_callback(lambda _: self._release(keys))
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            future.cancel()
+            raise PasswordHasherBusy('Password check timed out, try again later')
+
+    def check(self, password_hash: str, password: str, username: str = None, ip: str = None) -> bool:
+        return self._run([('user', username), ('ip', ip)], check_password_hash, password_hash, password)
+
+    def hash(self, password: str, ip: str = None) -> str:
+        return self._run([('ip', ip)], generate_password_hash, password)
+
+
+def ensure_refresh_token_table(conn: sqlite3.Connection):
+    conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS {REFRESH_TOKEN_TABLE} (
+            token_hash TEXT PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            expires_at REAL NOT NULL,
+            created_at REAL NOT NULL
+        )
+    ''')
+    conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{REFRESH_TOKEN_TABLE}_user '
+                 f'ON {REFRESH_TOKEN_TABLE} (user_id)')
+    conn.commit()
+
+
+def _token_hash(token: str) -> str:
+    # Токен случайный и длинный, поэтому достаточно быстрого sha256 - медленный хеш не нужен
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+
+def issue_refresh_token(conn: sqlite3.Connection, user_id: int, ttl: float) -> str:
+    """Создает refresh-токен; в БД хранится только его хеш, коммит выполняет вызывающий код"""
+    token = secrets.token_urlsafe(32)
+    now = time.time()
+    conn.execute(
+        f'INSERT INTO {REFRESH_TOKEN_TABLE} (token_hash, user_id, expires_at, created_at) '
+        f'VALUES (?, ?, ?, ?)',
+        (_token_hash(token), user_id, now + ttl, now)
+    )
+    # Заодно удаляем истекшие токены пользователя
+    conn.execute(f'DELETE FROM {REFRESH_TOKEN_TABLE} WHERE user_id = ? AND expires_at < ?',
+                 (user_id, now))
+    return token
+
+
+def rotate_refresh_token(conn: sqlite3.Connection, token: str, ttl: float):
+    """Погашает refresh-токен и выдает новый.
+
+    Возвращает (user_id, новый токен) или None, если токен неизвестен или истек.
+    Каждый токен одноразовый: повторное использование не пройдет.
+    """
+    token_hash = _token_hash(token)
+    row = conn.execute(f'SELECT user_id, expires_at FROM {REFRESH_TOKEN_TABLE} WHERE token_hash = ?',
+                       (token_hash,)).fetchone()
+    if row is None:
+        return None
+    deleted = conn.execute(f'DELETE FROM {REFRESH_TOKEN_TABLE} WHERE token_hash = ?',
+                           (token_hash,)).rowcount
+    if not deleted or row[1] < time.time():
+        conn.commit()
+        return None
+    new_token = issue_refresh_token(conn, row[0], ttl)
+    conn.commit()
+    return row[0], new_token
+
+
+def revoke_refresh_token(conn: sqlite3.Connection, token: str):
+    conn.execute(f'DELETE FROM {REFRESH_TOKEN_TABLE} WHERE token_hash = ?', (_token_hash(token),))
+    conn.commit()
@@ -1,6 +1,10 @@
 
 import sqlite3
 import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from analysis_backfill import ensure_model_version_column
 
 # Database path setup
 db_path = os.path.join('database.db')
@@ -99,6 +103,10 @@ CREATE TABLE IF NOT EXISTS FatigueAnalysis (
 )
 ''')
 
+# Results of video analyses written by the API, workers and re-analysis backfill;
+# the schema is shared with the application migrations
+ensure_model_version_column(conn)
+
 # Medical Checks table
 cursor.execute('''
 CREATE TABLE IF NOT EXISTS MedicalChecks (
@@ -0,0 +1,458 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+from datetime import datetime, timedelta
+
+logger = logging.getLogger("DutyTime")
+
+DUTY_TABLE = 'duty_periods'
+
+# Скользящие окна налета: (имя, длина в секундах)
+DUTY_WINDOWS = [('24h', 24 * 3600), ('7d', 7 * 24 * 3600), ('28d', 28 * 24 * 3600)]
+
+# Пределы по умолчанию, часы (порядок величин как в типовых FTL: 60 ч за 7 дней,
+# 100 ч налета за 28 дней); переопределяются DUTY_LIMIT_24H, DUTY_LIMIT_7D, DUTY_LIMIT_28D
+DEFAULT_DUTY_LIMITS = {'24h': 13.0, '7d': 60.0, '28d': 100.0}
+
+# Рейсы длиннее считаются ошибкой данных и в индекс не попадают: на этом
+# ограничении держатся диапазонные выборки по времени начала
+MAX_PERIOD_SEC = 48 * 3600
+
+# Время вылета и прилета в секундах - так же, как его считает CalculateFlightDuration
+_START = "CAST(strftime('%s', {row}.departure_time) AS INTEGER)"
+_END = "CAST(strftime('%s', {row}.arrival_time) AS INTEGER)"
+
+
+def duty_limits_from_env() -> dict:
+    return {name: float(os.environ.get(f'DUTY_LIMIT_{name.upper()}', DEFAULT_DUTY_LIMITS[name]))
+            for name, _ in DUTY_WINDOWS}
+
+
+def _periods_select(flight: str, member: str, source: str, condition: str) -> str:
+    """SELECT строк индекса для пар рейс - член экипажа; отмененные и некорректные рейсы пропускаются"""
+    start, end = _START.format(row=flight), _END.format(row=flight)
+    return f'''
+        SELECT {member}.employee_id, {start}, {flight}.flight_id, {end}
+        FROM {source}
+        WHERE {condition}
+          AND COALESCE({flight}.status, '') != 'cancelled'
+          AND {end} - {start} BETWEEN 1 AND {MAX_PERIOD_SEC}'''
+
+
+# Триггеры индекса: (имя, событие, условие WHEN, тело)
+DUTY_TRIGGERS = [
+    ('duty_flights_insert', 'AFTER INSERT ON Flights', None, f'''
+        INSERT OR IGNORE INTO {DUTY_TABLE} (employee_id, start_ts, flight_id, end_ts)
+        {_periods_select('NEW', 'm', 'CrewMembers m', 'm.crew_id = NEW.crew_id')};
+    '''),
+    ('duty_flights_update', 'AFTER UPDATE OF departure_time, arrival_time, crew_id, status ON Flights',
+     'OLD.departure_time IS NOT NEW.departure_time OR OLD.arrival_time IS NOT NEW.arrival_time '
+     'OR OLD.crew_id IS NOT NEW.crew_id OR OLD.status IS NOT NEW.status', f'''
+        DELETE FROM {DUTY_TABLE} WHERE flight_id = OLD.flight_id;
+        INSERT OR IGNORE INTO {DUTY_TABLE} (employee_id, start_ts, flight_id, end_ts)
+        {_periods_select('NEW', 'm', 'CrewMembers m', 'm.crew_id = NEW.crew_id')};
+    '''),
+    ('duty_flights_delete', 'AFTER DELETE ON Flights', None, f'''
+        DELETE FROM {DUTY_TABLE} WHERE flight_id = OLD.flight_id;
+    '''),
+    ('duty_crew_members_insert', 'AFTER INSERT ON CrewMembers', None, f'''
+        INSERT OR IGNORE INTO {DUTY_TABLE} (employee_id, start_ts, flight_id, end_ts)
+        {_periods_select('f', 'NEW', 'Flights f', 'f.crew_id = NEW.crew_id')};
+    '''),
+    ('duty_crew_members_delete', 'AFTER DELETE ON CrewMembers', None, f'''
+        DELETE FROM {DUTY_TABLE} WHERE employee_id = OLD.employee_id
+            AND flight_id IN (SELECT flight_id FROM Flights WHERE crew_id = OLD.crew_id);
+    '''),
+    ('duty_crew_members_update', 'AFTER UPDATE OF crew_id, employee_id ON CrewMembers',
+     'OLD.crew_id IS NOT NEW.crew_id OR OLD.employee_id IS NOT NEW.employee_id', f'''
+        DELETE FROM {DUTY_TABLE} WHERE employee_id = OLD.employee_id
+            AND flight_id IN (SELECT flight_id FROM Flights WHERE crew_id = OLD.crew_id);
+        INSERT OR IGNORE INTO {DUTY_TABLE} (employee_id, start_ts, flight_id, end_ts)
+        {_periods_select('f', 'NEW', 'Flights f', 'f.crew_id = NEW.crew_id')};
+    '''),
+    # Накопленный налет до начала каждого периода: вставка и удаление сдвигают
+    # только более поздние периоды того же сотрудника (обычно это несколько
+    # запланированных рейсов), новый период берет сумму у предыдущего
+    ('duty_periods_insert', f'AFTER INSERT ON {DUTY_TABLE}', None, f'''
+        UPDATE {DUTY_TABLE} SET cum_before = COALESCE((
+            SELECT p.cum_before + p.end_ts - p.start_ts FROM {DUTY_TABLE} p
+            WHERE p.employee_id = NEW.employee_id AND (p.start_ts, p.flight_id) < (NEW.start_ts, NEW.flight_id)
+            ORDER BY p.start_ts DESC, p.flight_id DESC LIMIT 1), 0)
+        WHERE employee_id = NEW.employee_id AND start_ts = NEW.start_ts AND flight_id = NEW.flight_id;
+        UPDATE {DUTY_TABLE} SET cum_before = cum_before + (NEW.end_ts - NEW.start_ts)
+        WHERE employee_id = NEW.employee_id AND (start_ts, flight_id) > (NEW.start_ts, NEW.flight_id);
+    '''),
+    ('duty_periods_delete', f'AFTER DELETE ON {DUTY_TABLE}', None, f'''
+        UPDATE {DUTY_TABLE} SET cum_before = cum_before - (OLD.end_ts - OLD.start_ts)
+        WHERE employee_id = OLD.employee_id AND (start_ts, flight_id) > (OLD.start_ts, OLD.flight_id);
+    '''),
+]
+
+
+def ensure_duty_time_schema(conn: sqlite3.Connection):
+    """Создает индекс налета duty_periods и триггеры, которые поддерживают его.
+
+    Индекс - строка на каждую пару (член экипажа, неотмененный рейс экипажа) с
+    временем начала и конца в секундах и накопленным налетом сотрудника до
+    начала периода. Налет за любое окно считается разностью двух накопленных
+    значений, то есть двумя поисками по индексу. Триггеры на Flights и
+    CrewMembers обновляют индекс в той же транзакции, что и запись; пересчет
+    duration при изменении времени рейса дополняет CalculateFlightDuration.
+    Новый индекс заполняется существующими рейсами. Периоды одного сотрудника
+    считаются непересекающимися: при двойном назначении суммы в окнах,
+    захватывающих пересечение, приблизительны.
+    """
+    tables = {row[0].lower() for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    if 'flights' not in tables or 'crewmembers' not in tables:
+        return
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_flights_crew ON Flights (crew_id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_flights_departure ON Flights (departure_time)')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS RecalculateFlightDuration
+        AFTER UPDATE OF departure_time, arrival_time ON Flights
+        BEGIN
+            UPDATE Flights
+            SET duration = CAST(
+                (strftime('%s', NEW.arrival_time) - strftime('%s', NEW.departure_time)) / 60
+                AS INTEGER)
+            WHERE flight_id = NEW.flight_id;
+        END
+    ''')
+    created = DUTY_TABLE not in tables
+    conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS {DUTY_TABLE} (
+            employee_id INTEGER NOT NULL,
+            start_ts INTEGER NOT NULL,
+            flight_id INTEGER NOT NULL,
+            end_ts INTEGER NOT NULL,
+            cum_before INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (employee_id, start_ts, flight_id)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{DUTY_TABLE}_flight ON {DUTY_TABLE} (flight_id)')
+    for name, event, condition, body in DUTY_TRIGGERS:
+        when = f'WHEN {condition}' if condition else ''
+        conn.execute(f'CREATE TRIGGER IF NOT EXISTS {name} {event} {when} BEGIN {body} END')
+    if created:
+        # Периоды вставляются по порядку времени: триггер не сдвигает ни одной строки
+        conn.execute(f'''
+            INSERT OR IGNORE INTO {DUTY_TABLE} (employee_id, start_ts, flight_id, end_ts)
+            {_periods_select('f', 'm', 'Flights f JOIN CrewMembers m ON m.crew_id = f.crew_id',
+                             'f.crew_id IS NOT NULL')}
+            ORDER BY m.employee_id, 2, f.flight_id
+        ''')
+        count = conn.execute(f'SELECT COUNT(*) FROM {DUTY_TABLE}').fetchone()[0]
+        logger.info(f"Duty time index built: {count} periods")
+    conn.commit()
+
+
+def rebuild_duty_index(conn: sqlite3.Connection):
+    """Пересоздает индекс с нуля (после массовой правки данных в обход триггеров)"""
+    # DROP вместо DELETE: построчное удаление сдвигало бы накопленные суммы
+    conn.execute(f'DROP TABLE IF EXISTS {DUTY_TABLE}')
+    conn.commit()
+    ensure_duty_time_schema(conn)
+
+
+def _duty_until(employee: str, moment: str) -> str:
+    """SQL-выражение: налет сотрудника в секундах от начала истории до момента moment"""
+    return f'''COALESCE((
+        SELECT p.cum_before + MIN(MAX({moment} - p.start_ts, 0), p.end_ts - p.start_ts)
+        FROM {DUTY_TABLE} p WHERE p.employee_id = {employee} AND p.start_ts <= {moment}
+        ORDER BY p.start_ts DESC, p.flight_id DESC LIMIT 1), 0)'''
+
+
+# Налет в окне [t - span, t] для каждого окна, которое содержит рассматриваемый
+# рейс: t пробегает прилет рейса, концы более поздних периодов сотрудника и
+# последний момент, когда окно еще содержит вылет. Максимум суммы по окну
+# достигается в одной из этих точек. Если сотрудник еще не назначен на рейс,
+# к сумме добавляется пересечение рейса с окном.
+DUTY_RISK_QUERY = f'''
+    WITH windows(name, span, limit_sec) AS (VALUES {', '.join('(?, ?, ?)' for _ in DUTY_WINDOWS)}),
+    window_flights AS (
+        SELECT flight_id, flight_number, crew_id, departure_time, arrival_time,
+               {_START.format(row='Flights')} AS dep, {_END.format(row='Flights')} AS arr
+        FROM Flights
+        WHERE departure_time >= ? AND departure_time < ? AND COALESCE(status, '') != 'cancelled'
+    ),
+    candidates AS (
+        SELECT f.flight_id, f.dep, f.arr, c.employee_id,
+               EXISTS(SELECT 1 FROM {DUTY_TABLE} p WHERE p.employee_id = c.employee_id
+                      AND p.start_ts = f.dep AND p.flight_id = f.flight_id) AS assigned
+        FROM window_flights f {{candidates}}
+        WHERE f.arr - f.dep BETWEEN 1 AND {MAX_PERIOD_SEC}
+    ),
+    points AS (
+        SELECT c.*, w.name, w.span, w.limit_sec, c.arr AS t FROM candidates c, windows w
+        UNION ALL
+        SELECT c.*, w.name, w.span, w.limit_sec, c.dep + w.span FROM candidates c, windows w
+        UNION ALL
+        SELECT c.*, w.name, w.span, w.limit_sec, p.end_ts
+        FROM candidates c JOIN windows w
+        JOIN {DUTY_TABLE} p ON p.employee_id = c.employee_id
+             AND p.start_ts > c.arr - {MAX_PERIOD_SEC} AND p.start_ts < c.dep + w.span
+        WHERE p.end_ts > c.arr AND p.end_ts < c.dep + w.span
+    ),
+    totals AS (
+        SELECT pt.flight_id, pt.employee_id, pt.assigned, pt.name, pt.limit_sec,
+               {_duty_until('pt.employee_id', 'pt.t')} - {_duty_until('pt.employee_id', 'pt.t - pt.span')}
+               + CASE WHEN pt.assigned THEN 0
+                      ELSE MAX(0, MIN(pt.arr, pt.t) - MAX(pt.dep, pt.t - pt.span)) END AS duty
+        FROM points pt
+    )
+    SELECT t.flight_id, f.flight_number, f.crew_id, f.departure_time, f.arrival_time,
+           t.employee_id, t.assigned, t.name, t.limit_sec, MAX(t.duty) AS duty
+    FROM totals t JOIN window_flights f ON f.flight_id = t.flight_id
+    GROUP BY t.flight_id, t.employee_id, t.name
+    ORDER BY f.departure_time, t.flight_id, t.employee_id
+'''
+
+# Кандидаты - текущий экипаж рейса или заданный список сотрудников для каждого рейса окна
+CREW_CANDIDATES = 'JOIN CrewMembers c ON c.crew_id = f.crew_id'
+LIST_CANDIDATES = 'JOIN (SELECT DISTINCT CAST(value AS INTEGER) AS employee_id FROM json_each(?)) c'
+
+
+def duty_risks(conn: sqlite3.Connection, start: datetime, end: datetime, employee_ids=None,
+               limits: dict = None, include_ok: bool = False) -> dict:
+    """Кто превысит пределы налета, если будет назначен на рейс с вылетом в [start, end).
+
+    Без employee_ids проверяется текущий экипаж каждого рейса, со списком -
+    каждый сотрудник списка на каждом рейсе окна. Налет считается по всем
+    скользящим окнам 24 ч / 7 дн / 28 дн, которые содержат рейс, включая
+    уже запланированные после него рейсы. Весь ответ - один запрос.
+    """
+    limits = dict(DEFAULT_DUTY_LIMITS, **(limits or {}))
+    params = []
+    for name, span in DUTY_WINDOWS:
+        params.extend((name, span, round(limits[name] * 3600)))
+    params.extend((start.strftime('%Y-%m-%dT%H:%M:%S'), end.strftime('%Y-%m-%dT%H:%M:%S')))
+    if employee_ids is None:
+        query = DUTY_RISK_QUERY.format(candidates=CREW_CANDIDATES)
+    else:
+        query = DUTY_RISK_QUERY.format(candidates=LIST_CANDIDATES)
+        params.append(json.dumps([int(employee_id) for employee_id in employee_ids]))
+
+    candidates = {}
+    for (flight_id, flight_number, crew_id, departure, arrival, employee_id, assigned,
+         name, limit_sec, duty) in conn.execute(query, params):
+        entry = candidates.setdefault((flight_id, employee_id), {
+            'flight_id': flight_id, 'flight_number': flight_number, 'crew_id': crew_id,
+            'departure_time': departure, 'arrival_time': arrival, 'employee_id': employee_id,
+            'assigned': bool(assigned), 'duty_hours': {}, 'exceeded': []})
+        entry['duty_hours'][name] = round(duty / 3600, 2)
+        if duty > limit_sec:
+            entry['exceeded'].append(name)
+    for entry in candidates.values():
+        entry['duty_hours'] = {name: entry['duty_hours'][name] for name, _ in DUTY_WINDOWS}
+    return {
+        'limits_hours': limits,
+        'candidates': len(candidates),
+        'risks': [entry for entry in candidates.values() if include_ok or entry['exceeded']],
+    }
+
+
+NAIVE_RISK_QUERY = '''
+    SELECT COALESCE(SUM(MAX(0, MIN(CAST(strftime('%s', f.arrival_time) AS INTEGER), ?)
+                            - MAX(CAST(strftime('%s', f.departure_time) AS INTEGER), ?))), 0)
+    FROM Flights f JOIN CrewMembers m ON m.crew_id = f.crew_id
+    WHERE m.employee_id = ? AND COALESCE(f.status, '') != 'cancelled' AND f.flight_id != ?
+'''
+
+
+def naive_duty_risks(conn: sqlite3.Connection, start: datetime, end: datetime, employee_ids=None,
+                     limits: dict = None) -> dict:
+    """Та же проверка без индекса: пересчет по Flights для каждой точки каждого окна (для сверки)"""
+    limits = dict(DEFAULT_DUTY_LIMITS, **(limits or {}))
+    to_ts = lambda value: int((datetime.fromisoformat(value) - datetime(1970, 1, 1)).total_seconds())
+    flights = conn.execute('''
+        SELECT flight_id, crew_id, departure_time, arrival_time FROM Flights
+        WHERE departure_time >= ? AND departure_time < ? AND COALESCE(status, '') != 'cancelled'
+    ''', (start.strftime('%Y-%m-%dT%H:%M:%S'), end.strftime('%Y-%m-%dT%H:%M:%S'))).fetchall()
+    result = {}
+    for flight_id, crew_id, departure, arrival in flights:
+        dep, arr = to_ts(departure), to_ts(arrival)
+        if not 0 < arr - dep <= MAX_PERIOD_SEC:
+            continue
+        if employee_ids is None:
+            members = [row[0] for row in conn.execute(
+                'SELECT employee_id FROM CrewMembers WHERE crew_id = ?', (crew_id,))]
+        else:
+            members = sorted(set(employee_ids))
+        for employee_id in members:
+            ends = [to_ts(row[0]) for row in conn.execute('''
+                SELECT f.arrival_time FROM Flights f JOIN CrewMembers m ON m.crew_id = f.crew_id
+                WHERE m.employee_id = ? AND COALESCE(f.status, '') != 'cancelled'
+            ''', (employee_id,))]
+            hours = {}
+            for name, span in DUTY_WINDOWS:
+                points = [arr, dep + span] + [t for t in ends if arr < t < dep + span]
+                hours[name] = max(
+                    conn.execute(NAIVE_RISK_QUERY, (t, t - span, employee_id, flight_id)).fetchone()[0]
+                    + max(0, min(arr, t) - max(dep, t - span)) for t in points) / 3600
+            result[(flight_id, employee_id)] = {
+                name: round(value, 2) for name, value in hours.items()}
+    return result
+
+
+def benchmark(years: int = 3, crews: int = 60, crew_size: int = 4, window_hours: float = 24.0,
+              queries: int = 20, path: str = None) -> dict:
+    """Синтетическое расписание за несколько лет: построение индекса, обновления и запросы окна"""
+    import random
+    import tempfile
+    import statistics
+
+    rng = random.Random(1)
+    workdir = tempfile.mkdtemp(prefix='duty-time-')
+    path = path or os.path.join(workdir, 'duty.db')
+    conn = sqlite3.connect(path)
+    conn.executescript('''
+        CREATE TABLE CrewMembers (crew_id INTEGER, employee_id INTEGER, role TEXT NOT NULL,
+            join_date TEXT DEFAULT CURRENT_TIMESTAMP, PRIMARY KEY (crew_id, employee_id));
+        CREATE TABLE Flights (flight_id INTEGER PRIMARY KEY AUTOINCREMENT, crew_id INTEGER,
+            flight_number TEXT, departure_time TEXT NOT NULL, arrival_time TEXT NOT NULL,
+            duration INTEGER, status TEXT DEFAULT 'scheduled');
+        CREATE TRIGGER CalculateFlightDuration AFTER INSERT ON Flights
+        BEGIN
+            UPDATE Flights SET duration = CAST(
+                (strftime('%s', arrival_time) - strftime('%s', departure_time)) / 60 AS INTEGER)
+            WHERE flight_id = NEW.flight_id;
+        END;
+    ''')
+    conn.executemany('INSERT INTO CrewMembers (crew_id, employee_id, role) VALUES (?, ?, ?)',
+                     [(crew, crew * crew_size + i, 'pilot' if i < 2 else 'cabin')
+                      for crew in range(1, crews + 1) for i in range(crew_size)])
+
+    # Экипаж летает 1-4 рейса в рабочий день по 45-180 минут с перерывами; доля
+    # рабочих дней у экипажей разная, так что часть из них подходит к пределам
+    first_day = datetime(2030, 1, 1) - timedelta(days=365 * years)
+    flights = []
+    for crew in range(1, crews + 1):
+        workload = rng.uniform(0.5, 0.9)
+        for day in range(365 * years):
+            if rng.random() > workload:
+                continue
+            moment = first_day + timedelta(days=day, hours=rng.randint(5, 9))
+            for leg in range(rng.randint(1, 4)):
+                length = timedelta(minutes=rng.randint(45, 180))
+                status = 'cancelled' if rng.random() < 0.02 else 'completed'
+                flights.append((crew, f'SU{rng.randint(100, 9999)}', moment.strftime('%Y-%m-%dT%H:%M:%S'),
+                                (moment + length).strftime('%Y-%m-%dT%H:%M:%S'), status))
+                moment += length + timedelta(minutes=rng.randint(40, 120))
+    flights.sort(key=lambda flight: flight[2])
+    conn.executemany('INSERT INTO Flights (crew_id, flight_number, departure_time, arrival_time, status) '
+                     'VALUES (?, ?, ?, ?, ?)', flights)
+    conn.commit()
+
+    started = time.perf_counter()
+    ensure_duty_time_schema(conn)
+    build_sec = time.perf_counter() - started
+    periods = conn.execute(f'SELECT COUNT(*) FROM {DUTY_TABLE}').fetchone()[0]
+
+    # Изменения расписания в последний месяц: вставка, перенос и отмена рейса
+    last_day = first_day + timedelta(days=365 * years)
+    update_ms = {'insert': [], 'reschedule': [], 'cancel': []}
+    for _ in range(queries):
+        crew = rng.randint(1, crews)
+        moment = last_day - timedelta(days=rng.randint(1, 28), hours=rng.randint(0, 12))
+        start = time.perf_counter()
+        cursor = conn.execute(
+            'INSERT INTO Flights (crew_id, flight_number, departure_time, arrival_time) VALUES (?, ?, ?, ?)',
+            (crew, 'SU1', moment.strftime('%Y-%m-%dT%H:%M:%S'),
+             (moment + timedelta(hours=2)).strftime('%Y-%m-%dT%H:%M:%S')))
+        conn.commit()
+        update_ms['insert'].append((time.perf_counter() - start) * 1000)
+        flight_id = cursor.lastrowid
+        start = time.perf_counter()
+        conn.execute('UPDATE Flights SET departure_time = ?, arrival_time = ? WHERE flight_id = ?',
+                     ((moment + timedelta(hours=1)).strftime('%Y-%m-%dT%H:%M:%S'),
+                      (moment + timedelta(hours=4)).strftime('%Y-%m-%dT%H:%M:%S'), flight_id))
+        conn.commit()
+        update_ms['reschedule'].append((time.perf_counter() - start) * 1000)
+        start = time.perf_counter()
+        conn.execute("UPDATE Flights SET status = 'cancelled' WHERE flight_id = ?", (flight_id,))
+        conn.commit()
+        update_ms['cancel'].append((time.perf_counter() - start) * 1000)
+
+    def timed(function, repeat: int) -> dict:
+        samples = []
+        value = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            value = function()
+            samples.append((time.perf_counter() - start) * 1000)
+        return {'p50_ms': round(statistics.median(samples), 2), 'max_ms': round(max(samples), 2), 'value': value}
+
+    window_start = last_day - timedelta(days=14)
+    window_end = window_start + timedelta(hours=window_hours)
+    pool = list(range(crew_size, crew_size * (crews + 1)))[:50]
+    crew_check = timed(lambda: duty_risks(conn, window_start, window_end), queries)
+    pool_check = timed(lambda: duty_risks(conn, window_start, window_end, employee_ids=pool),
+                       max(1, queries // 4))
+    naive_check = timed(lambda: naive_duty_risks(conn, window_start, window_end), 1)
+
+    indexed = {(entry['flight_id'], entry['employee_id']): entry['duty_hours']
+               for entry in duty_risks(conn, window_start, window_end, include_ok=True)['risks']}
+    mismatches = sum(1 for key, hours in naive_check['value'].items()
+                     if any(abs(hours[name] - indexed.get(key, {}).get(name, -1)) > 0.01 for name in hours))
+    report = {
+        'years': years, 'crews': crews, 'employees': crews * crew_size,
+        'flights': len(flights), 'duty_periods': periods,
+        'index_build_sec': round(build_sec, 2),
+        'db_mb': round(os.path.getsize(path) / 1024 / 1024, 1),
+        'update_p50_ms': {kind: round(statistics.median(samples), 2) for kind, samples in update_ms.items()},
+        'window_hours': window_hours,
+        'crew_check': {'candidates': crew_check['value']['candidates'],
+                       'at_risk': len(crew_check['value']['risks']),
+                       'p50_ms': crew_check['p50_ms'], 'max_ms': crew_check['max_ms']},
+        'pool_check': {'candidates': pool_check['value']['candidates'],
+                       'at_risk': len(pool_check['value']['risks']),
+                       'p50_ms': pool_check['p50_ms'], 'max_ms': pool_check['max_ms']},
+        'naive_crew_check_ms': naive_check['p50_ms'],
+        'naive_mismatches': mismatches,
+    }
+    conn.close()
+    os.remove(path)
+    os.rmdir(workdir)
+    return report
+
+
+if __name__ == '__main__':
+    import argparse
+    from neural_network.logging_setup import setup_logging
+
+    parser = argparse.ArgumentParser(description='Rolling duty time index for crew fatigue risk')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    rebuild_parser = subparsers.add_parser('rebuild', help='Rebuild the duty time index from Flights')
+    rebuild_parser.add_argument('--db', default='database/database.db')
+    check_parser = subparsers.add_parser('check', help='List crew members over duty limits in a window')
+    check_parser.add_argument('--db', default='database/database.db')
+    check_parser.add_argument('--from', dest='start', default=None, help='Window start, ISO format (default now)')
+    check_parser.add_argument('--hours', type=float, default=24.0)
+    check_parser.add_argument('--employees', default='', help='Comma-separated employee ids to check on every flight')
+    benchmark_parser = subparsers.add_parser('benchmark', help='Measure on a synthetic multi-year schedule')
+    benchmark_parser.add_argument('--years', type=int, default=3)
+    benchmark_parser.add_argument('--crews', type=int, default=60)
+    benchmark_parser.add_argument('--window-hours', type=float, default=24.0)
+    benchmark_parser.add_argument('--queries', type=int, default=20)
+    args = parser.parse_args()
+
+    setup_logging(log_file=False)
+    if args.command == 'rebuild':
+        connection = sqlite3.connect(args.db)
+        rebuild_duty_index(connection)
+        connection.close()
+        print(f"Duty time index rebuilt in {args.db}")
+    elif args.command == 'check':
+        connection = sqlite3.connect(args.db)
+        ensure_duty_time_schema(connection)
+        window_start = datetime.fromisoformat(args.start) if args.start else datetime.now()
+        employees = [int(value) for value in args.employees.split(',') if value] or None
+        print(json.dumps(duty_risks(connection, window_start, window_start + timedelta(hours=args.hours),
+                                    employee_ids=employees, limits=duty_limits_from_env()),
+                         indent=2, ensure_ascii=False))
+        connection.close()
+    else:
+        print(json.dumps(benchmark(args.years, args.crews, window_hours=args.window_hours,
+                                   queries=args.queries), indent=2))
@@ -0,0 +1,292 @@
+
+"""Раздача собранного фронтенда (dist/ после `npm run build`) из Flask.
+
+    python frontend_assets.py compress --dist dist
+    python frontend_assets.py measure --url http://localhost:5000/
+
+compress создает рядом с файлами сборки варианты .gz и .br (brotli - если
+установлен пакет Brotli); measure измеряет первую загрузку страницы: число
+запросов, переданные байты и время.
+"""
+import os
+import re
+import gzip
+import json
+import time
+import logging
+import argparse
+import mimetypes
+import posixpath
+import http.client
+from html.parser import HTMLParser
+from pathlib import Path
+from urllib.parse import urljoin, urlparse
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger("FrontendAssets")
+
+# Форматы, которые имеет смысл сжимать; картинки и шрифты уже сжаты
+COMPRESSIBLE = ('.html', '.js', '.mjs', '.css', '.svg', '.json', '.map', '.txt', '.xml',
+                '.ico', '.webmanifest')
+# Вариант сохраняется, только если он заметно меньше исходного файла
+MIN_SIZE = 1024
+MIN_SAVING = 0.9
+
+# Vite кладет файлы с хешем содержимого в имени в assets/: их можно кэшировать навсегда
+HASHED_DIR = 'assets'
+IMMUTABLE_CACHE = 'public, max-age=31536000, immutable'
+# index.html всегда перепроверяется, иначе браузер не узнает о новой сборке
+INDEX_CACHE = 'no-cache'
+DEFAULT_CACHE = 'public, max-age=3600'
+
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+def _compress(data: bytes, encoding: str) -> bytes:
+    if encoding == 'br':
+        return brotli.compress(data, quality=11)
+    # mtime=0: одинаковая сборка дает одинаковые файлы и ETag
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+
+def precompress(dist_dir: str, min_size: int = MIN_SIZE) -> dict:
+    """Создает .gz и .br варианты файлов сборки; актуальные варианты не пересоздаются"""
+    stats = {'files': 0, 'compressed': 0, 'up_to_date': 0, 'raw_bytes': 0,
+             'gzip_bytes': 0, 'br_bytes': 0, 'brotli': brotli is not None}
+    encodings = [(name, suffix) for name, suffix in ENCODINGS if name != 'br' or brotli is not None]
+    for path in sorted(Path(dist_dir).rglob('*')):
+        if not path.is_file() or path.suffix.lower() not in COMPRESSIBLE:
+            continue
+        size = path.stat().st_size
+        stats['files'] += 1
+        stats['raw_bytes'] += size
+        data = None
+        for name, suffix in encodings:
+            variant = path.with_name(path.name + suffix)
+            if variant.exists() and variant.stat().st_mtime >= path.stat().st_mtime:
+                stats['up_to_date'] += 1
+                stats[f'{name}_bytes'] += variant.stat().st_size
+                continue
+            if size < min_size:
+                continue
+            if data is None:
+                data = path.read_bytes()
+            compressed = _compress(data, name)
+            if len(compressed) > size * MIN_SAVING:
+                variant.unlink(missing_ok=True)
+                continue
+            tmp_path = variant.with_name(variant.name + '.tmp')
+            tmp_path.write_bytes(compressed)
+            os.replace(tmp_path, variant)
+            stats['compressed'] += 1
+            stats[f'{name}_bytes'] += len(compressed)
+    logger.info(f"Precompressed {dist_dir}: {stats['compressed']} variants written, "
+                f"{stats['up_to_date']} up to date")
+    return stats
+
+
+class FrontendAssets:
+    """Индекс файлов сборки с их сжатыми вариантами.
+
+    Сборка индексируется один раз при запуске: отдаются только известные
+    файлы, поэтому путь из запроса не может выйти за пределы dist. Для
+    каждого файла выбирается лучший вариант по Accept-Encoding (br, затем
+    gzip), файлы из assets/ получают immutable-кэширование, index.html -
+    перепроверку. Пути без расширения, которых нет в сборке, - маршруты
+    клиентского роутера: на них отдается index.html.
+    """
+
+    def __init__(self, dist_dir: str):
+        self.root = Path(dist_dir).resolve()
+        if not (self.root / 'index.html').is_file():
+            raise FileNotFoundError(f"Frontend build not found: {self.root / 'index.html'} "
+                                    f"(run `npm run build`)")
+        self.files = {}
+        variant_suffixes = tuple(suffix for _, suffix in ENCODINGS)
+        for path in self.root.rglob('*'):
+            if not path.is_file() or path.name.endswith(variant_suffixes + ('.tmp',)):
+                continue
+            relative = path.relative_to(self.root).as_posix()
+            variants = {name: path.with_name(path.name + suffix) for name, suffix in ENCODINGS
+                        if path.with_name(path.name + suffix).is_file()}
+            self.files[relative] = {'path': path, 'variants': variants,
+                                    'mimetype': mimetypes.guess_type(path.name)[0] or 'application/octet-stream'}
+        logger.info(f"Serving frontend from {self.root}: {len(self.files)} files")
+
+    def cache_control(self, relative: str) -> str:
+        if relative == 'index.html':
+            return INDEX_CACHE
+        if relative.startswith(HASHED_DIR + '/'):
+            return IMMUTABLE_CACHE
+        return DEFAULT_CACHE
+
+    def resolve(self, path: str):
+        """Файл сборки для пути запроса; None - 404"""
+        relative = posixpath.normpath(path).lstrip('/') if path else 'index.html'
+        if relative in self.files:
+            return relative
+        # Отсутствующий файл не подменяется index.html: браузер получил бы HTML вместо скрипта
+        if relative.startswith('api/') or '.' in posixpath.basename(relative):
+            return None
+        return 'index.html'
+
+    def send(self, relative: str, accept_encodings):
+        from flask import send_file
+        entry = self.files[relative]
+        path, encoding = entry['path'], None
+        for name, _ in ENCODINGS:
+            if name in entry['variants'] and accept_encodings[name]:
+                path, encoding = entry['variants'][name], name
+                break
+        response = send_file(path, mimetype=entry['mimetype'], conditional=True, etag=True)
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        if entry['variants']:
+            response.vary.add('Accept-Encoding')
+        response.headers['Cache-Control'] = self.cache_control(relative)
+        return response
+
+
+def register_frontend(app, dist_dir: str) -> FrontendAssets:
+    """Подключает раздачу сборки фронтенда к приложению Flask (маршруты / и /<path>)"""
+    from flask import request, abort
+    assets = FrontendAssets(dist_dir)
+
+    def frontend(path=''):
+        relative = assets.resolve(path)
+        if relative is None:
+            abort(404)
+        return assets.send(relative, request.accept_encodings)
+
+    app.add_url_rule('/', 'frontend', frontend)
+    app.add_url_rule('/<path:path>', 'frontend_path', frontend)
+    return assets
+
+
+class _AssetParser(HTMLParser):
+    def __init__(self):
+        super().__init__()
+        self.urls = []
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == 'script' and attrs.get('src'):
+            self.urls.append(attrs['src'])
+        elif tag == 'link' and attrs.get('href') and \
+                set((attrs.get('rel') or '').split()) & {'stylesheet', 'modulepreload', 'icon', 'preload'}:
+            self.urls.append(attrs['href'])
+
+
+def _module_imports(source: str) -> list:
+    # Статические и динамические импорты модулей; в сборке это чанки, на dev-сервере - исходники
+    pattern = re.compile(r'''(?:\bimport\s*\(?|\bfrom)\s*["']((?:\.{1,2})?/[^"'\s]+)["']''')
+    return pattern.findall(source)
+
+
+def _decode(body: bytes, encoding: str) -> bytes:
+    if encoding == 'gzip':
+        return gzip.decompress(body)
+    if encoding == 'br' and brotli is not None:
+        return brotli.decompress(body)
+    return body
+
+
+def measure_first_load(url: str, accept_encoding: str = 'br, gzip', bandwidth_mbps: float = 10.0,
+                       rtt_ms: float = 50.0, follow_imports: bool = True) -> dict:
+    """Загружает страницу как браузер с пустым кэшем: HTML, скрипты, стили и импорты модулей.
+
+    Кроме измеренного времени, возвращается оценка для канала bandwidth_mbps с
+    задержкой rtt_ms (запросы одного уровня вложенности идут параллельно) и
+    число запросов повторного визита - файлы без immutable кэширования.
+    """
+    origin = urlparse(url)
+    connection_class = http.client.HTTPSConnection if origin.scheme == 'https' else http.client.HTTPConnection
+    conn = connection_class(origin.netloc, timeout=30)
+    resources = []
+    started = time.perf_counter()
+
+    def fetch(resource_url: str):
+        parsed = urlparse(resource_url)
+        target = parsed.path + (f'?{parsed.query}' if parsed.query else '')
+        request_started = time.perf_counter()
+        conn.request('GET', target, headers={'Accept-Encoding': accept_encoding})
+        response = conn.getresponse()
+        body = response.read()
+        encoding = response.getheader('Content-Encoding')
+        resources.append({
+            'path': target, 'status': response.status, 'encoding': encoding,
+            'bytes': len(body), 'cache_control': response.getheader('Cache-Control'),
+            'ms': round((time.perf_counter() - request_started) * 1000, 1)})
+        return response, _decode(body, encoding)
+
+    try:
+        response, html = fetch(url)
+        if response.status != 200:
+            raise ValueError(f"Page {url} returned {response.status}")
+        parser = _AssetParser()
+        parser.feed(html.decode('utf-8', errors='replace'))
+        seen = {urlparse(url).path}
+        level = [urljoin(url, link) for link in parser.urls]
+        depth = 1
+        while level:
+            next_level = []
+            for resource_url in level:
+                if urlparse(resource_url).netloc != origin.netloc or urlparse(resource_url).path in seen:
+                    continue
+                seen.add(urlparse(resource_url).path)
+                response, body = fetch(resource_url)
+                content_type = response.getheader('Content-Type') or ''
+                if follow_imports and response.status == 200 and 'javascript' in content_type:
+                    next_level.extend(urljoin(resource_url, module)
+                                      for module in _module_imports(body.decode('utf-8', errors='replace')))
+            if next_level:
+                depth += 1
+            level = next_level
+    finally:
+        conn.close()
+
+    transferred = sum(resource['bytes'] for resource in resources)
+    return {
+        'url': url, 'accept_encoding': accept_encoding,
+        'requests': len(resources), 'transferred_bytes': transferred,
+        'elapsed_ms': round((time.perf_counter() - started) * 1000, 1),
+        'depth': depth,
+        'estimated_ms': round(transferred * 8 / (bandwidth_mbps * 1e6) * 1000 + (depth + 1) * rtt_ms, 1),
+        'bandwidth_mbps': bandwidth_mbps, 'rtt_ms': rtt_ms,
+        'repeat_visit_requests': sum(1 for resource in resources
+                                     if 'immutable' not in (resource['cache_control'] or '')),
+        'errors': [resource['path'] for resource in resources if resource['status'] >= 400],
+        'resources': resources,
+    }
+
+
+if __name__ == '__main__':
+    from neural_network.logging_setup import setup_logging
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    compress_parser = subparsers.add_parser('compress', help='Write .gz/.br variants of the build')
+    compress_parser.add_argument('--dist', default=os.environ.get('FRONTEND_DIST') or 'dist')
+    compress_parser.add_argument('--min-size', type=int, default=MIN_SIZE)
+    measure_parser = subparsers.add_parser('measure', help='Measure first page load')
+    measure_parser.add_argument('--url', default='http://localhost:5000/')
+    measure_parser.add_argument('--accept-encoding', default='br, gzip',
+                                help="Use 'identity' to measure without compression")
+    measure_parser.add_argument('--bandwidth', type=float, default=10.0, help='Link speed for the estimate, Mbit/s')
+    measure_parser.add_argument('--rtt', type=float, default=50.0, help='Round trip time for the estimate, ms')
+    measure_parser.add_argument('--verbose', action='store_true', help='List every resource')
+    args = parser.parse_args()
+
+    setup_logging(log_file=False)
+    if args.command == 'compress':
+        result = precompress(args.dist, min_size=args.min_size)
+    else:
+        result = measure_first_load(args.url, accept_encoding=args.accept_encoding,
+                                    bandwidth_mbps=args.bandwidth, rtt_ms=args.rtt)
+        if not args.verbose:
+            result.pop('resources')
+    print(json.dumps(result, indent=2))
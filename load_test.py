@@ -0,0 +1,374 @@
+
+"""Нагрузочное тестирование бэкенда FatigueGuard.
+
+Запускает routes.app на временной БД (или работает с внешним сервером через --url),
+гоняет смесь запросов с заданной параллельностью и печатает JSON с пропускной
+способностью, p50/p95/p99 и долей ошибок по каждому маршруту.
+
+    python load_test.py --stub-analyzer --duration 30 --concurrency 16 --output build.json
+    python load_test.py --stub-analyzer --compare build.json
+
+Для внешнего сервера (например, gunicorn) данные готовятся заранее:
+
+    python load_test.py --prepare --workdir /tmp/fatigue-load
+    DATABASE_PATH=/tmp/fatigue-load/load_test.db UPLOAD_FOLDER=/tmp/fatigue-load/video gunicorn routes:app
+    python load_test.py --url http://127.0.0.1:8000 --workdir /tmp/fatigue-load
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import shutil
+import sqlite3
+import logging
+import argparse
+import tempfile
+import threading
+import http.client
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger("LoadTest")
+
+DEFAULT_MIX = 'login=3,analyze=1,analyze-flight=1,feedback=3,video=2'
+SAMPLE_VIDEO = 'neural_network/data/video/test.mp4'
+PASSWORD = 'load-test-password'
+
+# Минимальная схема таблиц, с которыми работают маршруты routes.py
+SCHEMA = '''
+CREATE TABLE users (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username TEXT NOT NULL UNIQUE,
+    password TEXT NOT NULL,
+    first_name TEXT,
+    last_name TEXT,
+    role TEXT NOT NULL
+);
+CREATE TABLE recordings (
+    recording_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER,
+    video_path TEXT,
+    recorded_date TEXT
+);
+CREATE TABLE flights (
+    flight_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    crew_id INTEGER,
+    flight_number TEXT,
+    departure_time TEXT NOT NULL,
+    arrival_time TEXT NOT NULL,
+    duration INTEGER,
+    from_code TEXT NOT NULL,
+    from_city TEXT NOT NULL,
+    to_code TEXT NOT NULL,
+    to_city TEXT NOT NULL,
+    aircraft TEXT NOT NULL,
+    status TEXT DEFAULT 'scheduled',
+    video_path TEXT
+);
+CREATE TABLE fatigue_analysis (
+    analysis_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER,
+    flight_id INTEGER,
+    fatigue_level TEXT,
+    neural_network_score REAL,
+    feedback_score REAL,
+    analysis_date TEXT,
+    video_path TEXT,
+    notes TEXT
+);
+'''
+
+
+def prepare_environment(workdir: str, users: int, sample_video: str) -> dict:
+    """Создает БД с пользователями, рейсом с видео и анализами для отзывов.
+
+    Описание окружения сохраняется в env.json и переиспользуется при повторном запуске.
+    """
+    from werkzeug.security import generate_password_hash
+
+    env_path = os.path.join(workdir, 'env.json')
+    if os.path.exists(env_path):
+        with open(env_path, encoding='utf-8') as env_file:
+            return json.load(env_file)
+
+    db_path = os.path.join(workdir, 'load_test.db')
+    video_dir = os.path.join(workdir, 'video')
+    os.makedirs(video_dir, exist_ok=True)
+    video_name = f"converted_{uuid.uuid4()}.mp4"
+    shutil.copy(sample_video, os.path.join(video_dir, video_name))
+
+    conn = sqlite3.connect(db_path)
+    conn.executescript(SCHEMA)
+    password = generate_password_hash(PASSWORD)
+    conn.executemany(
+        'INSERT INTO users (username, password, first_name, last_name, role) VALUES (?, ?, ?, ?, ?)',
+        [(f'load{i}', password, 'Load', f'Test{i}', 'pilot') for i in range(users)]
+    )
+    conn.execute(
+        '''INSERT INTO flights (flight_number, departure_time, arrival_time, from_code, from_city,
+                                to_code, to_city, aircraft, video_path)
+           VALUES ('LT001', '2024-01-01 10:00', '2024-01-01 12:00', 'SVO', 'Москва',
+                   'LED', 'Санкт-Петербург', 'A320', ?)''',
+        (video_name,)
+    )
+    conn.executemany(
+        '''INSERT INTO fatigue_analysis (user_id, fatigue_level, neural_network_score, video_path, analysis_date)
+           VALUES (?, 'Low', 0.2, ?, datetime('now'))''',
+        [(i + 1, video_name) for i in range(users)]
+    )
+    conn.commit()
+    conn.close()
+    env = {'db_path': db_path, 'video_dir': video_dir, 'video_name': video_name, 'flight_id': 1,
+           'users': users, 'analyses': users, 'sample_video': os.path.abspath(sample_video)}
+    with open(env_path, 'w', encoding='utf-8') as env_file:
+        json.dump(env, env_file, indent=2)
+    return env
+
+
+def install_stub_analyzer(routes, delay: float):
+    """Подменяет анализ и конвертацию, чтобы тест не требовал модели и ffmpeg"""
+    def stub_analyze_source(source, is_video_file=False, return_report=False, **kwargs):
+        time.sleep(delay)
+        score = random.random()
+        report = {
+            'level': 'Low' if score < 0.3 else 'Medium' if score < 0.7 else 'High',
+            'score': round(score, 2), 'percent': round(score * 100, 1),
+            'frames_total': 100, 'frames_read': 100, 'frames_processed': 20, 'samples': 20,
+            'duration_sec': 3.3, 'analyzed_sec': 3.3, 'analyzed_fraction': 1.0,
+            'stopped_early': False, 'elapsed_sec': delay, 'model_version': 'stub',
+            'timeline': [(i / 6.0, score, 1) for i in range(20)],
+        }
+        return report if return_report else (report['level'], report['percent'])
+
+    def stub_convert_upload(source_path):
+        converted_filename = f"converted_{os.path.splitext(os.path.basename(source_path))[0]}.mp4"
+        converted_path = routes.video_storage.path_for(converted_filename, create=True)
+        os.replace(source_path, converted_path)
+        return converted_filename, converted_path
+
+    routes.analyze_source = stub_analyze_source
+    routes.video_storage.convert_upload = stub_convert_upload
+
+
+def start_local_server(env: dict, stub_analyzer: bool, stub_delay: float) -> str:
+    os.environ['DATABASE_PATH'] = env['db_path']
+    os.environ['UPLOAD_FOLDER'] = env['video_dir']
+    from werkzeug.serving import make_server
+    import routes
+
+    if stub_analyzer:
+        install_stub_analyzer(routes, stub_delay)
+    server = make_server('127.0.0.1', 0, routes.app, threaded=True)
+    threading.Thread(target=server.serve_forever, name='load-test-server', daemon=True).start()
+    return f'http://127.0.0.1:{server.server_port}'
+
+
+class Client:
+    """Один виртуальный пилот с собственным keep-alive соединением"""
+
+    def __init__(self, base_url: str, username: str, env: dict, video_bytes: bytes):
+        parsed = urlparse(base_url)
+        self.host, self.port = parsed.hostname, parsed.port or 80
+        self.username = username
+        self.env = env
+        self.video_bytes = video_bytes
+        self.token = None
+        self.refresh_token = None
+        self.conn = None
+
+    def _request(self, method: str, path: str, body: bytes = None, headers: dict = None):
+        if self.conn is None:
+            self.conn = http.client.HTTPConnection(self.host, self.port, timeout=120)
+        headers = dict(headers or {})
+        if self.token:
+            headers['Authorization'] = f'Bearer {self.token}'
+        try:
+            self.conn.request(method, path, body=body, headers=headers)
+            response = self.conn.getresponse()
+            data = response.read()
+            return response.status, data
+        except (http.client.HTTPException, OSError):
+            self.conn.close()
+            self.conn = None
+            raise
+
+    def _json(self, method: str, path: str, payload: dict):
+        return self._request(method, path, json.dumps(payload).encode('utf-8'),
+                             {'Content-Type': 'application/json'})
+
+    def login(self):
+        status, data = self._json('POST', '/api/login', {'username': self.username, 'password': PASSWORD})
+        if status == 200:
+            payload = json.loads(data)
+            self.token = payload['token']
+            self.refresh_token = payload.get('refresh_token')
+        return status
+
+    def refresh(self):
+        status, data = self._json('POST', '/api/refresh-token', {'refresh_token': self.refresh_token})
+        if status == 200:
+            payload = json.loads(data)
+            self.token = payload['token']
+            self.refresh_token = payload['refresh_token']
+        return status
+
+    def analyze(self):
+        boundary = uuid.uuid4().hex
+        body = (f'--{boundary}\r\nContent-Disposition: form-data; name="video"; filename="clip.webm"\r\n'
+                f'Content-Type: video/webm\r\n\r\n').encode('utf-8') + self.video_bytes + \
+            f'\r\n--{boundary}--\r\n'.encode('utf-8')
+        return self._request('POST', '/api/fatigue/analyze', body,
+                             {'Content-Type': f'multipart/form-data; boundary={boundary}'})[0]
+
+    def analyze_flight(self):
+        return self._json('POST', '/api/fatigue/analyze-flight', {'flight_id': self.env['flight_id']})[0]
+
+    def feedback(self):
+        return self._json('POST', '/api/fatigue/feedback',
+                          {'analysis_id': random.randint(1, self.env['analyses']), 'score': random.randint(1, 5)})[0]
+
+    def video(self):
+        return self._request('GET', f"/api/video/{self.env['video_name']}")[0]
+
+
+ROUTES = {
+    'login': Client.login,
+    'refresh': Client.refresh,
+    'analyze': Client.analyze,
+    'analyze-flight': Client.analyze_flight,
+    'feedback': Client.feedback,
+    'video': Client.video,
+}
+
+
+def parse_mix(mix: str) -> dict:
+    weights = {}
+    for part in mix.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in ROUTES:
+            raise ValueError(f"Unknown route in mix: {name}")
+        weights[name] = float(weight or 1)
+    return weights
+
+
+def percentile(sorted_values: list, q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(q / 100 * (len(sorted_values) - 1)))))
+    return sorted_values[index]
+
+
+def run_load(base_url: str, env: dict, mix: dict, concurrency: int, duration: float,
+             warmup: float = 2.0) -> dict:
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    with open(env['sample_video'], 'rb') as video:
+        video_bytes = video.read()
+    samples = []
+    samples_lock = threading.Lock()
+    measure_from = time.time() + warmup
+    deadline = measure_from + duration
+
+    def worker(index: int):
+        client = Client(base_url, f"load{index % env['users']}", env, video_bytes)
+        client.login()
+        local = []
+        while time.time() < deadline:
+            name = random.choices(names, weights)[0]
+            started = time.perf_counter()
+            try:
+                status = ROUTES[name](client)
+            except Exception:
+                status = 0
+            latency = time.perf_counter() - started
+            if time.time() >= measure_from:
+                local.append((name, status, latency))
+        with samples_lock:
+            samples.extend(local)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(worker, range(concurrency)))
+
+    report = {'concurrency': concurrency, 'duration_sec': duration, 'mix': mix, 'routes': {}}
+    for name in names + ['total']:
+        selected = [s for s in samples if name == 'total' or s[0] == name]
+        latencies = sorted(s[2] * 1000 for s in selected)
+        errors = sum(1 for s in selected if s[1] == 0 or s[1] >= 400)
+        report['routes'][name] = {
+            'requests': len(selected),
+            'rps': round(len(selected) / duration, 2),
+            'error_rate': round(errors / len(selected), 4) if selected else 0.0,
+            'status': {str(code): sum(1 for s in selected if s[1] == code)
+                       for code in sorted({s[1] for s in selected})},
+            'p50_ms': round(percentile(latencies, 50), 2),
+            'p95_ms': round(percentile(latencies, 95), 2),
+            'p99_ms': round(percentile(latencies, 99), 2),
+            'mean_ms': round(sum(latencies) / len(latencies), 2) if latencies else 0.0,
+        }
+    return report
+
+
+def compare_reports(current: dict, baseline: dict) -> dict:
+    """Относительные изменения rps и задержек по сравнению с базовым прогоном"""
+    delta = {}
+    for name, stats in current['routes'].items():
+        base = baseline.get('routes', {}).get(name)
+        if not base:
+            continue
+        delta[name] = {}
+        for key in ('rps', 'p50_ms', 'p95_ms', 'p99_ms', 'error_rate'):
+            if base[key]:
+                delta[name][key] = f"{(stats[key] - base[key]) / base[key] * 100:+.1f}%"
+            else:
+                delta[name][key] = f"{stats[key] - base[key]:+.4f}"
+    return delta
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='HTTP load test for the FatigueGuard backend')
+    parser.add_argument('--url', help='Test an already running server instead of starting routes.app')
+    parser.add_argument('--workdir', help='Directory with seed data (default: temporary, removed after run)')
+    parser.add_argument('--prepare', action='store_true', help='Only create seed data in --workdir')
+    parser.add_argument('--duration', type=float, default=30.0, help='Measured seconds')
+    parser.add_argument('--warmup', type=float, default=2.0)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--mix', default=DEFAULT_MIX, help='Route weights, e.g. login=3,feedback=1')
+    parser.add_argument('--users', type=int, default=50, help='Number of seeded test users')
+    parser.add_argument('--stub-analyzer', action='store_true',
+                        help='Replace model inference and ffmpeg with a fixed-delay stub')
+    parser.add_argument('--stub-delay', type=float, default=0.2, help='Stub analysis time in seconds')
+    parser.add_argument('--video', default=SAMPLE_VIDEO, help='Video uploaded by analysis requests')
+    parser.add_argument('--output', help='Write the JSON report to this file')
+    parser.add_argument('--compare', help='Baseline JSON report to compare against')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    mix = parse_mix(args.mix)
+    workdir = args.workdir or tempfile.mkdtemp(prefix='fatigue-load-')
+    os.makedirs(workdir, exist_ok=True)
+    try:
+        env = prepare_environment(workdir, args.users, args.video)
+        if args.prepare:
+            print(f"DATABASE_PATH={env['db_path']} UPLOAD_FOLDER={env['video_dir']}")
+            sys.exit(0)
+        if args.url:
+            base_url = args.url.rstrip('/')
+        else:
+            base_url = start_local_server(env, args.stub_analyzer, args.stub_delay)
+
+        report = run_load(base_url, env, mix, args.concurrency, args.duration, args.warmup)
+        if args.compare:
+            with open(args.compare, encoding='utf-8') as baseline:
+                report['compare'] = compare_reports(report, json.load(baseline))
+
+        output = json.dumps(report, indent=2, ensure_ascii=False)
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as result_file:
+                result_file.write(output)
+        print(output)
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
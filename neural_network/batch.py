@@ -0,0 +1,158 @@
+
+import os
+import json
+import time
+import logging
+import multiprocessing
+from pathlib import Path
+
+logger = logging.getLogger("BatchAnalysis")
+
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov', '.mkv', '.webm')
+
+# Анализатор процесса-воркера: модель загружается один раз на процесс
+_worker_analyzer = None
+_worker_options = {}
+# Ошибка инициализации воркера: исключение в initializer заставило бы пул
+# бесконечно перезапускать процессы, поэтому она возвращается в отчете каждой задачи
+_worker_error = None
+
+
+def collect_inputs(path: str) -> list:
+    """Возвращает список видео из каталога (рекурсивно) или из манифеста.
+
+    Манифест - текстовый файл с одним путем на строку либо JSONL с полем ``path``.
+    Относительные пути ищутся от текущего каталога, затем от каталога манифеста.
+    """
+    source = Path(path)
+    if source.is_dir():
+        return sorted(str(p) for p in source.rglob('*')
+                      if p.is_file() and p.suffix.lower() in VIDEO_EXTENSIONS)
+
+    inputs = []
+    with open(source, encoding='utf-8') as manifest:
+        for line in manifest:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            if line.startswith('{'):
+                line = json.loads(line)['path']
+            entry = Path(line)
+            if not entry.is_absolute() and not entry.exists():
+                entry = source.parent / entry
+            inputs.append(str(entry))
+    return inputs
+
+
+def load_finished(results_path: str, retry_errors: bool = False) -> set:
+    """Читает уже записанные результаты, чтобы продолжить прерванный запуск"""
+    finished = set()
+    if not os.path.exists(results_path):
+        return finished
+    with open(results_path, encoding='utf-8') as results:
+        for line in results:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # Последняя строка могла оборваться при падении
+                continue
+            if retry_errors and record.get('level') == 'Error':
+                continue
+            finished.add(record.get('input'))
+    return finished
+
+
+def _init_worker(model_path: str, threads: int, options: dict, nice: int = 0):
+    global _worker_analyzer, _worker_options, _worker_error
+    from neural_network.logging_setup import setup_logging
+
+    # Воркеры пишут только в консоль: ротацию файла выполняет родительский процесс
+    setup_logging(console=True, log_file=False)
+    try:
+        import cv2
+        import tensorflow as tf
+        from neural_network.predict import FatigueAnalyzer
+
+        # Фоновые задачи понижают приоритет, чтобы не мешать живым запросам
+        if nice and hasattr(os, 'nice'):
+            os.nice(nice)
+        # Несколько процессов не должны конкурировать за все ядра сразу
+        cv2.setNumThreads(1)
+        tf.config.threading.set_intra_op_parallelism_threads(threads)
+        tf.config.threading.set_inter_op_parallelism_threads(1)
+        _worker_analyzer = FatigueAnalyzer(model_path)
+        _worker_options = options
+    except Exception as e:
+        logger.error(f"Worker initialization failed: {str(e)}")
+        _worker_error = f"Worker initialization failed: {str(e)}"
+
+
+def _analyze_one(path: str) -> dict:
+    from neural_network.predict import analyze_source
+    from neural_network.logging_setup import log_context
+    if _worker_error is not None:
+        return {'input': path, 'worker': os.getpid(), 'level': 'Error', 'score': 0.0, 'percent': 0,
+                'error': _worker_error, 'analyzed_sec': 0.0, 'elapsed_sec': 0.0, 'model_version': None}
+    with log_context(job_id=path):
+        report = analyze_source(path, is_video_file=True, analyzer=_worker_analyzer,
+                                return_report=True, display=False, **_worker_options)
+    report['input'] = path
+    report['worker'] = os.getpid()
+    return report
+
+
+def analysis_pool(workers: int, model_path: str, options: dict, nice: int = 0):
+    """Пул процессов с загруженным анализатором, задачи отправляются через _analyze_one"""
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    # spawn: TensorFlow и MediaPipe плохо переносят fork после инициализации
+    context = multiprocessing.get_context('spawn')
+    return context.Pool(workers, initializer=_init_worker,
+                        initargs=(model_path, threads, options, nice))
+
+
+def run_batch(inputs: list, results_path: str, workers: int = 0, sequential: bool = False,
+              retry_errors: bool = False, model_path: str = None, multi_face: bool = False,
+              motion_threshold: float = 0.0, scoring: str = 'cnn', detection_cache: str = None) -> dict:
+    """Анализирует видео в нескольких процессах и дописывает по строке JSONL на видео"""
+    from neural_network.predict import MODEL_PATH
+
+    model_path = model_path or MODEL_PATH
+    # Без модели воркеры не запустятся: ошибка сразу, а не после создания пула
+    if not os.path.exists(model_path):
+        logger.error(f"Model file not found: {model_path}")
+        raise FileNotFoundError(f"Model file not found: {model_path}")
+    workers = workers or os.cpu_count() or 1
+    finished = load_finished(results_path, retry_errors=retry_errors)
+    pending = [path for path in inputs if path not in finished]
+    summary = {
+        'inputs': len(inputs), 'skipped': len(inputs) - len(pending), 'analyzed': 0,
+        'errors': 0, 'workers': workers, 'wall_sec': 0.0, 'video_sec': 0.0,
+        'videos_per_min': 0.0, 'realtime_factor': 0.0
+    }
+    logger.info(f"Batch analysis: {len(pending)} pending, {summary['skipped']} already finished, "
+                f"{workers} workers")
+    if not pending:
+        return summary
+
+    started = time.time()
+    with open(results_path, 'a', encoding='utf-8') as results, \
+            analysis_pool(min(workers, len(pending)), model_path,
+                          {'sequential': sequential, 'multi_face': multi_face,
+                           'motion_threshold': motion_threshold, 'scoring': scoring,
+                           'detection_cache': detection_cache}) as pool:
+        for report in pool.imap_unordered(_analyze_one, pending):
+            results.write(json.dumps(report, ensure_ascii=False) + '\n')
+            results.flush()
+            summary['analyzed'] += 1
+            summary['video_sec'] += report.get('analyzed_sec', 0.0)
+            if report['level'] == 'Error':
+                summary['errors'] += 1
+            logger.info(f"[{summary['analyzed']}/{len(pending)}] {report['input']}: "
+                        f"{report['level']} ({report['percent']}%) in {report['elapsed_sec']}s")
+
+    wall = time.time() - started
+    summary['wall_sec'] = round(wall, 2)
+    summary['video_sec'] = round(summary['video_sec'], 2)
+    summary['videos_per_min'] = round(summary['analyzed'] / wall * 60, 2) if wall else 0.0
+    summary['realtime_factor'] = round(summary['video_sec'] / wall, 2) if wall else 0.0
+    return summary
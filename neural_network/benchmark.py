@@ -0,0 +1,371 @@
+
+import cv2
+import json
+import time
+import argparse
+import logging
+import tracemalloc
+import numpy as np
+
+from neural_network.predict import (FaceDetector, FacePreprocessor, FatigueAnalyzer, MotionGate,
+                                    FrameReader, FACE_SIZE, FRAME_STEP, MODEL_PATH, score_level)
+from neural_network.capture import LatestFrameReader
+
+logger = logging.getLogger("Benchmark")
+
+
+def load_frames(video_path: str, step: int = 5, limit: int = 0) -> list:
+    """Читает каждый step-й кадр видео в память, чтобы декодирование не влияло на замеры"""
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise ValueError(f"Failed to open video: {video_path}")
+    frames = []
+    frame_count = 0
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frame_count += 1
+        if frame_count % step == 0:
+            frames.append(frame)
+            if limit and len(frames) >= limit:
+                break
+    cap.release()
+    return frames
+
+
+def benchmark_detection(frames: list, repeats: int = 3) -> dict:
+    """Сравнивает детекцию на полном разрешении и на уменьшенной копии кадра"""
+    modes = {'full': None, 'auto': 'auto'}
+    report = {'frames': len(frames)}
+    detected = {}
+
+    for name, scale in modes.items():
+        detector = FaceDetector(detection_scale=scale)
+        # Прогрев графа MediaPipe
+        detector.detect(frames[0])
+        best = None
+        for _ in range(repeats):
+            hits = []
+            start = time.perf_counter()
+            for frame in frames:
+                hits.append(bool(detector.detect(frame)))
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        detected[name] = hits
+        report[name] = {
+            'scale': round(detector.scale_for(frames[0].shape), 3),
+            'seconds': round(best, 4),
+            'fps': round(len(frames) / best, 1) if best else 0.0,
+            'detection_rate': round(sum(hits) / len(hits), 4),
+        }
+
+    report['speedup'] = round(report['full']['seconds'] / report['auto']['seconds'], 2) \
+        if report['auto']['seconds'] else 0.0
+    report['detection_rate_delta'] = round(
+        report['auto']['detection_rate'] - report['full']['detection_rate'], 4)
+    report['agreement'] = round(
+        sum(a == b for a, b in zip(detected['full'], detected['auto'])) / len(frames), 4)
+    return report
+
+
+def extract_face_crops(frames: list) -> list:
+    """Возвращает списки кропов лиц (представления кадров) для каждого кадра"""
+    detector = FaceDetector()
+    crops = []
+    for frame in frames:
+        faces = detector.detect(frame)
+        if not faces:
+            # Без лица берем центральную область, чтобы нагрузка была сопоставимой
+            h, w = frame.shape[:2]
+            faces = [(w // 4, h // 4, w // 2, h // 2, 0.0)]
+        crops.append([frame[y:y+height, x:x+width] for x, y, width, height, _ in faces])
+    return crops
+
+
+def _legacy_preprocess(faces: list) -> np.ndarray:
+    # Прежняя реализация: resize + astype + деление на каждый кроп
+    processed = []
+    for face in faces:
+        face = cv2.resize(face, (FACE_SIZE, FACE_SIZE))
+        processed.append(face.astype(np.float32) / 255.0)
+    return np.stack(processed)
+
+
+def benchmark_preprocessing(frames: list, repeats: int = 3) -> dict:
+    """Сравнивает время и объем выделяемой памяти при подготовке кропов"""
+    crops = extract_face_crops(frames)
+    preprocessor = FacePreprocessor()
+    modes = {'legacy': _legacy_preprocess, 'preallocated': preprocessor.preprocess}
+    report = {'frames': len(frames), 'faces': sum(len(c) for c in crops)}
+
+    for name, fn in modes.items():
+        fn(crops[0])
+        best = None
+        for _ in range(repeats):
+            start = time.perf_counter()
+            for faces in crops:
+                fn(faces)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+
+        # Пиковый объем временной памяти, выделяемой на обработку одного кадра
+        transient = 0
+        tracemalloc.start()
+        for faces in crops:
+            tracemalloc.reset_peak()
+            before, _ = tracemalloc.get_traced_memory()
+            fn(faces)
+            _, peak = tracemalloc.get_traced_memory()
+            transient += peak - before
+        tracemalloc.stop()
+
+        report[name] = {
+            'seconds': round(best, 4),
+            'us_per_frame': round(best / len(frames) * 1e6, 1),
+            'alloc_bytes_per_frame': int(transient / len(frames)),
+        }
+
+    report['speedup'] = round(report['legacy']['seconds'] / report['preallocated']['seconds'], 2) \
+        if report['preallocated']['seconds'] else 0.0
+    return report
+
+
+def benchmark_multi_face(frames: list, model_path: str = MODEL_PATH, crew_sizes=(1, 2, 4),
+                         repeats: int = 3) -> dict:
+    """Стоимость инференса и трекинга на кадр в зависимости от числа людей в кадре.
+
+    Кропы найденных лиц повторяются people раз, детекция (один проход на кадр
+    при любом числе людей) в замер не входит. batched - один вызов модели на кадр
+    для всех лиц, как в режиме multi_face; per_face - вызов модели на каждое лицо.
+    """
+    analyzer = FatigueAnalyzer(model_path, multi_face=True)
+    crops = [c for c in extract_face_crops(frames) if c]
+    report = {'frames': len(crops)}
+    for people in crew_sizes:
+        frame_crops = [faces * people for faces in crops]
+        # Рамки разнесены по кадру, чтобы трекер вел people отдельных людей
+        boxes = [[(i * 200, 0, 150, 150) for i in range(len(faces))] for faces in frame_crops]
+
+        def batched():
+            for faces, frame_boxes in zip(frame_crops, boxes):
+                batch = analyzer.preprocessor.preprocess(faces)
+                analyzer.model.predict(batch, verbose=0)
+                analyzer.tracker.update(frame_boxes)
+
+        def per_face():
+            for faces in frame_crops:
+                for face in faces:
+                    analyzer.model.predict(analyzer.preprocessor.preprocess([face]), verbose=0)
+
+        entry = {'faces_per_frame': round(sum(map(len, frame_crops)) / len(frame_crops), 2)}
+        for name, fn in (('batched', batched), ('per_face', per_face)):
+            analyzer.reset(multi_face=True)
+            fn()
+            if name == 'batched':
+                entry['tracks'] = len(analyzer.tracker.tracks)
+            best = None
+            for _ in range(repeats):
+                start = time.perf_counter()
+                fn()
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            entry[f'{name}_ms_per_frame'] = round(best / len(frame_crops) * 1000, 2)
+        report[f'people_{people}'] = entry
+
+    base = report.get(f'people_{crew_sizes[0]}')
+    for people in crew_sizes:
+        entry = report.get(f'people_{people}')
+        if base and entry:
+            entry['batched_cost_ratio'] = round(entry['batched_ms_per_frame'] / base['batched_ms_per_frame'], 2)
+            entry['per_face_cost_ratio'] = round(entry['per_face_ms_per_frame'] / base['per_face_ms_per_frame'], 2)
+    return report
+
+
+def benchmark_motion_gate(frames: list, model_path: str = MODEL_PATH, thresholds=(1.0, 2.0, 4.0, 8.0),
+                          max_reuse: int = 10) -> dict:
+    """Доля пропущенных кадров, время и отклонение оценок при разных порогах MotionGate.
+
+    Отклонение считается относительно прогона без гейта: среднее и максимальное
+    расхождение оценок по кадрам и разница итоговой оценки.
+    """
+    analyzer = FatigueAnalyzer(model_path)
+
+    def run(gate):
+        analyzer.reset()
+        analyzer.motion_gate = gate
+        scores = []
+        start = time.perf_counter()
+        for frame in frames:
+            # process_frame рисует рамки на кадре, поэтому каждый прогон работает с копией
+            analyzer.process_frame(frame.copy())
+            scores.append(analyzer.last_frame_scores[0] if analyzer.last_frame_scores else None)
+        elapsed = time.perf_counter() - start
+        return scores, elapsed, analyzer.get_final_score()['score']
+
+    run(None)  # прогрев модели и детектора
+    base_scores, base_time, base_final = run(None)
+    report = {'frames': len(frames), 'baseline': {
+        'ms_per_frame': round(base_time / len(frames) * 1000, 2), 'final_score': base_final}}
+    for threshold in thresholds:
+        gate = MotionGate(threshold=threshold, max_reuse=max_reuse)
+        scores, elapsed, final = run(gate)
+        diffs = [abs(a - b) for a, b in zip(scores, base_scores) if a is not None and b is not None]
+        report[f'threshold_{threshold:g}'] = dict(
+            gate.stats(),
+            ms_per_frame=round(elapsed / len(frames) * 1000, 2),
+            speedup=round(base_time / elapsed, 2) if elapsed else 0.0,
+            frame_score_deviation_mean=round(float(np.mean(diffs)), 4) if diffs else None,
+            frame_score_deviation_max=round(float(np.max(diffs)), 4) if diffs else None,
+            final_score=final,
+            final_score_deviation=round(abs(final - base_final), 4),
+        )
+    return report
+
+
+def benchmark_perclos(frames: list, model_path: str = MODEL_PATH, modes=('perclos', 'hybrid')) -> dict:
+    """Время на кадр, доля вызовов модели и согласие оценок PERCLOS с моделью.
+
+    Согласие считается относительно режима cnn: доля кадров с тем же уровнем
+    усталости (по среднему буфера), совпадение итогового уровня и корреляция
+    оценок по кадрам.
+    """
+    analyzer = FatigueAnalyzer(model_path)
+
+    def run(scoring):
+        analyzer.reset()
+        analyzer.scoring = scoring
+        buffered = []
+        start = time.perf_counter()
+        for frame in frames:
+            analyzer.process_frame(frame.copy())
+            buffered.append(float(np.mean(analyzer.buffer)) if analyzer.last_frame_scores else None)
+        elapsed = time.perf_counter() - start
+        return buffered, elapsed, analyzer.get_final_score()['score'], analyzer.scoring_stats()
+
+    run('cnn')  # прогрев модели и детектора
+    run('perclos')  # прогрев Face Mesh
+    base_scores, base_time, base_final, _ = run('cnn')
+    report = {'frames': len(frames), 'cnn': {
+        'ms_per_frame': round(base_time / len(frames) * 1000, 2), 'final_score': base_final,
+        'final_level': score_level(base_final)}}
+    for mode in modes:
+        scores, elapsed, final, stats = run(mode)
+        pairs = [(a, b) for a, b in zip(scores, base_scores) if a is not None and b is not None]
+        agreement = np.mean([score_level(a) == score_level(b) for a, b in pairs]) if pairs else None
+        correlation = None
+        if len(pairs) > 2:
+            a, b = np.array(pairs).T
+            if a.std() > 0 and b.std() > 0:
+                correlation = round(float(np.corrcoef(a, b)[0, 1]), 3)
+        report[mode] = dict(
+            stats,
+            ms_per_frame=round(elapsed / len(frames) * 1000, 2),
+            speedup=round(base_time / elapsed, 2) if elapsed else 0.0,
+            final_score=final,
+            final_level=score_level(final),
+            level_agreement=round(float(agreement), 3) if agreement is not None else None,
+            final_level_match=score_level(final) == score_level(base_final),
+            score_correlation=correlation,
+        )
+    return report
+
+
+class SimulatedCamera:
+    """Камера из кадров в памяти: кадр i появляется в момент i / fps и ждет чтения в буфере"""
+
+    def __init__(self, frames: list, fps: float = 30.0):
+        self.frames = frames
+        self.fps = fps
+        self.index = 0
+        self.started = None
+
+    def isOpened(self):
+        return True
+
+    def grab(self):
+        if self.index >= len(self.frames):
+            return False
+        if self.started is None:
+            self.started = time.perf_counter()
+        delay = self.capture_time(self.index + 1) - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        self.index += 1
+        return True
+
+    def retrieve(self):
+        return True, self.frames[self.index - 1].copy()
+
+    def read(self):
+        return self.retrieve() if self.grab() else (False, None)
+
+    def capture_time(self, index: int) -> float:
+        return self.started + (index - 1) / self.fps
+
+
+def benchmark_realtime(frames: list, model_path: str = MODEL_PATH, fps: float = 30.0,
+                       target_fps=(0.0, 2.0)) -> dict:
+    """Задержка от захвата кадра до оценки при чтении камеры в цикле анализа и в отдельном потоке.
+
+    Камера имитируется кадрами видео, которые появляются с частотой fps; при
+    последовательном чтении непрочитанные кадры копятся, как в буфере драйвера.
+    """
+    analyzer = FatigueAnalyzer(model_path)
+    analyzer.process_frame(frames[0].copy())  # прогрев модели и детектора
+
+    def run(reader_factory):
+        analyzer.reset()
+        camera = SimulatedCamera(frames, fps=fps)
+        reader = reader_factory(camera)
+        latencies = []
+        for index, frame, faces in reader:
+            analyzer.process_frame(frame, faces)
+            latencies.append((time.perf_counter() - camera.capture_time(index)) * 1000)
+        return {
+            'processed': len(latencies),
+            'latency_ms_p50': round(float(np.percentile(latencies, 50)), 1),
+            'latency_ms_p95': round(float(np.percentile(latencies, 95)), 1),
+            'latency_ms_max': round(float(np.max(latencies)), 1),
+            'final_latency_ms': round(latencies[-1], 1),
+        }
+
+    report = {'frames': len(frames), 'camera_fps': fps,
+              'sequential': run(lambda camera: FrameReader(camera, step=FRAME_STEP))}
+    for target in target_fps:
+        report[f'latest_frame_{target:g}fps'] = run(
+            lambda camera: LatestFrameReader(camera, target_fps=target))
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='FatigueGuard analysis benchmarks')
+    parser.add_argument('benchmark', choices=['detection', 'preprocess', 'multi-face', 'motion-gate',
+                                                      'perclos', 'realtime'])
+    parser.add_argument('--input', required=True, help='Path to input video')
+    parser.add_argument('--step', type=int, default=5, help='Analyze every N-th frame')
+    parser.add_argument('--limit', type=int, default=300, help='Max frames to load (0 - all)')
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args()
+
+    # Для имитации камеры нужны все кадры подряд
+    frames = load_frames(args.input, step=1 if args.benchmark == 'realtime' else args.step,
+                         limit=args.limit)
+    if not frames:
+        print("Error: no frames loaded")
+        exit(1)
+
+    if args.benchmark == 'detection':
+        result = benchmark_detection(frames, repeats=args.repeats)
+    elif args.benchmark == 'preprocess':
+        result = benchmark_preprocessing(frames, repeats=args.repeats)
+    elif args.benchmark == 'multi-face':
+        result = benchmark_multi_face(frames, repeats=args.repeats)
+    elif args.benchmark == 'motion-gate':
+        result = benchmark_motion_gate(frames)
+    elif args.benchmark == 'perclos':
+        result = benchmark_perclos(frames)
+    elif args.benchmark == 'realtime':
+        result = benchmark_realtime(frames)
+
+    print(json.dumps(result, indent=2, ensure_ascii=False))
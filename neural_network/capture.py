@@ -0,0 +1,124 @@
+
+import time
+import logging
+import threading
+from collections import deque
+
+import numpy as np
+
+logger = logging.getLogger("Capture")
+
+
+class LatestFrameReader:
+    """Чтение камеры в отдельном потоке с сохранением только последнего кадра.
+
+    Поток захвата непрерывно вычитывает кадры, поэтому они не копятся в буфере
+    драйвера, а анализ всегда получает самый свежий кадр: если обработка не
+    успевает, промежуточные кадры пропускаются, и оценка не отстает от
+    происходящего. target_fps ограничивает частоту анализа (0 - так часто, как
+    успевает модель), освобождая процессор на слабых машинах.
+
+    Итерация возвращает (номер кадра, кадр, None), как FrameReader; frame_time -
+    время захвата этого кадра. В stats -
+    число захваченных и обработанных кадров и задержка от захвата кадра
+    до получения его оценки.
+    """
+
+    def __init__(self, cap, target_fps: float = 0.0, read_timeout: float = 5.0,
+                 latency_window: int = 1000):
+        self.cap = cap
+        self.target_fps = target_fps
+        self.read_timeout = read_timeout
+        self.frames_read = 0
+        # Момент захвата последнего отданного кадра, с от начала чтения
+        self.frame_time = 0.0
+        self.stats = {}
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._frame = None
+        self._index = 0
+        self._stamp = 0.0
+        self._finished = False
+        self._latencies = deque(maxlen=latency_window)
+
+    def _capture(self):
+        while not self._stop.is_set():
+            ret, frame = self.cap.read()
+            stamp = time.perf_counter()
+            with self._cond:
+                if not ret:
+                    self._finished = True
+                    self._cond.notify()
+                    break
+                # Необработанный предыдущий кадр просто заменяется новым
+                self._frame = frame
+                self._index += 1
+                self._stamp = stamp
+                self._cond.notify()
+
+    def _next_frame(self, consumed: int):
+        with self._cond:
+            deadline = time.monotonic() + self.read_timeout
+            while self._index == consumed and not self._finished:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    logger.warning(f"No frame from camera for {self.read_timeout:.0f}s, stopping")
+                    return None
+                self._cond.wait(remaining)
+            if self._index == consumed:
+                return None
+            frame, self._frame = self._frame, None
+            return self._index, frame, self._stamp
+
+    def __iter__(self):
+        thread = threading.Thread(target=self._capture, name='camera-capture', daemon=True)
+        thread.start()
+        interval = 1.0 / self.target_fps if self.target_fps > 0 else 0.0
+        started = time.perf_counter()
+        next_due = started
+        consumed = 0
+        processed = 0
+        latency_sum = 0.0
+        latency_max = 0.0
+        try:
+            while True:
+                if interval:
+                    delay = next_due - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                    # После долгой обработки не наверстываем пропущенные интервалы
+                    next_due = max(next_due + interval, time.perf_counter())
+                item = self._next_frame(consumed)
+                if item is None:
+                    break
+                consumed, frame, stamp = item
+                self.frames_read = consumed
+                self.frame_time = stamp - started
+                yield consumed, frame, None
+                # Кадр обработан: оценка готова
+                latency = time.perf_counter() - stamp
+                self._latencies.append(latency)
+                latency_sum += latency
+                latency_max = max(latency_max, latency)
+                processed += 1
+        finally:
+            self._stop.set()
+            thread.join(timeout=self.read_timeout)
+            self.frames_read = self._index
+            wall = time.perf_counter() - started
+            latencies = np.array(self._latencies) * 1000
+            self.stats = {
+                'captured': self.frames_read, 'processed': processed,
+                'skipped': max(0, self.frames_read - processed),
+                'target_fps': self.target_fps,
+                'capture_fps': round(self.frames_read / wall, 2) if wall > 0 else 0.0,
+                'processing_fps': round(processed / wall, 2) if wall > 0 else 0.0,
+                'latency_ms': {
+                    'mean': round(latency_sum / processed * 1000, 1) if processed else None,
+                    'p50': round(float(np.percentile(latencies, 50)), 1) if len(latencies) else None,
+                    'p95': round(float(np.percentile(latencies, 95)), 1) if len(latencies) else None,
+                    'max': round(latency_max * 1000, 1) if processed else None,
+                }
+            }
+            logger.info(f"Camera capture: {processed} of {self.frames_read} frames analyzed, "
+                        f"latency p50 {self.stats['latency_ms']['p50']} ms")
@@ -0,0 +1,181 @@
+
+import os
+import json
+import time
+import hashlib
+import logging
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger("DetectionCache")
+
+CACHE_VERSION = 1
+
+
+def settings_digest(settings: dict) -> str:
+    return hashlib.sha256(json.dumps(settings, sort_keys=True).encode('utf-8')).hexdigest()[:8]
+
+
+class CachedDetections:
+    """Лица проанализированных кадров одного видео, прочитанные из кэша.
+
+    Кропы - массив (число лиц, size, size, 3) или None, если кэш записан без них;
+    scores - оценки модели для кропов, если вызывающий код их посчитал.
+    """
+
+    def __init__(self, data, meta: dict):
+        self.meta = meta
+        self.frames = data['frames']
+        self.offsets = data['offsets']
+        self.boxes = data['boxes']
+        self.confidence = data['confidence']
+        self.crops = data['crops'] if 'crops' in data.files else None
+        self.frames_read = 0
+        self.scores = None
+        self.current_scores = None
+        self.stats = {}
+
+    @property
+    def has_crops(self) -> bool:
+        return self.crops is not None
+
+    def faces_by_frame(self) -> dict:
+        return {int(frame): self.faces_at(i) for i, frame in enumerate(self.frames)}
+
+    def faces_at(self, i: int) -> list:
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return [(int(x), int(y), int(w), int(h), float(score))
+                for (x, y, w, h), score in zip(self.boxes[start:end], self.confidence[start:end])]
+
+    def __len__(self):
+        return len(self.frames)
+
+    def __iter__(self):
+        # Кадра нет: итерация возвращает (номер кадра, None, лица), оценки лиц
+        # текущего кадра - в current_scores
+        for i, frame in enumerate(self.frames):
+            start, end = self.offsets[i], self.offsets[i + 1]
+            self.current_scores = self.scores[start:end] if self.scores is not None else None
+            self.frames_read = int(frame)
+            yield int(frame), None, self.faces_at(i)
+        self.frames_read = int(self.meta['frames_read'])
+
+
+class CachedFacesReader:
+    """Декодирует кадры, но берет лица из кэша вместо детектора (кэш без кропов)"""
+
+    def __init__(self, reader, cached: CachedDetections):
+        self.reader = reader
+        self.faces = cached.faces_by_frame()
+        self.stats = {}
+
+    @property
+    def frames_read(self) -> int:
+        return self.reader.frames_read
+
+    def __iter__(self):
+        for frame_count, frame, _ in self.reader:
+            # Кадра нет в кэше - лица найдет детектор анализатора
+            yield frame_count, frame, self.faces.get(frame_count)
+
+
+class DetectionRecorder:
+    """Собирает лица (и кропы) каждого проанализированного кадра для записи в кэш"""
+
+    def __init__(self, crop_size: int = 0):
+        self.crop_size = crop_size
+        self.frames = []
+        self.boxes = []
+        self.confidence = []
+        self.crops = []
+        self.counts = []
+        self.frame_number = 0
+
+    def add(self, frame: np.ndarray, faces: list):
+        self.frames.append(self.frame_number)
+        self.counts.append(len(faces))
+        for x, y, w, h, score in faces:
+            self.boxes.append((x, y, w, h))
+            self.confidence.append(score)
+            if self.crop_size:
+                region = frame[y:y + h, x:x + w]
+                if region.size:
+                    crop = cv2.resize(region, (self.crop_size, self.crop_size))
+                else:
+                    crop = np.zeros((self.crop_size, self.crop_size, 3), dtype=np.uint8)
+                self.crops.append(crop)
+
+    def arrays(self) -> dict:
+        arrays = {
+            'frames': np.array(self.frames, dtype=np.int32),
+            'offsets': np.concatenate(([0], np.cumsum(self.counts, dtype=np.int64))),
+            'boxes': np.array(self.boxes, dtype=np.int32).reshape(-1, 4),
+            'confidence': np.array(self.confidence, dtype=np.float32),
+        }
+        if self.crop_size:
+            arrays['crops'] = np.array(self.crops, dtype=np.uint8).reshape(
+                -1, self.crop_size, self.crop_size, 3)
+        return arrays
+
+
+class DetectionCache:
+    """Кэш результатов детекции лиц по видео.
+
+    Для каждого видео хранится один файл <хеш видео>-<хеш настроек>.npz:
+    номера проанализированных кадров, смещения их лиц, рамки, уверенность
+    детектора и, если включено, кропы лиц размера входа модели (uint8).
+    Файл находится по хешу содержимого видео, поэтому переименование не
+    сбрасывает кэш, а замена файла сбрасывает. Другие настройки детектора
+    или шага кадров дают другой хеш настроек; запись нового файла удаляет
+    файлы того же видео с прежними настройками.
+    """
+
+    def __init__(self, root: str, store_crops: bool = True):
+        self.root = root
+        self.store_crops = store_crops
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(root, exist_ok=True)
+
+    def path_for(self, video_hash: str, settings: dict) -> str:
+        return os.path.join(self.root, f"{video_hash}-{settings_digest(settings)}.npz")
+
+    def load(self, video_hash: str, settings: dict):
+        """Возвращает CachedDetections или None, если кэша нет или он поврежден"""
+        path = self.path_for(video_hash, settings)
+        if not os.path.exists(path):
+            self.misses += 1
+            return None
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                meta = json.loads(str(data['meta']))
+                if meta.get('version') != CACHE_VERSION or meta.get('settings') != settings:
+                    raise ValueError('settings mismatch')
+                cached = CachedDetections(data, meta)
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable detection cache {path}: {str(e)}")
+            self.misses += 1
+            return None
+        self.hits += 1
+        return cached
+
+    def recorder(self, crop_size: int) -> DetectionRecorder:
+        return DetectionRecorder(crop_size if self.store_crops else 0)
+
+    def save(self, video_hash: str, settings: dict, recorder: DetectionRecorder, **meta) -> str:
+        path = self.path_for(video_hash, settings)
+        meta = dict(meta, version=CACHE_VERSION, settings=settings, video_hash=video_hash,
+                    created=time.time())
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        # Файл заменяется атомарно, параллельный читатель видит старую или новую версию
+        with open(tmp_path, 'wb') as cache_file:
+            np.savez(cache_file, meta=np.array(json.dumps(meta)), **recorder.arrays())
+        os.replace(tmp_path, path)
+        for stale in Path(self.root).glob(f"{video_hash}-*.npz"):
+            if str(stale) != path:
+                stale.unlink(missing_ok=True)
+        logger.info(f"Detection cache saved: {path} ({len(recorder.frames)} frames, "
+                    f"{os.path.getsize(path) // 1024} KB)")
+        return path
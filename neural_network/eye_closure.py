@@ -0,0 +1,129 @@
+
+import cv2
+import numpy as np
+import mediapipe as mp
+
+from neural_network.face_detection import DETECTION_TARGET_SIZE
+
+mp_face_mesh = mp.solutions.face_mesh
+
+# Точки век в сетке MediaPipe Face Mesh: уголок, два верхних, уголок, два нижних
+RIGHT_EYE = [33, 160, 158, 133, 153, 144]
+LEFT_EYE = [362, 385, 387, 263, 373, 380]
+EYE_POINTS = np.array([RIGHT_EYE, LEFT_EYE])
+
+# Пороги PERCLOS (доля времени с закрытыми глазами): до 7.5% - бодр,
+# от 15% - сонлив. Шкала переводится в оценку 0-1 так, чтобы эти границы
+# совпали с уровнями Low/Medium/High из predict.LEVEL_THRESHOLDS
+PERCLOS_POINTS = (0.0, 0.075, 0.15, 0.3)
+SCORE_POINTS = (0.0, 0.3, 0.7, 1.0)
+
+
+def eye_aspect_ratio(eyes: np.ndarray) -> np.ndarray:
+    """EAR по точкам глаз формы (..., 6, 2): сумма вертикалей к двойной горизонтали"""
+    vertical = (np.linalg.norm(eyes[..., 1, :] - eyes[..., 5, :], axis=-1) +
+                np.linalg.norm(eyes[..., 2, :] - eyes[..., 4, :], axis=-1))
+    horizontal = np.linalg.norm(eyes[..., 0, :] - eyes[..., 3, :], axis=-1)
+    return vertical / np.maximum(2.0 * horizontal, 1e-6)
+
+
+def perclos_score(perclos: float) -> float:
+    return float(np.interp(perclos, PERCLOS_POINTS, SCORE_POINTS))
+
+
+class EyeLandmarker:
+    def __init__(self, max_faces: int = 4, min_detection_confidence: float = 0.5,
+                 target_size: int = DETECTION_TARGET_SIZE):
+        # Face Mesh сам находит лица и отслеживает их между кадрами,
+        # поэтому в этом режиме отдельный детектор лиц не нужен
+        self.mesh = mp_face_mesh.FaceMesh(static_image_mode=False, max_num_faces=max_faces,
+                                          refine_landmarks=False,
+                                          min_detection_confidence=min_detection_confidence)
+        self.target_size = target_size
+
+    def detect(self, frame: np.ndarray):
+        """Возвращает (лица (x, y, width, height, 1.0), EAR каждого лица)"""
+        h, w = frame.shape[:2]
+        scale = min(1.0, self.target_size / max(h, w))
+        small = cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA) \
+            if scale < 1.0 else frame
+        results = self.mesh.process(cv2.cvtColor(small, cv2.COLOR_BGR2RGB))
+        if not results.multi_face_landmarks:
+            return [], np.empty(0)
+
+        # Все лица и оба глаза считаются одним векторным проходом
+        points = np.array([[(p.x, p.y) for p in face.landmark]
+                           for face in results.multi_face_landmarks]) * (w, h)
+        ratios = eye_aspect_ratio(points[:, EYE_POINTS]).mean(axis=1)
+        faces = []
+        for face_points in points:
+            x1, y1 = np.clip(face_points.min(axis=0), 0, None).astype(int)
+            x2, y2 = np.minimum(face_points.max(axis=0), (w, h)).astype(int)
+            faces.append((int(x1), int(y1), int(x2 - x1), int(y2 - y1), 1.0))
+        return faces, ratios
+
+
+class PerclosScorer:
+    def __init__(self, window: int = 180, closed_fraction: float = 0.65, min_samples: int = 10,
+                 baseline_percentile: float = 90.0):
+        # window - число последних обработанных кадров (при шаге 5 и 30 кадр/с это 30 секунд).
+        # Глаз считается закрытым, если EAR ниже closed_fraction от EAR открытых глаз
+        # этого человека (baseline_percentile-й процентиль окна): так не нужен
+        # общий порог для разной формы глаз и ракурсов камеры.
+        self.window = window
+        self.closed_fraction = closed_fraction
+        self.min_samples = min_samples
+        self.baseline_percentile = baseline_percentile
+        self._ratios = np.zeros(window, dtype=np.float32)
+        # Время каждого отсчета: кадры с камеры идут с неравными промежутками
+        self._times = np.zeros(window, dtype=np.float64)
+        self._count = 0
+
+    def add(self, ratio: float, t: float = 0.0):
+        self._ratios[self._count % self.window] = ratio
+        self._times[self._count % self.window] = t
+        self._count += 1
+
+    def window_sec(self) -> float:
+        """Длительность окна: промежуток между первым и последним отсчетом плюс
+        средний интервал, чтобы n отсчетов покрывали n интервалов"""
+        samples = min(self._count, self.window)
+        if samples < 2:
+            return 0.0
+        last = (self._count - 1) % self.window
+        first = (self._count - samples) % self.window
+        span = float(self._times[last] - self._times[first])
+        return span * samples / (samples - 1)
+
+    def _ordered(self) -> np.ndarray:
+        if self._count <= self.window:
+            return self._ratios[:self._count]
+        start = self._count % self.window
+        return np.concatenate((self._ratios[start:], self._ratios[:start]))
+
+    def closed(self) -> np.ndarray:
+        ratios = self._ordered()
+        if not len(ratios):
+            return np.zeros(0, dtype=bool)
+        baseline = np.percentile(ratios, self.baseline_percentile)
+        return ratios < self.closed_fraction * baseline
+
+    @property
+    def ready(self) -> bool:
+        return self._count >= self.min_samples
+
+    def perclos(self) -> float:
+        closed = self.closed()
+        return float(closed.mean()) if len(closed) else 0.0
+
+    def blinks(self) -> int:
+        """Число закрытий глаз в окне (переходов открыт -> закрыт)"""
+        closed = self.closed()
+        return int(np.count_nonzero(closed[1:] & ~closed[:-1])) if len(closed) > 1 else 0
+
+    def score(self) -> float:
+        return perclos_score(self.perclos())
+
+    def stats(self) -> dict:
+        return {'perclos': round(self.perclos(), 3), 'blinks': self.blinks(),
+                'samples': min(self._count, self.window), 'window_sec': self.window_sec()}
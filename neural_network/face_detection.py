@@ -0,0 +1,68 @@
+
+import cv2
+import numpy as np
+import mediapipe as mp
+
+mp_face_detection = mp.solutions.face_detection
+FaceDetection = mp_face_detection.FaceDetection
+
+# Длинная сторона кадра, до которой он уменьшается перед детекцией лиц.
+# Детектор MediaPipe сам работает на входе 128x128, поэтому полное
+# разрешение 1080p только тратит время на конвертацию цвета и масштабирование.
+DETECTION_TARGET_SIZE = 640
+
+class FaceDetector:
+    def __init__(self, min_detection_confidence: float = 0.7, detection_scale='auto',
+                 target_size: int = DETECTION_TARGET_SIZE):
+        # detection_scale: 'auto' - по разрешению кадра, число - фиксированный
+        # коэффициент, None - детекция на полном разрешении
+        self.detector = FaceDetection(min_detection_confidence=min_detection_confidence)
+        self.min_detection_confidence = min_detection_confidence
+        self.detection_scale = detection_scale
+        self.target_size = target_size
+
+    def settings(self) -> dict:
+        """Параметры, от которых зависят найденные лица (ключ кэша детекции)"""
+        return {'detector': 'mediapipe', 'min_detection_confidence': self.min_detection_confidence,
+                'detection_scale': self.detection_scale, 'target_size': self.target_size}
+
+    def scale_for(self, shape) -> float:
+        if self.detection_scale is None:
+            return 1.0
+        if self.detection_scale == 'auto':
+            longest = max(shape[:2])
+            return min(1.0, self.target_size / longest) if longest > 0 else 1.0
+        return min(1.0, float(self.detection_scale))
+
+    def detect(self, frame: np.ndarray) -> list:
+        """Возвращает список (x, y, width, height, score) в координатах исходного кадра"""
+        scale = self.scale_for(frame.shape)
+        if scale < 1.0:
+            small = cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        else:
+            small = frame
+        rgb_frame = cv2.cvtColor(small, cv2.COLOR_BGR2RGB)
+        results = self.detector.process(rgb_frame)
+
+        faces = []
+        if not results.detections:
+            return faces
+
+        # Координаты относительные, поэтому переносятся на исходный кадр без пересчета масштаба
+        h, w = frame.shape[:2]
+        for detection in results.detections:
+            bbox = detection.location_data.relative_bounding_box
+
+            x = int(bbox.xmin * w)
+            y = int(bbox.ymin * h)
+            width = int(bbox.width * w)
+            height = int(bbox.height * h)
+
+            x = max(0, x)
+            y = max(0, y)
+            width = min(w - x, width)
+            height = min(h - y, height)
+
+            score = detection.score[0] if detection.score else 0.0
+            faces.append((x, y, width, height, float(score)))
+        return faces
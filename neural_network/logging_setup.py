@@ -0,0 +1,238 @@
+
+import os
+import sys
+import json
+import time
+import queue
+import atexit
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+# Идентификаторы запроса и задачи попадают в каждую запись, сделанную в их контексте
+request_id_var = contextvars.ContextVar('request_id', default=None)
+job_id_var = contextvars.ContextVar('job_id', default=None)
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+_listener = None
+_handler = None
+_lock = threading.Lock()
+
+
+@contextmanager
+def log_context(request_id=None, job_id=None):
+    """Привязывает request_id и/или job_id к записям внутри блока"""
+    tokens = []
+    if request_id is not None:
+        tokens.append((request_id_var, request_id_var.set(request_id)))
+    if job_id is not None:
+        tokens.append((job_id_var, job_id_var.set(str(job_id))))
+    try:
+        yield
+    finally:
+        for var, token in reversed(tokens):
+            var.reset(token)
+
+
+class ContextFilter(logging.Filter):
+    """Запоминает идентификаторы в потоке, который пишет запись, до передачи в очередь"""
+
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        record.job_id = job_id_var.get()
+        return True
+
+
+class RateLimitFilter(logging.Filter):
+    """Ограничивает повторяющиеся предупреждения и ошибки.
+
+    Записи с одного места вызова (файл и строка) пропускаются не чаще burst раз
+    за interval секунд; число отброшенных попадает в поле suppressed следующей
+    пропущенной записи. Так битое видео с ошибкой на каждом кадре дает несколько
+    строк в журнале, а не тысячи.
+    """
+
+    def __init__(self, interval: float = 10.0, burst: int = 5, level: int = logging.WARNING):
+        super().__init__()
+        self.interval = interval
+        self.burst = burst
+        self.level = level
+        self._lock = threading.Lock()
+        self._windows = {}
+
+    def filter(self, record):
+        if record.levelno < self.level:
+            return True
+        key = (record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= self.interval:
+                suppressed = window[2] if window else 0
+                if len(self._windows) > 10000:
+                    self._windows.clear()
+                self._windows[key] = [now, 1, 0]
+            elif window[1] < self.burst:
+                window[1] += 1
+                suppressed = window[2]
+                window[2] = 0
+            else:
+                window[2] += 1
+                return False
+        if suppressed:
+            record.suppressed = suppressed
+        return True
+
+
+class BoundedQueueHandler(QueueHandler):
+    """Кладет запись в ограниченную очередь и сразу возвращается.
+
+    Форматирование (включая трассировку исключений) выполняет поток QueueListener.
+    Если очередь переполнена, запись отбрасывается, а число потерь добавляется
+    в поле dropped следующей записи.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        if self.dropped:
+            record.dropped = self.dropped
+        try:
+            self.queue.put_nowait(record)
+            self.dropped = 0
+        except queue.Full:
+            self.dropped += 1
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись - одна строка JSON"""
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for field in ('request_id', 'job_id', 'suppressed', 'dropped'):
+            value = getattr(record, field, None)
+            if value:
+                entry[field] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Читаемый формат для консоли с идентификаторами в конце строки"""
+
+    def format(self, record):
+        line = super().format(record)
+        extra = [f"{field}={getattr(record, field)}"
+                 for field in ('request_id', 'job_id', 'suppressed', 'dropped')
+                 if getattr(record, field, None)]
+        return f"{line} [{' '.join(extra)}]" if extra else line
+
+
+class _Listener(QueueListener):
+    def enqueue_sentinel(self):
+        # Очередь может быть заполнена: ждем, пока поток освободит место
+        self.queue.put(self._sentinel)
+
+
+def setup_logging(level=None, log_file=None, console=True):
+    """Настраивает неблокирующее логирование для процесса.
+
+    Обработчики корневого логгера заменяются одним QueueHandler; запись в консоль
+    и в файл с ротацией по размеру выполняет фоновый поток. Повторный вызов
+    ничего не делает, log_file=False отключает файл. Параметры по умолчанию
+    берутся из окружения: LOG_LEVEL, LOG_FILE, LOG_FORMAT (text/json для консоли;
+    файл всегда в JSON), LOG_MAX_BYTES, LOG_BACKUP_COUNT, LOG_QUEUE_SIZE,
+    LOG_RATE_INTERVAL, LOG_RATE_BURST.
+    """
+    global _listener, _handler
+    with _lock:
+        if _listener is not None:
+            return _listener
+
+        level = level or os.environ.get('LOG_LEVEL', 'INFO').upper()
+        if log_file is None:
+            log_file = os.environ.get('LOG_FILE')
+
+        handlers = []
+        if console:
+            stream = logging.StreamHandler(sys.stderr)
+            if os.environ.get('LOG_FORMAT', 'text').lower() == 'json':
+                stream.setFormatter(JsonFormatter())
+            else:
+                stream.setFormatter(TextFormatter(TEXT_FORMAT))
+            handlers.append(stream)
+        if log_file:
+            file_handler = RotatingFileHandler(
+                log_file, encoding='utf-8',
+                maxBytes=int(os.environ.get('LOG_MAX_BYTES', str(10 * 1024 * 1024))),
+                backupCount=int(os.environ.get('LOG_BACKUP_COUNT', '5'))
+            )
+            file_handler.setFormatter(JsonFormatter())
+            handlers.append(file_handler)
+
+        queue_handler = BoundedQueueHandler(queue.Queue(int(os.environ.get('LOG_QUEUE_SIZE', '10000'))))
+        # Сначала ограничение частоты: отброшенная запись не стоит ничего, кроме поиска в словаре
+        queue_handler.addFilter(RateLimitFilter(
+            interval=float(os.environ.get('LOG_RATE_INTERVAL', '10')),
+            burst=int(os.environ.get('LOG_RATE_BURST', '5'))
+        ))
+        queue_handler.addFilter(ContextFilter())
+
+        root = logging.getLogger()
+        for handler in root.handlers[:]:
+            root.removeHandler(handler)
+        root.addHandler(queue_handler)
+        root.setLevel(level)
+
+        _listener = _Listener(queue_handler.queue, *handlers, respect_handler_level=True)
+        _listener.start()
+        _handler = queue_handler
+        atexit.register(shutdown_logging)
+        return _listener
+
+
+def _restart_after_fork():
+    """Запускает фоновый поток заново в дочернем процессе.
+
+    Поток записи не переживает fork (gunicorn --preload, multiprocessing fork):
+    без перезапуска записи дочернего процесса копились бы в очереди и терялись.
+    Очередь создается новая - ее блокировки могли быть захвачены потоком родителя.
+    """
+    global _lock
+    _lock = threading.Lock()
+    if _listener is None:
+        return
+    log_queue = queue.Queue(_handler.queue.maxsize)
+    _handler.queue = _listener.queue = log_queue
+    _listener._thread = None
+    _listener.start()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_restart_after_fork)
+
+
+def shutdown_logging():
+    """Дописывает оставшиеся в очереди записи и останавливает фоновый поток"""
+    global _listener, _handler
+    with _lock:
+        if _listener is None:
+            return
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = _handler = None
@@ -0,0 +1,237 @@
+
+import time
+import queue
+import logging
+import multiprocessing
+from multiprocessing import shared_memory
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger("AnalysisPipeline")
+
+# Как часто (с) проверять, живы ли стадии, пока от детектора нет сообщений
+STAGE_POLL_INTERVAL = 1.0
+
+
+class PipelineError(Exception):
+    """Ошибка в одной из стадий конвейера"""
+
+
+def _attach(name: str, slots: int, shape: tuple):
+    # Дочерние процессы (spawn) используют трекер ресурсов родителя,
+    # сегмент удаляется один раз - родителем после остановки стадий
+    shm = shared_memory.SharedMemory(name=name)
+    ring = np.ndarray((slots,) + shape, dtype=np.uint8, buffer=shm.buf)
+    return shm, ring
+
+
+def _stage_stats(busy: float, started: float, items: int) -> dict:
+    wall = time.perf_counter() - started
+    return {'busy_sec': round(busy, 3), 'wall_sec': round(wall, 3), 'items': items,
+            'utilization': round(busy / wall, 3) if wall > 0 else 0.0}
+
+
+def _decode_stage(source, step, shm_name, slots, shape, free_slots, output, stop):
+    """Декодирует видео и кладет каждый step-й кадр в свободный слот кольцевого буфера"""
+    shm, ring = _attach(shm_name, slots, shape)
+    cap = cv2.VideoCapture(source)
+    started = time.perf_counter()
+    busy = 0.0
+    frame_count = 0
+    sent = 0
+    try:
+        if not cap.isOpened():
+            output.put(('error', f"Failed to open video source: {source}"))
+            return
+        while not stop.is_set():
+            t = time.perf_counter()
+            # Пропускаемые кадры только демультиплексируются и декодируются, без конвертации
+            if not cap.grab():
+                break
+            frame_count += 1
+            busy += time.perf_counter() - t
+            if frame_count % step:
+                continue
+
+            slot = free_slots.get()
+            if slot is None:
+                break
+            t = time.perf_counter()
+            ret, frame = cap.retrieve(ring[slot])
+            if not ret:
+                free_slots.put(slot)
+                break
+            if not np.shares_memory(frame, ring):
+                if frame.shape != shape:
+                    cv2.resize(frame, (shape[1], shape[0]), dst=ring[slot])
+                else:
+                    ring[slot][...] = frame
+            busy += time.perf_counter() - t
+            output.put(('frame', slot, frame_count, None))
+            sent += 1
+        output.put(('end', frame_count, {'decode': _stage_stats(busy, started, sent)}))
+    except Exception as e:
+        output.put(('error', f"Decode stage error: {str(e)}"))
+    finally:
+        cap.release()
+        del ring
+        shm.close()
+
+
+def _detect_stage(shm_name, slots, shape, detection_scale, source_queue, output):
+    """Находит лица в кадрах из буфера и передает координаты дальше"""
+    shm, ring = _attach(shm_name, slots, shape)
+    started = time.perf_counter()
+    busy = 0.0
+    items = 0
+    try:
+        from neural_network.face_detection import FaceDetector
+        detector = FaceDetector(min_detection_confidence=0.7, detection_scale=detection_scale)
+        # Время загрузки графа MediaPipe не входит в загрузку стадии
+        started = time.perf_counter()
+        while True:
+            message = source_queue.get()
+            if message[0] != 'frame':
+                if message[0] == 'end':
+                    message[2]['detect'] = _stage_stats(busy, started, items)
+                output.put(message)
+                break
+            _, slot, frame_count, _ = message
+            t = time.perf_counter()
+            faces = detector.detect(ring[slot])
+            busy += time.perf_counter() - t
+            items += 1
+            output.put(('frame', slot, frame_count, faces))
+    except Exception as e:
+        output.put(('error', f"Detection stage error: {str(e)}"))
+    finally:
+        del ring
+        shm.close()
+
+
+def probe_frame_shape(source) -> tuple:
+    cap = cv2.VideoCapture(source)
+    try:
+        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    finally:
+        cap.release()
+    if width <= 0 or height <= 0:
+        raise PipelineError(f"Failed to read frame size: {source}")
+    return height, width, 3
+
+
+class FramePipeline:
+    """Конвейер декодирование -> детекция -> инференс для одного видео.
+
+    Декодер и детектор работают в отдельных процессах, инференс - в процессе,
+    который перебирает кадры. Кадры передаются через кольцевой буфер в общей
+    памяти: по очередям ходят только номера слотов и координаты лиц. Число
+    слотов ограничивает объем памяти и число кадров в работе.
+
+    Итерация возвращает (номер кадра, кадр, лица). Кадр - представление слота,
+    оно действительно до следующего шага итерации.
+    """
+
+    def __init__(self, source, step: int = 5, slots: int = 8, detection_scale='auto'):
+        self.source = str(source)
+        self.step = step
+        self.slots = slots
+        self.detection_scale = detection_scale
+        self.shape = probe_frame_shape(self.source)
+        self.frames_read = 0
+        self.stats = {}
+
+    def __iter__(self):
+        context = multiprocessing.get_context('spawn')
+        frame_bytes = int(np.prod(self.shape))
+        shm = shared_memory.SharedMemory(create=True, size=frame_bytes * self.slots)
+        ring = np.ndarray((self.slots,) + self.shape, dtype=np.uint8, buffer=shm.buf)
+        free_slots = context.Queue()
+        decoded = context.Queue()
+        detected = context.Queue()
+        stop = context.Event()
+        for slot in range(self.slots):
+            free_slots.put(slot)
+
+        processes = [
+            context.Process(target=_decode_stage, name='pipeline-decode', daemon=True,
+                            args=(self.source, self.step, shm.name, self.slots, self.shape,
+                                  free_slots, decoded, stop)),
+            context.Process(target=_detect_stage, name='pipeline-detect', daemon=True,
+                            args=(shm.name, self.slots, self.shape, self.detection_scale,
+                                  decoded, detected)),
+        ]
+        for process in processes:
+            process.start()
+
+        started = time.perf_counter()
+        busy = 0.0
+        items = 0
+        finished = False
+        try:
+            while True:
+                message = self._next_message(detected, processes)
+                if message[0] == 'error':
+                    raise PipelineError(message[1])
+                if message[0] == 'end':
+                    self.frames_read = message[1]
+                    self.stats = message[2]
+                    finished = True
+                    break
+                _, slot, frame_count, faces = message
+                self.frames_read = frame_count
+                t = time.perf_counter()
+                yield frame_count, ring[slot], faces
+                busy += time.perf_counter() - t
+                items += 1
+                free_slots.put(slot)
+        finally:
+            self.stats['inference'] = _stage_stats(busy, started, items)
+            if not finished:
+                # Досрочная остановка: декодер может ждать свободный слот
+                stop.set()
+                free_slots.put(None)
+            for process in processes:
+                process.join(timeout=5)
+                if process.is_alive():
+                    process.terminate()
+                    process.join()
+            for q in (free_slots, decoded, detected):
+                q.cancel_join_thread()
+                q.close()
+            del ring
+            try:
+                shm.close()
+            except BufferError:
+                # Вызывающий код еще держит представление последнего кадра;
+                # отображение освободится вместе с ним
+                pass
+            shm.unlink()
+            logger.info("Pipeline stage utilization: " + ', '.join(
+                f"{name} {stage['utilization']:.0%}" for name, stage in self.stats.items()))
+
+    @staticmethod
+    def _next_message(detected, processes: list):
+        """Следующее сообщение детектора; PipelineError, если стадия завершилась аварийно.
+
+        Стадия, убитая сигналом или OOM, не успевает отправить 'error', и без проверки
+        итерация ждала бы вечно. Декодер штатно завершается раньше детектора, поэтому
+        аварией считается его ненулевой код выхода, а для детектора - любой выход.
+        """
+        while True:
+            try:
+                return detected.get(timeout=STAGE_POLL_INTERVAL)
+            except queue.Empty:
+                pass
+            failed = [process for process in processes if process.exitcode is not None and
+                      (process.exitcode != 0 or process is processes[-1])]
+            if not failed:
+                continue
+            try:
+                # Последнее сообщение могло прийти уже после проверки
+                return detected.get(timeout=STAGE_POLL_INTERVAL)
+            except queue.Empty:
+                raise PipelineError(f"Pipeline stage {failed[0].name} exited unexpectedly "
+                                    f"(exit code {failed[0].exitcode})")
@@ -2,27 +2,240 @@
 import cv2
 import numpy as np
 import tensorflow as tf
-import mediapipe as mp
+import os
 import time
+import json
+import hashlib
 from pathlib import Path
+from statistics import NormalDist
 import logging
 
-# Настройка логирования
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler()
-    ]
-)
+# Детектор лиц вынесен в отдельный модуль, чтобы процессы конвейера
+# могли использовать его без загрузки TensorFlow
+from neural_network.face_detection import FaceDetector
+from neural_network.logging_setup import setup_logging, log_context
+from neural_network.video_writer import AnnotatedVideoWriter, draw_overlays
+from neural_network.detection_cache import DetectionCache, CachedFacesReader
 
 logger = logging.getLogger("FatigueAnalyzer")
 
-mp_face_detection = mp.solutions.face_detection
-FaceDetection = mp_face_detection.FaceDetection
+MODEL_PATH = 'neural_network/data/models/fatigue_model.keras'
+
+_fingerprint_cache = {}
+
+def file_fingerprint(path: str) -> str:
+    """Начало sha256 от содержимого файла; пересчитывается при изменении размера или mtime"""
+    stat = Path(path).stat()
+    key = (str(Path(path).resolve()), stat.st_size, stat.st_mtime_ns)
+    if key not in _fingerprint_cache:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as source_file:
+            for chunk in iter(lambda: source_file.read(1024 * 1024), b''):
+                digest.update(chunk)
+        _fingerprint_cache[key] = digest.hexdigest()[:16]
+    return _fingerprint_cache[key]
+
+def model_fingerprint(model_path: str = MODEL_PATH) -> str:
+    """Версия модели - начало sha256 от содержимого файла.
+
+    Сохраняется вместе с результатами анализа, чтобы после выкладки
+    новой модели можно было найти устаревшие результаты.
+    """
+    return file_fingerprint(model_path)
+
+# Размер входа модели
+FACE_SIZE = 48
+
+# Границы уровней усталости: Low < 0.3 <= Medium < 0.7 <= High
+LEVEL_THRESHOLDS = (0.3, 0.7)
+
+def score_level(score: float) -> str:
+    if score < LEVEL_THRESHOLDS[0]:
+        return "Low"
+    elif score < LEVEL_THRESHOLDS[1]:
+        return "Medium"
+    return "High"
+
+def format_score(score: float) -> dict:
+    level = score_level(score)
+    logger.info(f"Final score: {score:.2f}, level: {level}")
+    return {
+        'level': level,
+        'score': round(float(score), 2),
+        'percent': round(float(score) * 100, 1)
+    }
+
+class FacePreprocessor:
+    def __init__(self, capacity: int = 4, size: int = FACE_SIZE):
+        # Буферы переиспользуются между кадрами и растут только при нехватке места,
+        # поэтому на каждый кадр не создаются временные массивы
+        self.size = size
+        self._resized = np.empty((0, size, size, 3), dtype=np.uint8)
+        self._batch = np.empty((0, size, size, 3), dtype=np.float32)
+        self._reserve(capacity)
+
+    def _reserve(self, count: int):
+        if count <= len(self._batch):
+            return
+        capacity = max(count, 2 * len(self._batch))
+        self._resized = np.empty((capacity, self.size, self.size, 3), dtype=np.uint8)
+        self._batch = np.empty((capacity, self.size, self.size, 3), dtype=np.float32)
+
+    def preprocess(self, faces: list) -> np.ndarray:
+        """Масштабирует и нормализует кропы лиц в общий батч.
+
+        Возвращает представление внутреннего буфера формы (N, size, size, 3),
+        которое действительно до следующего вызова.
+        """
+        count = len(faces)
+        self._reserve(count)
+        for i, face in enumerate(faces):
+            if face is None or face.size == 0:
+                logger.error("Empty face region for preprocessing")
+                self._resized[i].fill(0)
+                continue
+            try:
+                cv2.resize(face, (self.size, self.size), dst=self._resized[i])
+            except Exception as e:
+                logger.error(f"Face preprocessing error: {str(e)}")
+                self._resized[i].fill(0)
+        # Приведение типа и нормализация на месте, без промежуточных буферов
+        batch = self._batch[:count]
+        np.copyto(batch, self._resized[:count])
+        np.multiply(batch, np.float32(1.0 / 255.0), out=batch)
+        return batch
+
+def iou_matrix(boxes_a: np.ndarray, boxes_b: np.ndarray) -> np.ndarray:
+    """Попарный IoU прямоугольников (x, y, width, height)"""
+    ax1, ay1 = boxes_a[:, 0:1], boxes_a[:, 1:2]
+    ax2, ay2 = ax1 + boxes_a[:, 2:3], ay1 + boxes_a[:, 3:4]
+    bx1, by1 = boxes_b[:, 0], boxes_b[:, 1]
+    bx2, by2 = bx1 + boxes_b[:, 2], by1 + boxes_b[:, 3]
+    inter = (np.clip(np.minimum(ax2, bx2) - np.maximum(ax1, bx1), 0, None) *
+             np.clip(np.minimum(ay2, by2) - np.maximum(ay1, by1), 0, None))
+    union = boxes_a[:, 2:3] * boxes_a[:, 3:4] + boxes_b[:, 2] * boxes_b[:, 3] - inter
+    return np.where(union > 0, inter / np.maximum(union, 1e-9), 0.0)
+
+class FaceTracker:
+    def __init__(self, iou_threshold: float = 0.3, max_missed: int = 15):
+        # Лица связываются между кадрами по перекрытию рамок; в кабине люди почти
+        # не меняются местами, поэтому жадного сопоставления по IoU достаточно.
+        # Трек удаляется после max_missed обработанных кадров без совпадения.
+        self.iou_threshold = iou_threshold
+        self.max_missed = max_missed
+        self.tracks = {}
+        self._next_id = 1
+
+    def reset(self):
+        self.tracks = {}
+        self._next_id = 1
+
+    def update(self, boxes: list) -> list:
+        """Возвращает идентификатор для каждой рамки (x, y, width, height)"""
+        ids = [None] * len(boxes)
+        track_ids = list(self.tracks)
+        if boxes and track_ids:
+            overlap = iou_matrix(np.array([self.tracks[t]['box'] for t in track_ids], dtype=np.float64),
+                                 np.array(boxes, dtype=np.float64))
+            # Пары в порядке убывания IoU, каждый трек и каждая рамка используются один раз
+            for flat in np.argsort(overlap, axis=None)[::-1]:
+                t, b = divmod(int(flat), len(boxes))
+                if overlap[t, b] < self.iou_threshold:
+                    break
+                if ids[b] is None and self.tracks[track_ids[t]]['missed'] >= 0:
+                    ids[b] = track_ids[t]
+                    self.tracks[track_ids[t]]['missed'] = -1
+
+        for track in self.tracks.values():
+            track['missed'] += 1
+        for b, box in enumerate(boxes):
+            if ids[b] is None:
+                ids[b] = self._next_id
+                self._next_id += 1
+                self.tracks[ids[b]] = {'box': box, 'missed': 0}
+            else:
+                self.tracks[ids[b]]['box'] = box
+        for track_id in [t for t, track in self.tracks.items() if track['missed'] > self.max_missed]:
+            del self.tracks[track_id]
+        return ids
+
+class MotionGate:
+    def __init__(self, threshold: float = 2.0, max_reuse: int = 10, size: int = 32, margin: float = 0.2):
+        # Кадр считается неизменным, если средняя абсолютная разница уменьшенной
+        # серой области лиц (или всего кадра, если лиц нет) с последним полностью
+        # обработанным кадром меньше threshold (шкала 0-255). Не больше max_reuse
+        # кадров подряд получают оценки предыдущего, затем кадр обрабатывается заново.
+        self.threshold = threshold
+        self.max_reuse = max_reuse
+        self.size = size
+        self.margin = margin
+        self.reset()
+
+    def reset(self):
+        self.faces = []
+        self.predictions = []
+        self._reference = None
+        self._roi = None
+        self._streak = 0
+        self.frames = 0
+        self.reused = 0
+        self._deviations = []
+
+    def _sample(self, frame: np.ndarray, roi) -> np.ndarray:
+        if roi is not None:
+            x1, y1, x2, y2 = roi
+            frame = frame[y1:y2, x1:x2]
+        # Грубое прореживание перед INTER_AREA: для полного кадра 1080p масштабирование дешевле
+        step = max(1, min(frame.shape[:2]) // (self.size * 4))
+        small = cv2.resize(frame[::step, ::step], (self.size, self.size), interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+
+    def unchanged(self, frame: np.ndarray) -> bool:
+        """True, если можно переиспользовать лица и оценки последнего обработанного кадра"""
+        self.frames += 1
+        if self._reference is None or self._streak >= self.max_reuse:
+            return False
+        sample = self._sample(frame, self._roi)
+        if cv2.norm(sample, self._reference, cv2.NORM_L1) / sample.size >= self.threshold:
+            return False
+        self._streak += 1
+        self.reused += 1
+        return True
+
+    def remember(self, frame: np.ndarray, faces: list, predictions):
+        """Запоминает полностью обработанный кадр как новый эталон"""
+        predictions = [float(p) for p in predictions]
+        # Расхождение оценок после серии повторов показывает, насколько они устарели
+        if self._streak and len(predictions) == len(self.predictions) and predictions:
+            self._deviations.append(max(abs(a - b) for a, b in zip(predictions, self.predictions)))
+        self._streak = 0
+        self.faces = faces
+        self.predictions = predictions
+        self._roi = None
+        if faces:
+            h, w = frame.shape[:2]
+            x1 = min(face[0] for face in faces)
+            y1 = min(face[1] for face in faces)
+            x2 = max(face[0] + face[2] for face in faces)
+            y2 = max(face[1] + face[3] for face in faces)
+            pad_x, pad_y = int((x2 - x1) * self.margin), int((y2 - y1) * self.margin)
+            self._roi = (max(0, x1 - pad_x), max(0, y1 - pad_y), min(w, x2 + pad_x), min(h, y2 + pad_y))
+        self._reference = self._sample(frame, self._roi)
+
+    def stats(self) -> dict:
+        return {
+            'threshold': self.threshold,
+            'frames': self.frames,
+            'reused': self.reused,
+            'reused_fraction': round(self.reused / self.frames, 3) if self.frames else 0.0,
+            'refresh_deviation_mean': round(float(np.mean(self._deviations)), 4) if self._deviations else None,
+            'refresh_deviation_max': round(float(np.max(self._deviations)), 4) if self._deviations else None,
+        }
 
 class FatigueAnalyzer:
-    def __init__(self, model_path: str, buffer_size: int = 15):
+    def __init__(self, model_path: str, buffer_size: int = 15, detection_scale='auto',
+                 multi_face: bool = False, motion_gate: MotionGate = None, scoring: str = 'cnn',
+                 ambiguous_range=(0.2, 0.8)):
         try:
             # Проверка существования файла модели
             if not Path(model_path).exists():
@@ -30,126 +243,406 @@ class FatigueAnalyzer:
                 raise FileNotFoundError(f"Model file not found: {model_path}")
                 
             self.model = tf.keras.models.load_model(model_path)
-            logger.info(f"Model loaded successfully from {model_path}")
+            self.model_version = model_fingerprint(model_path)
+            logger.info(f"Model loaded successfully from {model_path} (version {self.model_version})")
         except Exception as e:
             logger.error(f"Error loading model: {str(e)}")
             raise
             
         self.buffer = []
         self.buffer_size = buffer_size
-        self.face_detector = FaceDetection(min_detection_confidence=0.7)
+        # Оценки, полученные на последнем обработанном кадре, и общее число оценок
+        self.last_frame_scores = []
+        self.last_face_present = False
+        self.sample_count = 0
+        self.face_detector = FaceDetector(min_detection_confidence=0.7, detection_scale=detection_scale)
+        self.preprocessor = FacePreprocessor()
         self.last_face_time = time.time()
+        # Режим нескольких лиц: у каждого человека в кадре свой буфер оценок
+        self.multi_face = multi_face
+        self.tracker = FaceTracker()
+        self.identities = {}
+        self.last_frame_identities = []
+        self.last_overlays = []
+        self.frame_index = 0
+        # Время обрабатываемого кадра в секундах от начала источника; задает цикл анализа,
+        # потому что с камеры кадры приходят с неравными промежутками
+        self.frame_time = 0.0
+        # Пропуск почти неизменных кадров (None - каждый кадр обрабатывается полностью)
+        self.motion_gate = motion_gate
+        # Оценка лица: cnn - модель, perclos - доля времени с закрытыми глазами
+        # по точкам Face Mesh, hybrid - PERCLOS, а модель только для оценок
+        # внутри ambiguous_range и пока окно PERCLOS не набрано
+        self.scoring = scoring
+        self.ambiguous_range = ambiguous_range
+        self._eye_landmarker = None
+        self.eye_scorers = {}
+        self.cnn_faces = 0
+        # recorder(frame, faces) получает лица каждого кадра для кэша детекции
+        self.face_recorder = None
         logger.info("FatigueAnalyzer initialized successfully")
 
-    def process_frame(self, frame: np.ndarray) -> np.ndarray:
-        if frame is None:
+    def process_frame(self, frame: np.ndarray, faces: list = None, scores=None) -> np.ndarray:
+        """Анализирует кадр; faces - уже найденные лица (например, стадией детекции конвейера).
+
+        scores - оценки модели для этих лиц, посчитанные заранее по кропам из кэша
+        детекции: тогда кадр не нужен (frame=None), а разметка не рисуется.
+        """
+        self.last_frame_scores = []
+        self.last_frame_identities = []
+        self.last_face_present = False
+        # Разметка кадра; запись видео переносит ее на непроанализированные кадры
+        self.last_overlays = []
+        self.frame_index += 1
+        if frame is None and scores is None:
             logger.error("Received None frame")
             return np.zeros((300, 300, 3), dtype=np.uint8)
         
-        if frame.size == 0 or len(frame.shape) < 3:
+        if frame is not None and (frame.size == 0 or len(frame.shape) < 3):
             logger.error(f"Invalid frame format: shape={frame.shape if hasattr(frame, 'shape') else 'unknown'}")
             return np.zeros((300, 300, 3), dtype=np.uint8)
             
         try:
-            rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            results = self.face_detector.process(rgb_frame)
+            gate = self.motion_gate if frame is not None else None
+            reused = gate is not None and gate.unchanged(frame)
+            eye_ratios = None
+            if reused:
+                # Кадр почти не изменился: детекция и инференс не нужны
+                faces, predictions = gate.faces, gate.predictions
+            elif self.scoring != 'cnn':
+                # Face Mesh находит лица и точки век за один проход
+                faces, eye_ratios = self.eye_landmarker.detect(frame)
+            elif faces is None:
+                faces = self.face_detector.detect(frame)
+            if self.face_recorder is not None:
+                # Лица записываются в кэш детекции до фильтрации
+                self.face_recorder(frame, faces or [])
             
-            if results.detections:
+            if faces:
                 self.last_face_time = time.time()
-                for detection in results.detections:
-                    bbox = detection.location_data.relative_bounding_box
-                    h, w = frame.shape[:2]
-                    
-                    x = int(bbox.xmin * w)
-                    y = int(bbox.ymin * h)
-                    width = int(bbox.width * w)
-                    height = int(bbox.height * h)
-                    
-                    x = max(0, x)
-                    y = max(0, y)
-                    width = min(w - x, width)
-                    height = min(h - y, height)
-
-                    if width > 10 and height > 10:
-                        try:
-                            face_roi = frame[y:y+height, x:x+width]
-                            processed = self._preprocess_face(face_roi)
-                            prediction = self.model.predict(processed[None, ...], verbose=0)[0][0]
-                            self._update_buffer(prediction)
-                            
-                            color = (0, 0, 255) if prediction > 0.5 else (0, 255, 0)
-                            cv2.rectangle(frame, (x, y), (x+width, y+height), color, 2)
-                            cv2.putText(frame, f"Fatigue: {np.mean(self.buffer):.2f}", 
-                                       (x, y-10), cv2.FONT_HERSHEY_SIMPLEX, 0.7, color, 2)
-                        except Exception as e:
-                            logger.error(f"Processing error: {str(e)}")
+                self.last_face_present = True
+                keep = [i for i, face in enumerate(faces) if face[2] > 10 and face[3] > 10]
+                faces = [faces[i] for i in keep]
+                if eye_ratios is not None:
+                    eye_ratios = eye_ratios[keep]
+                if scores is not None:
+                    scores = scores[keep]
+                if faces:
+                    if self.tracks_faces:
+                        identities = self.tracker.update([face[:4] for face in faces])
+                    if not reused:
+                        if scores is not None:
+                            predictions = scores
+                        elif eye_ratios is None:
+                            predictions = self._predict_cnn(frame, faces)
+                        else:
+                            predictions = self._predict_eyes(frame, faces, eye_ratios, identities)
+                        if gate is not None and len(predictions):
+                            gate.remember(frame, faces, predictions)
+                    for i, ((x, y, width, height, _), prediction) in enumerate(zip(faces, predictions)):
+                        if self.multi_face:
+                            buffer = self._update_identity(identities[i], float(prediction))
+                            label = f"#{identities[i]} Fatigue: {np.mean(buffer):.2f}"
+                        else:
+                            self._update_buffer(float(prediction))
+                            label = f"Fatigue: {np.mean(self.buffer):.2f}"
+                        
+                        color = (0, 0, 255) if prediction > 0.5 else (0, 255, 0)
+                        self.last_overlays.append(('box', x, y, width, height, label, color))
+                elif gate is not None and not reused:
+                    gate.remember(frame, [], [])
             else:
-                if time.time() - self.last_face_time > 2:
+                if gate is not None and not reused:
+                    gate.remember(frame, [], [])
+                if self.tracks_faces:
+                    # Пропуски кадров учитываются трекером; без лица оценку некому приписать
+                    self.tracker.update([])
+                if not self.multi_face and time.time() - self.last_face_time > 2:
                     self._update_buffer(1.0)  # Если лицо не найдено долго, считаем что человек устал/отвлекся
                     # Добавляем текст для информирования
-                    h, w = frame.shape[:2]
-                    cv2.putText(frame, "No face detected", (w//2-100, h//2),
-                              cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
+                    self.last_overlays.append(('text', "No face detected", (0, 0, 255)))
             
-            return frame
+            return draw_overlays(frame, self.last_overlays) if frame is not None else None
         except Exception as e:
             logger.error(f"Frame processing error: {str(e)}")
             return frame
 
-    def _preprocess_face(self, face: np.ndarray) -> np.ndarray:
+    @property
+    def tracks_faces(self) -> bool:
+        # Трекер нужен для буферов по людям и для окон PERCLOS каждого человека
+        return self.multi_face or self.scoring != 'cnn'
+
+    @property
+    def eye_landmarker(self):
+        if self._eye_landmarker is None:
+            from neural_network.eye_closure import EyeLandmarker
+            self._eye_landmarker = EyeLandmarker()
+        return self._eye_landmarker
+
+    def predict_crops(self, crops: np.ndarray, batch_size: int = 256) -> np.ndarray:
+        """Оценки модели для кропов лиц размера входа модели, большими батчами"""
+        self.cnn_faces += len(crops)
+        scores = np.empty(len(crops), dtype=np.float32)
+        for start in range(0, len(crops), batch_size):
+            chunk = crops[start:start + batch_size]
+            scores[start:start + len(chunk)] = self.model.predict(
+                chunk.astype(np.float32) * np.float32(1.0 / 255.0), verbose=0)[:, 0]
+        return scores
+
+    def _predict_cnn(self, frame: np.ndarray, faces: list):
+        self.cnn_faces += len(faces)
         try:
-            if face is None or face.size == 0:
-                logger.error("Empty face region for preprocessing")
-                return np.zeros((48, 48, 3), dtype=np.float32)
-                
-            face = cv2.resize(face, (48, 48))
-            return face.astype(np.float32) / 255.0
+            # Все лица кадра обрабатываются одним батчем
+            batch = self.preprocessor.preprocess(
+                [frame[y:y+height, x:x+width] for x, y, width, height, _ in faces])
+            return self.model.predict(batch, verbose=0)[:, 0]
         except Exception as e:
-            logger.error(f"Face preprocessing error: {str(e)}")
-            # Возвращаем пустой массив подходящей формы в случае ошибки
-            return np.zeros((48, 48, 3), dtype=np.float32)
+            logger.error(f"Processing error: {str(e)}")
+            return []
+
+    def _predict_eyes(self, frame: np.ndarray, faces: list, eye_ratios: np.ndarray, identities: list):
+        """Оценка по PERCLOS; в режиме hybrid неоднозначные лица досчитываются моделью"""
+        from neural_network.eye_closure import PerclosScorer
+
+        predictions = np.empty(len(faces), dtype=np.float32)
+        ambiguous = []
+        for i, (identity, ratio) in enumerate(zip(identities, eye_ratios)):
+            scorer = self.eye_scorers.setdefault(identity, PerclosScorer())
+            scorer.add(ratio, self.frame_time)
+            predictions[i] = scorer.score()
+            low, high = self.ambiguous_range
+            if self.scoring == 'hybrid' and (not scorer.ready or low <= predictions[i] <= high):
+                ambiguous.append(i)
+        if ambiguous:
+            cnn = self._predict_cnn(frame, [faces[i] for i in ambiguous])
+            if len(cnn) == len(ambiguous):
+                predictions[ambiguous] = cnn
+        return predictions
+
+    def scoring_stats(self) -> dict:
+        """Режим оценки, доля лиц, прошедших через модель, и PERCLOS по людям"""
+        faces = self.sample_count
+        stats = {'mode': self.scoring, 'cnn_faces': self.cnn_faces,
+                 'cnn_fraction': round(min(1.0, self.cnn_faces / faces), 3) if faces else 0.0}
+        if self.eye_scorers:
+            stats['eyes'] = {identity: scorer.stats() for identity, scorer in sorted(self.eye_scorers.items())}
+        return stats
+
+    def reset(self, multi_face: bool = None):
+        """Сбрасывает состояние перед анализом нового источника, модель остается загруженной"""
+        self.buffer = []
+        self.last_frame_scores = []
+        self.last_frame_identities = []
+        self.last_overlays = []
+        self.last_face_present = False
+        self.sample_count = 0
+        self.last_face_time = time.time()
+        self.tracker.reset()
+        self.identities = {}
+        self.frame_index = 0
+        self.frame_time = 0.0
+        self.eye_scorers = {}
+        self.cnn_faces = 0
+        if self.motion_gate is not None:
+            self.motion_gate.reset()
+        if multi_face is not None:
+            self.multi_face = multi_face
 
     def _update_buffer(self, value: float):
+        self.last_frame_scores.append(value)
+        self.sample_count += 1
         self.buffer.append(value)
         if len(self.buffer) > self.buffer_size:
             self.buffer.pop(0)
 
+    def _update_identity(self, identity: int, value: float) -> list:
+        state = self.identities.setdefault(identity, {
+            'buffer': [], 'samples': 0, 'total': 0.0,
+            'first_sec': self.frame_time, 'last_sec': self.frame_time})
+        state['buffer'].append(value)
+        if len(state['buffer']) > self.buffer_size:
+            state['buffer'].pop(0)
+        state['samples'] += 1
+        state['total'] += value
+        state['last_sec'] = self.frame_time
+        self.last_frame_scores.append(value)
+        self.last_frame_identities.append(identity)
+        self.sample_count += 1
+        return state['buffer']
+
+    def get_identity_scores(self, min_samples: int = 5) -> list:
+        """Итог по каждому человеку; короткие треки (ложные срабатывания) отбрасываются"""
+        result = []
+        for identity, state in sorted(self.identities.items()):
+            if state['samples'] < min_samples:
+                continue
+            score = float(np.mean(state['buffer']))
+            result.append({
+                'id': identity,
+                'level': score_level(score),
+                'score': round(score, 2),
+                'percent': round(score * 100, 1),
+                'samples': state['samples'],
+                'mean_score': round(state['total'] / state['samples'], 2),
+                'first_sec': round(state['first_sec'], 2),
+                'last_sec': round(state['last_sec'], 2),
+            })
+        return result
+
     def get_final_score(self) -> dict:
+        if self.multi_face:
+            # Итог по экипажу определяется самым уставшим человеком
+            identities = self.get_identity_scores() or self.get_identity_scores(min_samples=1)
+            if not identities:
+                logger.warning("No data in buffer for scoring")
+                return {'level': 'No data', 'score': 0.0, 'percent': 0.0}
+            return format_score(max(identity['score'] for identity in identities))
         if not self.buffer:
             logger.warning("No data in buffer for scoring")
             return {'level': 'No data', 'score': 0.0, 'percent': 0.0}
             
-        avg_score = np.mean(self.buffer)
-        if avg_score < 0.3:
-            level = "Low"
-        elif avg_score < 0.7:
-            level = "Medium"
-        else:
-            level = "High"
-            
-        logger.info(f"Final score: {avg_score:.2f}, level: {level}")
-        return {
-            'level': level,
-            'score': round(avg_score, 2),
-            'percent': round(avg_score * 100, 1)
-        }
+        return format_score(np.mean(self.buffer))
+
+class SequentialScorer:
+    def __init__(self, confidence: float = 0.95, min_duration: float = 10.0, min_samples: int = 10):
+        # Доверительный интервал для среднего по всем оценкам (алгоритм Уэлфорда).
+        # Соседние кадры коррелированы, поэтому интервал оптимистичен - от раннего
+        # решения страхуют минимальная длительность и минимальное число оценок.
+        self.z = NormalDist().inv_cdf((1 + confidence) / 2)
+        self.min_duration = min_duration
+        self.min_samples = min_samples
+        self.count = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+
+    def add(self, value: float):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (value - self.mean)
+
+    def interval(self) -> tuple:
+        if self.count < 2:
+            return 0.0, 1.0
+        std_error = (self._m2 / (self.count - 1)) ** 0.5 / self.count ** 0.5
+        margin = self.z * std_error
+        return self.mean - margin, self.mean + margin
+
+    def is_certain(self, position: float) -> bool:
+        """Уровень определен, если весь доверительный интервал лежит внутри одного уровня"""
+        if self.count < self.min_samples or position < self.min_duration:
+            return False
+        low, high = self.interval()
+        return score_level(low) == score_level(high)
+
+    def get_final_score(self) -> dict:
+        if not self.count:
+            logger.warning("No data in buffer for scoring")
+            return {'level': 'No data', 'score': 0.0, 'percent': 0.0}
+        return format_score(self.mean)
+
+# Анализируется каждый N-й кадр
+FRAME_STEP = 5
 
-def analyze_source(source, is_video_file=False, output_file=None):
+class FrameReader:
+    """Последовательное чтение кадров в текущем потоке.
+
+    Итерация возвращает (номер кадра, кадр, None) для каждого step-го кадра;
+    промежуточные кадры только захватываются (grab) без конвертации. Если задан
+    on_skipped, промежуточные кадры декодируются и передаются ему (номер, кадр) -
+    так запись видео получает все кадры источника.
+    """
+
+    def __init__(self, cap, step: int = FRAME_STEP, on_skipped=None):
+        self.cap = cap
+        self.step = step
+        self.on_skipped = on_skipped
+        self.frames_read = 0
+        self.stats = {}
+
+    def __iter__(self):
+        while self.cap.isOpened():
+            if not self.cap.grab():
+                break
+            self.frames_read += 1
+            if self.frames_read % self.step:
+                if self.on_skipped is not None:
+                    ret, frame = self.cap.retrieve()
+                    if ret:
+                        self.on_skipped(self.frames_read, frame)
+                continue
+            ret, frame = self.cap.retrieve()
+            if not ret:
+                break
+            yield self.frames_read, frame, None
+
+def analyze_source(source, is_video_file=False, output_file=None, sequential=False,
+                   confidence=0.95, min_duration=10.0, return_report=False,
+                   analyzer=None, model_path=MODEL_PATH, display=None, record_timeline=False,
+                   multi_face=False, pipelined=False, motion_threshold=0.0, motion_max_reuse=10,
+                   scoring='cnn', latest_frame=None, target_fps=0.0, output_codec=None,
+                   detection_cache=None):
+    """Анализирует видеофайл или камеру.
+
+    По умолчанию возвращает (уровень, процент). При sequential=True анализ
+    прекращается, как только уровень усталости статистически определен
+    (но не раньше min_duration секунд видео). При return_report=True
+    возвращается словарь с результатом и статистикой анализа.
+    Готовый analyzer можно передать, чтобы не загружать модель повторно.
+    Окно с кадрами показывается при display=True (по умолчанию - только для камеры).
+    При record_timeline=True в отчет добавляется список (секунда, оценка, лицо найдено)
+    по всем проанализированным кадрам; кадры без оценки записываются с NaN.
+    При multi_face=True лица отслеживаются между кадрами, у каждого человека
+    свой буфер и итог (report['identities']), а общий уровень - по самому уставшему.
+    При pipelined=True видеофайл декодируется и обрабатывается детектором в отдельных
+    процессах (neural_network.pipeline), загрузка стадий попадает в report['pipeline'].
+    При motion_threshold > 0 почти неизменные кадры получают оценки предыдущего
+    (MotionGate), доля пропущенных кадров попадает в report['motion_gate'].
+    scoring='perclos' оценивает лицо по доле времени с закрытыми глазами (Face Mesh),
+    'hybrid' дополнительно вызывает модель для неоднозначных оценок; доля лиц,
+    прошедших через модель, PERCLOS и частота морганий - в report['scoring'].
+    При latest_frame=True (по умолчанию - для камеры) кадры читает отдельный поток и
+    анализируется всегда самый свежий кадр не чаще target_fps раз в секунду
+    (0 - без ограничения); задержка от захвата до оценки - в report['capture'].
+    Размеченное видео output_file пишется в фоновом потоке с частотой кадров источника
+    (кодек output_codec, по умолчанию по расширению файла), итог записи - в report['output'].
+    detection_cache - каталог или DetectionCache: найденные лица и их кропы сохраняются
+    по хешу видео и настройкам детектора, и повторный анализ того же видео моделью
+    обходится без декодирования и детекции (только для scoring='cnn').
+    """
+    report = {
+        'level': 'Error', 'score': 0.0, 'percent': 0,
+        'frames_total': 0, 'frames_read': 0, 'frames_processed': 0, 'samples': 0,
+        'duration_sec': 0.0, 'analyzed_sec': 0.0, 'analyzed_fraction': 0.0,
+        'stopped_early': False, 'elapsed_sec': 0.0, 'model_version': None
+    }
+    started = time.time()
+    writer = None
     try:
         logger.info(f"Starting analysis of {'video file' if is_video_file else 'camera'}")
         
-        # Проверяем, существует ли файл модели
-        model_path = 'neural_network/data/models/fatigue_model.keras'
-        if not Path(model_path).exists():
-            logger.error(f"Model file not found: {model_path}")
-            return "Error", 0
-            
-        analyzer = FatigueAnalyzer(model_path)
+        if analyzer is None:
+            # Проверяем, существует ли файл модели
+            if not Path(model_path).exists():
+                logger.error(f"Model file not found: {model_path}")
+                report['error'] = 'Model file not found'
+                return report if return_report else ("Error", 0)
+                
+            analyzer = FatigueAnalyzer(model_path, multi_face=multi_face)
+        else:
+            analyzer.reset(multi_face=multi_face)
+        analyzer.scoring = scoring
+        analyzer.motion_gate = MotionGate(threshold=motion_threshold, max_reuse=motion_max_reuse) \
+            if motion_threshold > 0 else None
+        
+        if display is None:
+            display = not is_video_file
         
         # Проверяем существование источника
         if is_video_file and not Path(source).exists():
             logger.error(f"Video source does not exist: {source}")
-            return "Error", 0
+            report['error'] = 'Video source does not exist'
+            return report if return_report else ("Error", 0)
         
         cap = cv2.VideoCapture(source if is_video_file else 0)
         if not cap.isOpened():
@@ -159,66 +652,289 @@ def analyze_source(source, is_video_file=False, output_file=None):
         logger.info(f"Video source opened: {source if is_video_file else 'camera'} - "
                    f"resolution: {cap.get(3)}x{cap.get(4)}, FPS: {cap.get(5)}")
         
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        if not fps or fps != fps or fps <= 0:
+            fps = 30.0
+        if is_video_file:
+            report['frames_total'] = max(0, int(cap.get(cv2.CAP_PROP_FRAME_COUNT)))
+            report['duration_sec'] = round(report['frames_total'] / fps, 2)
+        
         if output_file:
-            fourcc = cv2.VideoWriter_fourcc(*'XVID')
-            out = cv2.VideoWriter(output_file, fourcc, 30.0, 
-                                (int(cap.get(3)), int(cap.get(4))))
+            writer = AnnotatedVideoWriter(output_file, fps, (int(cap.get(3)), int(cap.get(4))),
+                                          codec=output_codec)
         
+        scorer = SequentialScorer(confidence=confidence, min_duration=min_duration) if sequential else None
+        # В режиме нескольких лиц уровень должен определиться у каждого человека
+        identity_scorers = {}
+        timeline = [] if record_timeline else None
         frame_count = 0
         processed_frames = 0
+
+        if latest_frame is None:
+            latest_frame = not is_video_file
+        stats_key = 'pipeline'
+        cache = cached = recorder = None
+        # Пропущенные кадры попадают в запись с разметкой последнего проанализированного
+        on_skipped = None if writer is None else \
+            lambda index, skipped: writer.write(skipped, analyzer.last_overlays)
+        if detection_cache and is_video_file and scoring == 'cnn':
+            cache = detection_cache if isinstance(detection_cache, DetectionCache) \
+                else DetectionCache(detection_cache)
+            video_hash = file_fingerprint(source)
+            cache_settings = dict(analyzer.face_detector.settings(), step=FRAME_STEP, face_size=FACE_SIZE)
+            cached = cache.load(video_hash, cache_settings)
+            report['detection_cache'] = {'hit': cached is not None,
+                                         'crops': cached is not None and cached.has_crops, 'saved': False}
+        if cached is not None and cached.has_crops and writer is None and not display:
+            # Видео не декодируется: все кропы из кэша оцениваются моделью крупными батчами
+            cap.release()
+            cached.scores = analyzer.predict_crops(cached.crops)
+            frames = cached
+        elif cached is not None:
+            # Кадры нужны для записи или окна, детектор - нет
+            frames = CachedFacesReader(FrameReader(cap, step=FRAME_STEP, on_skipped=on_skipped), cached)
+        elif pipelined and is_video_file:
+            from neural_network.pipeline import FramePipeline
+            cap.release()
+            frames = FramePipeline(source, step=FRAME_STEP,
+                                   detection_scale=analyzer.face_detector.detection_scale)
+        elif latest_frame:
+            from neural_network.capture import LatestFrameReader
+            # Драйверу камеры достаточно одного кадра в буфере, остальные только устаревают
+            cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+            frames = LatestFrameReader(cap, target_fps=target_fps)
+            stats_key = 'capture'
+        else:
+            frames = FrameReader(cap, step=FRAME_STEP, on_skipped=on_skipped)
         
-        while cap.isOpened():
-            ret, frame = cap.read()
-            if not ret:
-                break
-                
-            frame_count += 1
-            
-            # Обрабатываем не каждый кадр для ускорения
-            if frame_count % 5 == 0:
-                processed = analyzer.process_frame(frame)
-                processed_frames += 1
-                
-                if output_file:
-                    out.write(processed)
-                
-                # Только показываем окно если это не автоматический анализ
-                if not is_video_file or output_file:
-                    cv2.imshow('Analysis', processed)
-                    if cv2.waitKey(1) & 0xFF == ord('q'):
-                        break
+        # С MotionGate часть кадров не проходит детекцию, такой проход кэш не пополняет
+        if cache is not None and cached is None and analyzer.motion_gate is None:
+            recorder = cache.recorder(FACE_SIZE)
+            analyzer.face_recorder = recorder.add
         
+        all_frames = isinstance(frames, (FrameReader, CachedFacesReader))
+        written = 0
+        # Обрабатываем не каждый кадр для ускорения
+        for frame_count, frame, faces in frames:
+            if recorder is not None:
+                recorder.frame_number = frame_count
+            # Время кадра: по номеру в файле, для камеры - момент захвата кадра
+            if is_video_file:
+                position = frame_count / fps
+            elif stats_key == 'capture':
+                position = frames.frame_time
+            else:
+                position = time.time() - started
+            analyzer.frame_time = position
+            processed = analyzer.process_frame(
+                frame, faces, scores=frames.current_scores if frames is cached else None)
+            processed_frames += 1
+            
+            if writer is not None:
+                # Конвейер и поток камеры не отдают пропущенные кадры: проанализированный
+                # кадр повторяется, чтобы сохранить длительность. Буфер кадра конвейера
+                # переиспользуется, поэтому кадр копируется
+                writer.write(processed, repeat=1 if all_frames else frame_count - written,
+                             copy=not all_frames)
+                written = frame_count
+            
+            # Окно показываем только по запросу, на серверах дисплея нет
+            if display:
+                cv2.imshow('Analysis', processed)
+                if cv2.waitKey(1) & 0xFF == ord('q'):
+                    break
+
+            if timeline is not None:
+                face = int(analyzer.last_face_present)
+                if analyzer.last_frame_scores:
+                    timeline.extend((position, value, face) for value in analyzer.last_frame_scores)
+                else:
+                    timeline.append((position, float('nan'), face))
+
+            if scorer and multi_face:
+                for identity, value in zip(analyzer.last_frame_identities, analyzer.last_frame_scores):
+                    identity_scorers.setdefault(identity, SequentialScorer(
+                        confidence=confidence, min_duration=min_duration)).add(value)
+                settled = [s for s in identity_scorers.values() if s.count >= s.min_samples]
+                if settled and all(s.is_certain(position) for s in settled):
+                    logger.info(f"Fatigue level settled for {len(settled)} people after {position:.1f}s")
+                    report['stopped_early'] = True
+                    break
+            elif scorer:
+                for value in analyzer.last_frame_scores:
+                    scorer.add(value)
+                if scorer.is_certain(position):
+                    low, high = scorer.interval()
+                    logger.info(f"Fatigue level settled after {position:.1f}s: "
+                                f"CI [{low:.2f}, {high:.2f}]")
+                    report['stopped_early'] = True
+                    break
+        else:
+            # Кэш записывается только по полному проходу видео
+            if recorder is not None:
+                analyzer.face_recorder = None
+                cache.save(video_hash, cache_settings, recorder, frames_read=frames.frames_read,
+                           frames_total=report['frames_total'], fps=fps)
+                report['detection_cache']['saved'] = True
+        analyzer.face_recorder = None
+    
+        frame_count = frames.frames_read
         logger.info(f"Analyzed {processed_frames} frames out of {frame_count}")
         
         cap.release()
-        if output_file and 'out' in locals():
-            out.release()
-        cv2.destroyAllWindows()
+        if writer is not None:
+            report['output'] = writer.close()
+            writer = None
+        if display:
+            cv2.destroyAllWindows()
         
-        result = analyzer.get_final_score()
-        return result['level'], result['percent']
+        # В последовательном режиме уровень считается по всем оценкам,
+        # а не по последнему окну буфера
+        if scorer and multi_face:
+            settled = [s for s in identity_scorers.values() if s.count >= s.min_samples] or \
+                list(identity_scorers.values())
+            result = max(settled, key=lambda s: s.mean).get_final_score() if settled \
+                else scorer.get_final_score()
+        else:
+            result = scorer.get_final_score() if scorer else analyzer.get_final_score()
+        report.update(result)
+        if multi_face:
+            identities = analyzer.get_identity_scores()
+            for identity in identities:
+                if identity['id'] in identity_scorers:
+                    identity['sequential_score'] = round(identity_scorers[identity['id']].mean, 2)
+            report['identities'] = identities
+        report['model_version'] = analyzer.model_version
+        report['frames_read'] = frame_count
+        report['frames_processed'] = processed_frames
+        if frames.stats:
+            report[stats_key] = frames.stats
+        if analyzer.motion_gate is not None:
+            report['motion_gate'] = analyzer.motion_gate.stats()
+        report['scoring'] = analyzer.scoring_stats()
+        for eyes in report['scoring'].get('eyes', {}).values():
+            # Моргания за минуту по длительности окна, которое видел счетчик
+            window_sec = eyes.pop('window_sec')
+            eyes['blinks_per_min'] = round(eyes['blinks'] / window_sec * 60, 1) if window_sec else 0.0
+        report['samples'] = analyzer.sample_count
+        if timeline is not None:
+            report['timeline'] = timeline
+        report['analyzed_sec'] = round(frame_count / fps, 2)
+        if report['frames_total']:
+            report['analyzed_fraction'] = round(min(1.0, frame_count / report['frames_total']), 3)
     except Exception as e:
         logger.error(f"Analysis error: {str(e)}", exc_info=True)
-        return "Error", 0
+        report.update({'level': 'Error', 'score': 0.0, 'percent': 0, 'error': str(e)})
+        if writer is not None:
+            writer.close()
+        if analyzer is not None:
+            analyzer.face_recorder = None
+    report['elapsed_sec'] = round(time.time() - started, 3)
+    if return_report:
+        return report
+    return report['level'], report['percent']
 
 if __name__ == '__main__':
     import argparse
     parser = argparse.ArgumentParser()
-    parser.add_argument('--mode', choices=['video', 'realtime'], required=True)
-    parser.add_argument('--input', help='Path to input video')
+    parser.add_argument('--mode', choices=['video', 'realtime', 'batch', 'worker'], required=True)
+    parser.add_argument('--input', help='Path to input video, or directory/manifest in batch mode')
     parser.add_argument('--output', help='Path to output video')
+    parser.add_argument('--codec', help='FourCC of the output video (default: by file extension, '
+                                        'mp4v for .mp4, XVID otherwise)')
+    parser.add_argument('--display', action='store_true', help='Show analysis window')
+    parser.add_argument('--sequential', action='store_true',
+                        help='Stop as soon as the fatigue level is statistically certain')
+    parser.add_argument('--results', default='batch_results.jsonl',
+                        help='JSONL file with batch results (used to resume)')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='Number of analysis processes in batch and worker modes (0 - CPU count)')
+    parser.add_argument('--db', default=os.environ.get('DATABASE_PATH', 'database/database.db'),
+                        help='Application database that receives results (worker mode)')
+    parser.add_argument('--videos', default=os.environ.get('UPLOAD_FOLDER', 'neural_network/data/video'),
+                        help='Video storage root (worker mode)')
+    parser.add_argument('--queue-url', help='Work queue URL, e.g. sqlite:///database/database.db '
+                                            '(worker mode, default: WORK_QUEUE_URL or --db)')
+    parser.add_argument('--lease', type=float, default=120.0,
+                        help='Seconds a claimed job stays leased without a heartbeat (worker mode)')
+    parser.add_argument('--exit-when-idle', action='store_true',
+                        help='Stop the worker once the queue is empty (worker mode)')
+    parser.add_argument('--multi-face', action='store_true',
+                        help='Track every face separately and report a score per person')
+    parser.add_argument('--pipelined', action='store_true',
+                        help='Decode and detect faces in separate processes (video mode)')
+    parser.add_argument('--motion-threshold', type=float, default=0.0,
+                        help='Reuse scores of frames whose face region changed less than this '
+                             '(mean gray-level difference, 0 disables)')
+    parser.add_argument('--scoring', choices=['cnn', 'perclos', 'hybrid'], default='cnn',
+                        help='Score faces with the model, by eye closure (PERCLOS), '
+                             'or by eye closure with the model for ambiguous faces')
+    parser.add_argument('--target-fps', type=float, default=0.0,
+                        help='Analyze at most this many camera frames per second, always the newest '
+                             '(realtime mode, 0 - as fast as possible)')
+    parser.add_argument('--detection-cache', metavar='DIR',
+                        help='Cache detected faces and crops per video here; re-analysis of the same '
+                             'video with the same detector settings skips decoding and detection')
+    parser.add_argument('--retry-errors', action='store_true',
+                        help='Re-analyze inputs that previously failed in batch mode')
     args = parser.parse_args()
+    setup_logging()
     
-    if args.mode == 'video' and not args.input:
-        logger.error("Input video required for video mode")
+    if args.mode in ('video', 'batch') and not args.input:
+        logger.error(f"Input required for {args.mode} mode")
         print("Error: Input video required")
         exit(1)
+
+    if args.mode == 'worker':
+        from analysis_worker import run_workers
+        summaries = run_workers(args.workers or os.cpu_count() or 1, args.db, args.videos,
+                                queue_url=args.queue_url, model_path=MODEL_PATH, lease_sec=args.lease,
+                                exit_when_idle=args.exit_when_idle)
+        print(json.dumps(summaries, indent=2))
+        exit(0)
+
+    if args.mode == 'batch':
+        from neural_network.batch import run_batch, collect_inputs
+        summary = run_batch(collect_inputs(args.input), args.results,
+                            workers=args.workers, sequential=args.sequential,
+                            retry_errors=args.retry_errors, multi_face=args.multi_face,
+                            motion_threshold=args.motion_threshold, scoring=args.scoring,
+                            detection_cache=args.detection_cache)
+        print(json.dumps(summary, indent=2))
+        exit(0 if not summary['errors'] else 2)
         
-    level, percent = analyze_source(
-        source=args.input if args.mode == 'video' else 0,
-        is_video_file=args.mode == 'video',
-        output_file=args.output
-    )
+    with log_context(job_id=args.input or 'camera'):
+        report = analyze_source(
+            source=args.input if args.mode == 'video' else 0,
+            is_video_file=args.mode == 'video',
+            output_file=args.output,
+            sequential=args.sequential,
+            display=args.display or args.mode == 'realtime',
+            multi_face=args.multi_face,
+            pipelined=args.pipelined,
+            motion_threshold=args.motion_threshold,
+            scoring=args.scoring,
+            target_fps=args.target_fps,
+            output_codec=args.codec,
+            detection_cache=args.detection_cache,
+            return_report=True
+        )
     
-    print(f"Fatigue Level: {level}")
-    print(f"Fatigue Percentage: {percent}%")
+    print(f"Fatigue Level: {report['level']}")
+    print(f"Fatigue Percentage: {report['percent']}%")
+    if 'motion_gate' in report:
+        print(f"Motion gate: {report['motion_gate']['reused_fraction']:.0%} of frames reused")
+    if report.get('scoring', {}).get('mode', 'cnn') != 'cnn':
+        print(f"Scoring: {report['scoring']['mode']}, model used for "
+              f"{report['scoring']['cnn_fraction']:.0%} of faces")
+    if 'detection_cache' in report:
+        print(f"Detection cache: {'hit' if report['detection_cache']['hit'] else 'miss'}")
+    if 'capture' in report:
+        latency = report['capture']['latency_ms']
+        print(f"Capture: {report['capture']['processed']} of {report['capture']['captured']} frames "
+              f"analyzed, latency p50 {latency['p50']} ms, p95 {latency['p95']} ms")
+    for stage, stats in report.get('pipeline', {}).items():
+        print(f"Stage {stage}: {stats['utilization']:.0%} busy, {stats['items']} frames")
+    for identity in report.get('identities', []):
+        print(f"Person #{identity['id']} ({identity['first_sec']}-{identity['last_sec']}s): "
+              f"{identity['level']} ({identity['percent']}%)")
@@ -0,0 +1,112 @@
+
+import os
+import time
+import queue
+import logging
+import threading
+from pathlib import Path
+
+import cv2
+
+logger = logging.getLogger("VideoWriter")
+
+# Кодек по расширению выходного файла; VIDEO_OUTPUT_CODEC переопределяет выбор
+DEFAULT_CODECS = {'.mp4': 'mp4v', '.m4v': 'mp4v', '.avi': 'XVID', '.mkv': 'XVID'}
+
+
+def draw_overlays(frame, overlays: list):
+    """Рисует на кадре рамки лиц с подписями и текстовые предупреждения.
+
+    overlays - список ('box', x, y, width, height, label, color)
+    и ('text', label, color).
+    """
+    for overlay in overlays:
+        if overlay[0] == 'box':
+            _, x, y, width, height, label, color = overlay
+            cv2.rectangle(frame, (x, y), (x + width, y + height), color, 2)
+            cv2.putText(frame, label, (x, y - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.7, color, 2)
+        else:
+            _, label, color = overlay
+            h, w = frame.shape[:2]
+            cv2.putText(frame, label, (w // 2 - 100, h // 2), cv2.FONT_HERSHEY_SIMPLEX, 1, color, 2)
+    return frame
+
+
+def output_codec(path: str, codec: str = None) -> str:
+    codec = codec or os.environ.get('VIDEO_OUTPUT_CODEC')
+    if codec:
+        return codec
+    return DEFAULT_CODECS.get(Path(path).suffix.lower(), 'XVID')
+
+
+class AnnotatedVideoWriter:
+    """Запись размеченного видео в фоновом потоке.
+
+    Кадры передаются через ограниченную очередь: кодирование не задерживает
+    анализ, пока поток записи успевает, а при отставании write() ждет место
+    в очереди, так что память не растет. Кадры, которые не анализировались,
+    получают разметку последнего проанализированного кадра, поэтому файл
+    сохраняет частоту кадров источника и его длительность.
+    """
+
+    def __init__(self, path: str, fps: float, size: tuple, codec: str = None, queue_size: int = 32):
+        self.path = path
+        self.codec = output_codec(path, codec)
+        self.writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*self.codec), fps, size)
+        if not self.writer.isOpened():
+            raise ValueError(f"Failed to open video writer: {path} ({self.codec})")
+        self.fps = fps
+        self.size = size
+        self.frames_written = 0
+        self.blocked_sec = 0.0
+        self.encode_sec = 0.0
+        self._error = None
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = threading.Thread(target=self._run, name='video-writer', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            if self._error is not None:
+                continue
+            frame, overlays, repeat = item
+            try:
+                start = time.perf_counter()
+                if frame.shape[1::-1] != self.size:
+                    frame = cv2.resize(frame, self.size)
+                if overlays:
+                    draw_overlays(frame, overlays)
+                for _ in range(repeat):
+                    self.writer.write(frame)
+                self.frames_written += repeat
+                self.encode_sec += time.perf_counter() - start
+            except Exception as e:
+                # Ошибка записи не должна прерывать анализ
+                self._error = e
+                logger.error(f"Video writer error: {str(e)}")
+
+    def write(self, frame, overlays: list = None, repeat: int = 1, copy: bool = False):
+        """Ставит кадр в очередь записи repeat раз, overlays рисуются в потоке записи.
+
+        copy=True нужен, если вызывающий код переиспользует буфер кадра.
+        """
+        if repeat < 1:
+            return
+        start = time.perf_counter()
+        self._queue.put((frame.copy() if copy else frame, overlays, repeat))
+        self.blocked_sec += time.perf_counter() - start
+
+    def close(self) -> dict:
+        """Дописывает очередь, закрывает файл и возвращает статистику записи"""
+        self._queue.put(None)
+        self._thread.join()
+        self.writer.release()
+        stats = {'path': self.path, 'codec': self.codec, 'fps': round(self.fps, 3),
+                 'frames_written': self.frames_written,
+                 'encode_sec': round(self.encode_sec, 3), 'blocked_sec': round(self.blocked_sec, 3)}
+        if self._error is not None:
+            stats['error'] = str(self._error)
+        return stats
@@ -0,0 +1,315 @@
+
+import sqlite3
+import logging
+import threading
+from datetime import datetime, timedelta
+
+logger = logging.getLogger("Readiness")
+
+CHANGES_TABLE = 'readiness_changes'
+
+# Индексы для выборки последних записей по сотрудникам и рейсов по времени вылета
+READINESS_INDEXES = [
+    ('FatigueAnalysis', 'idx_fatigue_analysis_employee', 'employee_id, analysis_date'),
+    ('fatigue_analysis', 'idx_fatigue_analysis_user', 'user_id, analysis_date'),
+    ('CognitiveTests', 'idx_cognitive_tests_employee', 'employee_id, test_type, test_date'),
+    ('MedicalChecks', 'idx_medical_checks_employee', 'employee_id, check_date'),
+    ('CrewMembers', 'idx_crew_members_employee', 'employee_id'),
+    ('Flights', 'idx_flights_departure', 'departure_time'),
+]
+
+# Триггеры журнала изменений: (таблица, событие, сущность, выражение идентификатора).
+# Анализы видео приложение пишет в fatigue_analysis с user_id - тем же идентификатором,
+# что employee_id в CognitiveTests и Feedback
+CHANGE_TRIGGERS = [
+    ('FatigueAnalysis', 'INSERT', 'employee', 'NEW.employee_id'),
+    ('fatigue_analysis', 'INSERT', 'employee', 'NEW.user_id'),
+    ('fatigue_analysis', 'UPDATE', 'employee', 'NEW.user_id'),
+    ('CognitiveTests', 'INSERT', 'employee', 'NEW.employee_id'),
+    ('MedicalChecks', 'INSERT', 'employee', 'NEW.employee_id'),
+    ('MedicalChecks', 'UPDATE', 'employee', 'NEW.employee_id'),
+    ('CrewMembers', 'INSERT', 'crew', 'NEW.crew_id'),
+    ('CrewMembers', 'DELETE', 'crew', 'OLD.crew_id'),
+    ('Flights', 'UPDATE', 'flight', 'NEW.flight_id'),
+]
+
+# Пороги готовности
+MIN_COGNITIVE_SCORE = 60.0
+STATUS_ORDER = {'ready': 0, 'unknown': 1, 'warning': 2, 'not_ready': 3}
+
+# Сколько записей журнала изменений хранить
+CHANGES_RETENTION = 10000
+
+# Параметры SQLite на один запрос с IN (...)
+MAX_QUERY_PARAMS = 900
+
+
+def ensure_readiness_schema(conn: sqlite3.Connection):
+    """Создает индексы, журнал изменений и триггеры, которые его заполняют.
+
+    Журнал нужен, чтобы кэш инвалидировался и при записи из других процессов.
+    """
+    tables = {row[0].lower() for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    for table, name, columns in READINESS_INDEXES:
+        if table.lower() in tables:
+            conn.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})')
+    conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS {CHANGES_TABLE} (
+            change_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            entity TEXT NOT NULL,
+            entity_id INTEGER
+        )
+    ''')
+    for table, event, entity, expression in CHANGE_TRIGGERS:
+        if table.lower() not in tables:
+            continue
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS readiness_{table.lower()}_{event.lower()}
+            AFTER {event} ON {table}
+            BEGIN
+                INSERT INTO {CHANGES_TABLE} (entity, entity_id) VALUES ('{entity}', {expression});
+            END
+        ''')
+    conn.commit()
+
+
+def _chunks(values: list, size: int = MAX_QUERY_PARAMS):
+    for offset in range(0, len(values), size):
+        yield values[offset:offset + size]
+
+
+def _member_status(member: dict, departure: str) -> tuple:
+    reasons = []
+    status = 'ready'
+
+    medical = member['medical']
+    if not medical:
+        reasons.append('no_medical_check')
+        status = 'not_ready'
+    elif medical['expiry_date'] < departure[:len(medical['expiry_date'])] or medical['status'] == 'failed':
+        reasons.append('medical_expired' if medical['status'] != 'failed' else 'medical_failed')
+        status = 'not_ready'
+
+    fatigue = member['fatigue']
+    level = (fatigue or {}).get('fatigue_level') or ''
+    if not fatigue:
+        reasons.append('no_fatigue_analysis')
+    elif level.lower() == 'high':
+        reasons.append('high_fatigue')
+        status = 'not_ready'
+    elif level.lower() == 'medium':
+        reasons.append('medium_fatigue')
+
+    cognitive = member['cognitive']
+    if not cognitive:
+        reasons.append('no_cognitive_test')
+    elif cognitive['score'] is not None and cognitive['score'] < MIN_COGNITIVE_SCORE:
+        reasons.append('low_cognitive_score')
+
+    if status == 'ready' and reasons:
+        missing_only = all(reason.startswith('no_') for reason in reasons)
+        status = 'unknown' if missing_only else 'warning'
+    return status, reasons
+
+
+def _latest_by_employee(conn: sqlite3.Connection, query: str, employee_ids: list) -> dict:
+    """Последняя запись каждого сотрудника одним запросом на пачку идентификаторов"""
+    latest = {}
+    for chunk in _chunks(employee_ids):
+        placeholders = ', '.join('?' * len(chunk))
+        for row in conn.execute(query.format(ids=placeholders), chunk * query.count('{ids}')):
+            row = dict(row)
+            latest[row.pop('employee_id')] = row
+    return latest
+
+
+# Анализы из обеих таблиц; даты сравниваются без разделителя 'T' (datetime('now') пишет пробел)
+LATEST_FATIGUE = '''
+    SELECT employee_id, analysis_id, fatigue_level, neural_network_score, analysis_date FROM (
+        SELECT employee_id, analysis_id, fatigue_level, neural_network_score, analysis_date,
+               ROW_NUMBER() OVER (PARTITION BY employee_id
+                                  ORDER BY REPLACE(analysis_date, 'T', ' ') DESC, analysis_id DESC) AS rn
+        FROM (
+            SELECT employee_id, analysis_id, fatigue_level, neural_network_score, analysis_date
+            FROM FatigueAnalysis WHERE employee_id IN ({ids})
+            UNION ALL
+            SELECT user_id, analysis_id, fatigue_level, neural_network_score, analysis_date
+            FROM fatigue_analysis WHERE user_id IN ({ids})
+        )
+    ) WHERE rn = 1
+'''
+
+LATEST_COGNITIVE = '''
+    SELECT employee_id, test_id, test_type, score, test_date FROM (
+        SELECT employee_id, test_id, test_type, score, test_date,
+               ROW_NUMBER() OVER (PARTITION BY employee_id
+                                  ORDER BY test_date DESC, test_id DESC) AS rn
+        FROM CognitiveTests WHERE employee_id IN ({ids})
+    ) WHERE rn = 1
+'''
+
+LATEST_MEDICAL = '''
+    SELECT employee_id, check_id, check_date, expiry_date, status FROM (
+        SELECT employee_id, check_id, check_date, expiry_date, status,
+               ROW_NUMBER() OVER (PARTITION BY employee_id
+                                  ORDER BY check_date DESC, check_id DESC) AS rn
+        FROM MedicalChecks WHERE employee_id IN ({ids})
+    ) WHERE rn = 1
+'''
+
+
+def build_readiness(conn: sqlite3.Connection, flights: list) -> dict:
+    """Собирает готовность экипажей для списка рейсов.
+
+    Число запросов не зависит от числа рейсов и членов экипажа: состав экипажей
+    и последние анализ, тест и медосмотр выбираются по одному запросу на пачку.
+    """
+    crew_ids = sorted({flight['crew_id'] for flight in flights if flight['crew_id'] is not None})
+    members_by_crew = {}
+    for chunk in _chunks(crew_ids):
+        placeholders = ', '.join('?' * len(chunk))
+        rows = conn.execute(f'''
+            SELECT cm.crew_id, cm.employee_id, cm.role, e.name, e.position
+            FROM CrewMembers cm
+            LEFT JOIN Employees e ON e.employee_id = cm.employee_id
+            WHERE cm.crew_id IN ({placeholders})
+            ORDER BY cm.crew_id, cm.employee_id
+        ''', chunk)
+        for row in rows:
+            members_by_crew.setdefault(row['crew_id'], []).append(dict(row))
+
+    employee_ids = sorted({m['employee_id'] for members in members_by_crew.values() for m in members})
+    fatigue = _latest_by_employee(conn, LATEST_FATIGUE, employee_ids)
+    cognitive = _latest_by_employee(conn, LATEST_COGNITIVE, employee_ids)
+    medical = _latest_by_employee(conn, LATEST_MEDICAL, employee_ids)
+
+    result = {}
+    for flight in flights:
+        crew = []
+        for member in members_by_crew.get(flight['crew_id'], []):
+            entry = {
+                'employee_id': member['employee_id'],
+                'name': member['name'],
+                'position': member['position'],
+                'crew_role': member['role'],
+                'fatigue': fatigue.get(member['employee_id']),
+                'cognitive': cognitive.get(member['employee_id']),
+                'medical': medical.get(member['employee_id']),
+            }
+            entry['status'], entry['reasons'] = _member_status(entry, flight['departure_time'])
+            crew.append(entry)
+        statuses = [member['status'] for member in crew] or ['unknown']
+        result[flight['flight_id']] = dict(flight, crew=crew,
+                                           readiness=max(statuses, key=STATUS_ORDER.get))
+    return result
+
+
+class ReadinessCache:
+    """Кэш готовности по рейсам.
+
+    Записи инвалидируются по журналу readiness_changes: новый анализ, тест или
+    медосмотр сотрудника сбрасывает рейсы, в экипаже которых он состоит, изменение
+    состава экипажа - рейсы этого экипажа, изменение рейса - сам рейс.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._by_employee = {}
+        self._by_crew = {}
+        self._last_change = None
+        self._lock = threading.Lock()
+
+    def _drop(self, flight_id):
+        entry = self._entries.pop(flight_id, None)
+        if entry is None:
+            return
+        for member in entry['crew']:
+            flights = self._by_employee.get(member['employee_id'])
+            if flights:
+                flights.discard(flight_id)
+        flights = self._by_crew.get(entry['crew_id'])
+        if flights:
+            flights.discard(flight_id)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_employee.clear()
+            self._by_crew.clear()
+
+    def invalidate(self, entity: str, entity_id):
+        with self._lock:
+            self._invalidate(entity, entity_id)
+
+    def _invalidate(self, entity: str, entity_id):
+        if entity == 'flight':
+            self._drop(entity_id)
+            return
+        index = self._by_employee if entity == 'employee' else self._by_crew
+        for flight_id in list(index.pop(entity_id, ())):
+            self._drop(flight_id)
+
+    def sync(self, conn: sqlite3.Connection):
+        """Применяет новые записи журнала изменений одним запросом"""
+        if self._last_change is None:
+            row = conn.execute(f'SELECT MAX(change_id) FROM {CHANGES_TABLE}').fetchone()
+            self._last_change = row[0] or 0
+            return
+        rows = conn.execute(
+            f'SELECT change_id, entity, entity_id FROM {CHANGES_TABLE} WHERE change_id > ? ORDER BY change_id',
+            (self._last_change,)
+        ).fetchall()
+        if not rows:
+            return
+        with self._lock:
+            if rows[0][0] != self._last_change + 1:
+                # Часть журнала уже удалена: надежнее сбросить кэш целиком
+                first = conn.execute(f'SELECT MIN(change_id) FROM {CHANGES_TABLE}').fetchone()[0]
+                if first is not None and first > self._last_change + 1:
+                    self._entries.clear()
+                    self._by_employee.clear()
+                    self._by_crew.clear()
+            for _, entity, entity_id in rows:
+                self._invalidate(entity, entity_id)
+            previous, self._last_change = self._last_change, rows[-1][0]
+        # Старые записи журнала чистятся примерно раз в тысячу изменений
+        if previous // 1000 != self._last_change // 1000:
+            conn.execute(f'DELETE FROM {CHANGES_TABLE} WHERE change_id <= ?',
+                         (self._last_change - CHANGES_RETENTION,))
+            conn.commit()
+
+    def get_window(self, conn: sqlite3.Connection, start: datetime, end: datetime) -> list:
+        """Готовность всех рейсов с вылетом в [start, end)"""
+        self.sync(conn)
+        flights = [dict(row) for row in conn.execute('''
+            SELECT flight_id, flight_number, crew_id, departure_time, arrival_time,
+                   from_code, to_code, aircraft, status
+            FROM Flights
+            WHERE departure_time >= ? AND departure_time < ? AND COALESCE(status, '') != 'cancelled'
+            ORDER BY departure_time
+        ''', (start.strftime('%Y-%m-%dT%H:%M:%S'), end.strftime('%Y-%m-%dT%H:%M:%S')))]
+
+        with self._lock:
+            cached = {f['flight_id']: self._entries.get(f['flight_id']) for f in flights}
+        # Закэшированная запись годится, только если рейс не поменялся
+        missing = [f for f in flights
+                   if not cached[f['flight_id']] or
+                   {k: cached[f['flight_id']][k] for k in f} != f]
+        if missing:
+            fresh = build_readiness(conn, missing)
+            with self._lock:
+                for flight_id, entry in fresh.items():
+                    self._drop(flight_id)
+                    self._entries[flight_id] = entry
+                    self._by_crew.setdefault(entry['crew_id'], set()).add(flight_id)
+                    for member in entry['crew']:
+                        self._by_employee.setdefault(member['employee_id'], set()).add(flight_id)
+                self._prune(start)
+            cached.update(fresh)
+        return [cached[f['flight_id']] for f in flights]
+
+    def _prune(self, start: datetime):
+        # Рейсы, вылетевшие больше суток назад, больше не запрашиваются
+        threshold = (start - timedelta(days=1)).strftime('%Y-%m-%dT%H:%M:%S')
+        for flight_id in [fid for fid, e in self._entries.items() if e['departure_time'] < threshold]:
+            self._drop(flight_id)
@@ -1,33 +1,179 @@
 
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, request, jsonify, send_from_directory, g
 from flask_cors import CORS
 import os
 import time
 import sqlite3
 import uuid
 import json
-from werkzeug.security import generate_password_hash, check_password_hash
+import atexit
+import threading
+import logging
 import jwt
 from datetime import datetime, timedelta
 from functools import wraps
-from neural_network.predict import FatigueAnalyzer, analyze_source
-import cv2
-import numpy as np
+from neural_network.predict import analyze_source
+from neural_network.logging_setup import setup_logging, request_id_var, log_context
+from video_storage import VideoStorage, VideoConversionError
+from analysis_backfill import ensure_model_version_column
+from timeline import ensure_timeline_table, save_timeline, load_timeline, downsample
+from auth_tokens import (PasswordHasher, PasswordHasherBusy, ensure_refresh_token_table,
+                         issue_refresh_token, rotate_refresh_token, revoke_refresh_token)
+from test_sessions import (TestSessionStore, TestSessionError, ensure_test_session_schema,
+                           public_question, TEST_TYPES)
+from readiness import ReadinessCache, ensure_readiness_schema
+from admission import AdmissionController, AdmissionRejected
+from training_export import ensure_feedback_sequence
+from work_queue import open_work_queue
+from analysis_worker import ANALYSIS_KIND, NO_FACES_ERROR, analysis_payload
+from frontend_assets import register_frontend
+from text_search import ensure_text_search_schema, search as search_texts, SEARCH_SOURCES
+from duty_time import ensure_duty_time_schema, duty_risks, duty_limits_from_env
+
+# Под gunicorn (routes:app) блок __main__ не выполняется, поэтому логирование
+# настраивается при импорте; повторный вызов (run.py, воркеры) ничего не меняет
+setup_logging()
 
 app = Flask(__name__, static_folder='neural_network/data/video')
-CORS(app)
+CORS(app, expose_headers=['Retry-After', 'X-Request-ID'])
+
+logger = logging.getLogger("Routes")
 
-DATABASE = 'database/database.db'
+DATABASE = os.environ.get('DATABASE_PATH', 'database/database.db')
 SECRET_KEY = 'fatigue-guard-secret-key'  # В реальном проекте использовать переменную окружения
-UPLOAD_FOLDER = 'neural_network/data/video'
+UPLOAD_FOLDER = os.environ.get('UPLOAD_FOLDER', 'neural_network/data/video')
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
+# Хранилище видео: квота в МБ (0 - без ограничения) и период фоновой очистки
+VIDEO_QUOTA_MB = int(os.environ.get('VIDEO_QUOTA_MB', '0'))
+VIDEO_GC_INTERVAL = float(os.environ.get('VIDEO_GC_INTERVAL', '600'))
+video_storage = VideoStorage(UPLOAD_FOLDER, DATABASE,
+                             quota_bytes=VIDEO_QUOTA_MB * 1024 * 1024,
+                             gc_interval=VIDEO_GC_INTERVAL)
+video_storage.start_background_gc()
+
+# Время жизни токенов: короткий access-токен продлевается refresh-токеном без проверки пароля
+ACCESS_TOKEN_MINUTES = int(os.environ.get('ACCESS_TOKEN_MINUTES', '60'))
+REFRESH_TOKEN_DAYS = int(os.environ.get('REFRESH_TOKEN_DAYS', '30'))
+REFRESH_TOKEN_TTL = REFRESH_TOKEN_DAYS * 24 * 3600
+
+# Хеширование паролей выполняется в ограниченном пуле, чтобы волна логинов не занимала все потоки
+password_hasher = PasswordHasher(
+    workers=int(os.environ.get('PASSWORD_HASH_WORKERS', str(max(1, (os.cpu_count() or 2) // 2)))),
+    max_pending=int(os.environ.get('PASSWORD_HASH_QUEUE', '32')),
+    per_user_limit=int(os.environ.get('PASSWORD_HASH_PER_USER', '2')),
+    per_ip_limit=int(os.environ.get('PASSWORD_HASH_PER_IP', '8'))
+)
+
+# Анализ видео занимает ядра и сотни мегабайт памяти: число одновременных анализов
+# ограничено, лишние запросы ждут в очереди или получают 429
+analysis_admission = AdmissionController(
+    max_concurrent=int(os.environ.get('ANALYSIS_MAX_CONCURRENT', str(max(1, (os.cpu_count() or 2) // 2)))),
+    max_queue=int(os.environ.get('ANALYSIS_QUEUE', '4')),
+    queue_timeout=float(os.environ.get('ANALYSIS_QUEUE_TIMEOUT', '20')),
+    memory_budget_mb=float(os.environ.get('ANALYSIS_MEMORY_BUDGET_MB', '0')),
+    job_memory_mb=float(os.environ.get('ANALYSIS_JOB_MEMORY_MB', '600'))
+)
+
+# Активные сессии когнитивных тестов хранятся в памяти и периодически пишутся в БД
+TEST_SESSION_TTL = float(os.environ.get('TEST_SESSION_TTL', '3600'))
+TEST_SESSION_FLUSH_INTERVAL = float(os.environ.get('TEST_SESSION_FLUSH_INTERVAL', '2'))
+test_sessions = TestSessionStore(DATABASE, ttl=TEST_SESSION_TTL,
+                                 flush_interval=TEST_SESSION_FLUSH_INTERVAL)
+
+# Готовность экипажей кэшируется по рейсам и сбрасывается по журналу изменений
+READINESS_WINDOW_HOURS = float(os.environ.get('READINESS_WINDOW_HOURS', '24'))
+readiness_cache = ReadinessCache()
+
+# Пределы налета за скользящие 24 ч / 7 дн / 28 дн, часы
+DUTY_LIMITS = duty_limits_from_env()
+
+# Последовательный анализ: остановка, как только уровень усталости определен
+SEQUENTIAL_ANALYSIS = os.environ.get('SEQUENTIAL_ANALYSIS', 'False').lower() in ('1', 'true', 'yes')
+
+# Видео рейса снимает кабину с несколькими пилотами: каждый оценивается отдельно (по умолчанию выключено)
+MULTI_FACE_FLIGHT_ANALYSIS = os.environ.get('MULTI_FACE_FLIGHT_ANALYSIS', 'False').lower() in ('1', 'true', 'yes')
+
+# Кадры, в которых область лица почти не изменилась, получают оценку предыдущего кадра
+MOTION_GATE_THRESHOLD = float(os.environ.get('MOTION_GATE_THRESHOLD', '0'))
+MOTION_GATE_MAX_REUSE = int(os.environ.get('MOTION_GATE_MAX_REUSE', '10'))
+
+# Оценка лица: cnn - модель, perclos - по закрытию глаз, hybrid - PERCLOS с моделью для неоднозначных
+FATIGUE_SCORING = os.environ.get('FATIGUE_SCORING', 'cnn').lower()
+# Каталог кэша детекции лиц; пустое значение - кэш выключен
+DETECTION_CACHE_DIR = os.environ.get('DETECTION_CACHE_DIR', '')
+
+# Конвейерный анализ: декодирование и детекция лиц в отдельных процессах
+PIPELINED_ANALYSIS = os.environ.get('PIPELINED_ANALYSIS', 'False').lower() in ('1', 'true', 'yes')
+
+# Очередь анализа: видео анализируют отдельные воркеры (predict.py --mode worker),
+# маршрут ставит задачу и ждет результат не дольше ANALYSIS_JOB_WAIT секунд, затем отвечает 202.
+# Ожидание держит поток сервера, поэтому оно короткое, а ждущих не больше ANALYSIS_JOB_WAITERS;
+# остальные запросы получают 202 сразу
+ANALYSIS_WORK_QUEUE = os.environ.get('ANALYSIS_WORK_QUEUE', 'False').lower() in ('1', 'true', 'yes')
+ANALYSIS_JOB_WAIT = float(os.environ.get('ANALYSIS_JOB_WAIT', '5'))
+work_queue = open_work_queue(default_db=DATABASE) if ANALYSIS_WORK_QUEUE else None
+job_waiters = threading.BoundedSemaphore(int(os.environ.get('ANALYSIS_JOB_WAITERS', '1')))
+
+# Собранный фронтенд (npm run build) раздается этим же приложением; пустое значение -
+# фронтенд раздает dev-сервер Vite
+FRONTEND_DIST = os.environ.get('FRONTEND_DIST', '')
+
 # Проверка подключения к БД
 def get_db_connection():
     conn = sqlite3.connect(DATABASE)
     conn.row_factory = sqlite3.Row
     return conn
 
+# Результаты анализа помечаются версией модели, ряды оценок хранятся отдельно
+try:
+    _conn = get_db_connection()
+    ensure_model_version_column(_conn)
+    ensure_timeline_table(_conn)
+    ensure_refresh_token_table(_conn)
+    ensure_test_session_schema(_conn)
+    ensure_readiness_schema(_conn)
+    ensure_feedback_sequence(_conn)
+    ensure_text_search_schema(_conn)
+    ensure_duty_time_schema(_conn)
+    _conn.close()
+except sqlite3.Error as e:
+    logger.error(f"Schema migration error: {str(e)}")
+
+test_sessions.start_background_flush()
+atexit.register(test_sessions.close)
+
+# Каждый запрос получает идентификатор: он попадает во все записи журнала и в ответ
+@app.before_request
+def bind_request_id():
+    request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex[:16]
+    g.request_id = request_id
+    g.request_id_token = request_id_var.set(request_id)
+
+@app.after_request
+def add_request_id_header(response):
+    if 'request_id' in g:
+        response.headers['X-Request-ID'] = g.request_id
+    return response
+
+@app.teardown_request
+def unbind_request_id(exc=None):
+    token = g.pop('request_id_token', None)
+    if token is not None:
+        request_id_var.reset(token)
+
+# Флаги анализа можно переопределить параметром запроса
+def request_flag(name, default):
+    value = request.values.get(name)
+    if value is None and request.is_json:
+        value = (request.get_json(silent=True) or {}).get(name)
+    if value is None:
+        return default
+    return str(value).lower() in ('1', 'true', 'yes')
+
+def use_sequential_analysis():
+    return request_flag('sequential', SEQUENTIAL_ANALYSIS)
+
 # Декоратор для защиты маршрутов
 def token_required(f):
     @wraps(f)
@@ -60,17 +206,117 @@ def token_required(f):
             }
             
         except Exception as e:
-            print(f"Token error: {str(e)}")
+            logger.warning(f"Token error: {str(e)}")
             return jsonify({'message': 'Token is invalid!'}), 401
             
         return f(*args, **kwargs)
     
     return decorated
 
+# Ответ 429 при перегрузке пула хеширования паролей или очереди анализа
+def retry_later(e):
+    response = jsonify({'message': str(e)})
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response, 429
+
+# Декоратор для тяжелых маршрутов анализа (после token_required)
+def analysis_admission_required(f):
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        # С очередью анализ идет у воркеров, и процесс API не нагружается
+        if work_queue is not None:
+            return f(*args, **kwargs)
+        # Тело запроса читается до ожидания места: медленная загрузка видео
+        # не должна держать место анализа (файлы уходят во временные файлы)
+        request.files
+        try:
+            with analysis_admission.admit():
+                return f(*args, **kwargs)
+        except AdmissionRejected as e:
+            return retry_later(e)
+    
+    return decorated
+
+# Параметры анализа из настроек сервера и флагов запроса
+def analysis_options(**overrides):
+    options = {
+        'sequential': use_sequential_analysis(),
+        'pipelined': request_flag('pipelined', PIPELINED_ANALYSIS),
+        'motion_threshold': MOTION_GATE_THRESHOLD,
+        'motion_max_reuse': MOTION_GATE_MAX_REUSE,
+        'scoring': FATIGUE_SCORING,
+        'detection_cache': DETECTION_CACHE_DIR or None,
+    }
+    options.update(overrides)
+    return options
+
+# Ожидание задачи из очереди анализа; None - задача не завершилась за ANALYSIS_JOB_WAIT
+def wait_for_job(job_id):
+    deadline = time.monotonic() + ANALYSIS_JOB_WAIT
+    delay = 0.2
+    while True:
+        job = work_queue.get(job_id)
+        if job['status'] in ('done', 'failed'):
+            return job
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return None
+        time.sleep(min(delay, remaining))
+        delay = min(delay * 1.5, 2.0)
+
+# Ставит анализ в очередь и отвечает результатом или 202 с номером задачи
+def queued_analysis_response(video_path, user_id, flight_id=None, discard_path=None, extra=None, **options):
+    job_id = work_queue.enqueue(ANALYSIS_KIND, analysis_payload(video_path, user_id, flight_id, **options),
+                                video_path=video_path)
+    logger.info(f"Analysis of {video_path} queued as job {job_id}")
+    job = None
+    if job_waiters.acquire(blocking=False):
+        try:
+            job = wait_for_job(job_id)
+        finally:
+            job_waiters.release()
+    if job is None:
+        return jsonify({'job_id': job_id, 'status': 'queued', 'video_path': video_path,
+                        'message': 'Analysis is queued, poll /api/fatigue/jobs/<job_id> for the result'}), 202
+    if job['status'] == 'failed':
+        if discard_path:
+            video_storage.discard(discard_path)
+        if job['error'] == NO_FACES_ERROR:
+            return jsonify({'job_id': job_id, 'message': NO_FACES_ERROR}), 400
+        return jsonify({'job_id': job_id, 'message': f"Error analyzing video: {job['error']}"}), 500
+    return jsonify(analysis_job_result(job, extra))
+
+def analysis_job_result(job, extra=None):
+    result = job['result']
+    response = dict(extra or {})
+    response.update({
+        'job_id': job['job_id'],
+        'analysis_id': result['analysis_id'],
+        'fatigue_level': result['fatigue_level'],
+        'neural_network_score': result['neural_network_score'],
+        'analysis_date': datetime.fromtimestamp(job['finished_at']).isoformat(),
+        'video_path': job['payload']['video_path'],
+        'analyzed_fraction': result['analyzed_fraction'],
+        'stopped_early': result['stopped_early'],
+        'identities': result.get('identities', [])
+    })
+    return response
+
+# Создание access-токена пользователя
+def create_access_token(user):
+    return jwt.encode({
+        'user_id': user['id'],
+        'username': user['username'],
+        'role': user['role'],
+        'exp': datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_MINUTES)
+    }, SECRET_KEY, algorithm="HS256")
+
 # Маршрут для проверки состояния сервера
 @app.route('/api/status', methods=['GET'])
 def status():
-    return jsonify({'status': 'Server is running', 'time': time.time()})
+    return jsonify({'status': 'Server is running', 'time': time.time(),
+                    'analysis': analysis_admission.stats(),
+                    'work_queue': work_queue.stats() if work_queue is not None else None})
 
 # Маршрут для входа в систему
 @app.route('/api/login', methods=['POST'])
@@ -88,19 +334,28 @@ def login():
                        (username,)).fetchone()
     conn.close()
     
-    if not user or not check_password_hash(user['password'], password):
+    if not user:
+        return jsonify({'message': 'Invalid username or password'}), 401
+
+    try:
+        valid = password_hasher.check(user['password'], password, username=username,
+                                      ip=request.remote_addr)
+    except PasswordHasherBusy as e:
+        return retry_later(e)
+    if not valid:
         return jsonify({'message': 'Invalid username or password'}), 401
         
-    # Создаем токен доступа
-    token = jwt.encode({
-        'user_id': user['id'],
-        'username': user['username'],
-        'role': user['role'],
-        'exp': datetime.utcnow() + timedelta(hours=24)  # 24 часа
-    }, SECRET_KEY, algorithm="HS256")
+    # Создаем токены доступа и продления
+    token = create_access_token(user)
+    conn = get_db_connection()
+    refresh_token = issue_refresh_token(conn, user['id'], REFRESH_TOKEN_TTL)
+    conn.commit()
+    conn.close()
     
     return jsonify({
         'token': token,
+        'refresh_token': refresh_token,
+        'expires_in': ACCESS_TOKEN_MINUTES * 60,
         'user': {
             'id': user['id'],
             'username': user['username'],
@@ -129,7 +384,11 @@ def register():
         return jsonify({'message': 'User already exists'}), 400
     
     # Хешируем пароль
-    hashed_password = generate_password_hash(data['password'])
+    try:
+        hashed_password = password_hasher.hash(data['password'], ip=request.remote_addr)
+    except PasswordHasherBusy as e:
+        conn.close()
+        return retry_later(e)
     
     # Роль по умолчанию - pilot
     role = data.get('role', 'pilot')
@@ -147,9 +406,47 @@ def register():
         'user_id': user_id
     }), 201
 
+# Продление сессии по refresh-токену без повторной проверки пароля
+@app.route('/api/refresh-token', methods=['POST'])
+def refresh_access_token():
+    data = request.get_json(silent=True) or {}
+    refresh_token = data.get('refresh_token')
+    if not refresh_token:
+        return jsonify({'message': 'Missing refresh token'}), 400
+
+    conn = get_db_connection()
+    try:
+        rotated = rotate_refresh_token(conn, refresh_token, REFRESH_TOKEN_TTL)
+        if not rotated:
+            return jsonify({'message': 'Refresh token is invalid or expired'}), 401
+        user_id, new_refresh_token = rotated
+        user = conn.execute('SELECT * FROM users WHERE id = ?', (user_id,)).fetchone()
+    finally:
+        conn.close()
+
+    if not user:
+        return jsonify({'message': 'User not found!'}), 401
+
+    return jsonify({
+        'token': create_access_token(user),
+        'refresh_token': new_refresh_token,
+        'expires_in': ACCESS_TOKEN_MINUTES * 60
+    })
+
+# Выход: refresh-токен отзывается, access-токен истечет сам
+@app.route('/api/logout', methods=['POST'])
+def logout():
+    data = request.get_json(silent=True) or {}
+    if data.get('refresh_token'):
+        conn = get_db_connection()
+        revoke_refresh_token(conn, data['refresh_token'])
+        conn.close()
+    return jsonify({'message': 'Logged out'})
+
 # Маршрут для загрузки и анализа видео
 @app.route('/api/fatigue/analyze', methods=['POST'])
 @token_required
+@analysis_admission_required
 def analyze_fatigue():
     try:
         # Проверяем, что получено видео
@@ -162,96 +459,59 @@ def analyze_fatigue():
             return jsonify({'message': 'No video file selected'}), 400
             
         # Создаем уникальное имя файла
-        filename = f"{uuid.uuid4()}.webm"
-        filepath = os.path.join(UPLOAD_FOLDER, filename)
+        filename, filepath = video_storage.new_upload_path('.webm')
         
         # Сохраняем файл
         video_file.save(filepath)
-        print(f"Video saved to {filepath}")
+        logger.info(f"Video saved to {filepath}")
         
         # Проверяем, существует ли файл после сохранения
         if not os.path.exists(filepath) or os.path.getsize(filepath) == 0:
+            video_storage.discard(filepath)
             return jsonify({'message': 'Failed to save video file or file is empty'}), 500
             
-        # Конвертируем webm в mp4 для лучшей совместимости с OpenCV
-        converted_filename = f"converted_{filename.replace('.webm', '.mp4')}"
-        converted_filepath = os.path.join(UPLOAD_FOLDER, converted_filename)
-        
-        # Проверяем наличие ffmpeg
-        import subprocess
+        # Конвертируем webm в mp4 для лучшей совместимости с OpenCV,
+        # исходный webm удаляется сразу после конвертации
         try:
-            subprocess.run(["ffmpeg", "-version"], capture_output=True, check=True)
-        except (subprocess.SubprocessError, FileNotFoundError):
-            return jsonify({'message': 'ffmpeg not found. Required for video conversion'}), 500
-        
-        # Используем ffmpeg для конвертации
-        cmd = f"ffmpeg -y -i {filepath} -c:v libx264 -preset ultrafast {converted_filepath}"
-        process = subprocess.run(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        
-        if process.returncode != 0:
-            error_msg = process.stderr.decode('utf-8')
-            print(f"Conversion failed: {error_msg}")
-            return jsonify({'message': f'Video conversion failed: {error_msg[:200]}...'}), 500
+            converted_filename, converted_filepath = video_storage.convert_upload(filepath)
+        except VideoConversionError as e:
+            logger.error(f"Conversion failed: {str(e)}")
+            return jsonify({'message': str(e)}), 500
             
-        print(f"Video converted to {converted_filepath}")
+        logger.info(f"Video converted to {converted_filepath}")
         
-        # Проверяем, существует ли конвертированный файл
-        if not os.path.exists(converted_filepath) or os.path.getsize(converted_filepath) == 0:
-            return jsonify({'message': 'Converted video file is missing or empty'}), 500
+        if work_queue is not None:
+            return queued_analysis_response(converted_filename, request.current_user['id'],
+                                            discard_path=converted_filepath, **analysis_options())
         
         # Анализируем видео с помощью нашей модели усталости
         try:
-            # Инициализируем анализатор усталости
-            analyzer = FatigueAnalyzer('neural_network/data/models/fatigue_model.keras')
+            with log_context(job_id=converted_filename):
+                result = analyze_source(converted_filepath, is_video_file=True,
+                                        return_report=True, record_timeline=True,
+                                        **analysis_options())
             
-            # Открываем видео файл
-            video = cv2.VideoCapture(converted_filepath)
-            if not video.isOpened():
-                return jsonify({'message': 'Failed to open video file for analysis'}), 500
-                
-            fatigue_scores = []
-            frame_count = 0
-            
-            # Обрабатываем кадры видео
-            while True:
-                ret, frame = video.read()
-                if not ret:
-                    break
-                    
-                # Пропускаем каждые 5 кадров для ускорения
-                frame_count += 1
-                if frame_count % 5 != 0:
-                    continue
-                    
-                try:
-                    # Обрабатываем кадр и получаем предсказание
-                    processed_frame = analyzer.process_frame(frame)
-                    if len(analyzer.buffer) > 0:
-                        fatigue_scores.append(analyzer.buffer[-1])
-                except Exception as e:
-                    print(f"Error processing frame: {str(e)}")
-                    continue
-            
-            # Закрываем видео файл
-            video.release()
+            if result['level'] == 'Error':
+                video_storage.discard(converted_filepath)
+                return jsonify({'message': f"Error analyzing video: {result.get('error', 'unknown error')}"}), 500
             
             # Проверяем, есть ли результаты анализа
-            if not fatigue_scores:
+            if not result['samples']:
+                video_storage.discard(converted_filepath)
                 return jsonify({'message': 'No faces detected in video'}), 400
             
-            # Получаем окончательный результат анализа
-            result = analyzer.get_final_score()
-            
             # Сохраняем результат в БД
             conn = get_db_connection()
             conn.execute(
                 '''INSERT INTO fatigue_analysis 
-                   (user_id, fatigue_level, neural_network_score, video_path, analysis_date) 
-                   VALUES (?, ?, ?, ?, datetime('now'))''',
-                (request.current_user['id'], result['level'], result['score'], converted_filename)
+                   (user_id, fatigue_level, neural_network_score, video_path, analysis_date, model_version) 
+                   VALUES (?, ?, ?, ?, datetime('now'), ?)''',
+                (request.current_user['id'], result['level'], result['score'], converted_filename,
+                 result['model_version'])
             )
-            conn.commit()
             analysis_id = conn.execute('SELECT last_insert_rowid()').fetchone()[0]
+            save_timeline(conn, analysis_id, result.get('timeline', []))
+            conn.commit()
             conn.close()
             
             # Возвращаем результат
@@ -260,19 +520,18 @@ def analyze_fatigue():
                 'fatigue_level': result['level'],
                 'neural_network_score': result['score'],
                 'analysis_date': datetime.now().isoformat(),
-                'video_path': converted_filename
+                'video_path': converted_filename,
+                'analyzed_fraction': result['analyzed_fraction'],
+                'stopped_early': result['stopped_early']
             })
             
         except Exception as e:
-            print(f"Analysis error: {str(e)}")
-            import traceback
-            traceback.print_exc()
+            video_storage.discard(converted_filepath)
+            logger.error(f"Analysis error: {str(e)}", exc_info=True)
             return jsonify({'message': f'Error analyzing video: {str(e)}'}), 500
             
     except Exception as e:
-        print(f"General error: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.error(f"General error: {str(e)}", exc_info=True)
         return jsonify({'message': f'Server error: {str(e)}'}), 500
 
 # Маршрут для сохранения записи видео
@@ -289,37 +548,20 @@ def save_recording():
             return jsonify({'message': 'No video file selected'}), 400
         
         # Сохраняем файл
-        filename = f"{uuid.uuid4()}.webm"
-        filepath = os.path.join(UPLOAD_FOLDER, filename)
+        filename, filepath = video_storage.new_upload_path('.webm')
         video_file.save(filepath)
         
         # Проверяем, существует ли файл после сохранения
         if not os.path.exists(filepath) or os.path.getsize(filepath) == 0:
+            video_storage.discard(filepath)
             return jsonify({'message': 'Failed to save video file or file is empty'}), 500
         
-        # Конвертируем в mp4
-        converted_filename = f"converted_{filename.replace('.webm', '.mp4')}"
-        converted_filepath = os.path.join(UPLOAD_FOLDER, converted_filename)
-        
-        # Проверяем наличие ffmpeg
-        import subprocess
+        # Конвертируем в mp4, исходный webm удаляется
         try:
-            subprocess.run(["ffmpeg", "-version"], capture_output=True, check=True)
-        except (subprocess.SubprocessError, FileNotFoundError):
-            return jsonify({'message': 'ffmpeg not found. Required for video conversion'}), 500
-        
-        # Используем ffmpeg для конвертации
-        cmd = f"ffmpeg -y -i {filepath} -c:v libx264 -preset ultrafast {converted_filepath}"
-        process = subprocess.run(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        
-        if process.returncode != 0:
-            error_msg = process.stderr.decode('utf-8')
-            print(f"Conversion failed: {error_msg}")
-            return jsonify({'message': f'Video conversion failed: {error_msg[:200]}...'}), 500
-        
-        # Проверяем, существует ли конвертированный файл
-        if not os.path.exists(converted_filepath) or os.path.getsize(converted_filepath) == 0:
-            return jsonify({'message': 'Converted video file is missing or empty'}), 500
+            converted_filename, converted_filepath = video_storage.convert_upload(filepath)
+        except VideoConversionError as e:
+            logger.error(f"Conversion failed: {str(e)}")
+            return jsonify({'message': str(e)}), 500
         
         # Сохраняем запись в БД
         conn = get_db_connection()
@@ -340,14 +582,13 @@ def save_recording():
         })
         
     except Exception as e:
-        print(f"Save recording error: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.error(f"Save recording error: {str(e)}", exc_info=True)
         return jsonify({'message': f'Error saving recording: {str(e)}'}), 500
 
 # Маршрут для анализа последнего рейса
 @app.route('/api/fatigue/analyze-flight', methods=['POST'])
 @token_required
+@analysis_admission_required
 def analyze_flight():
     try:
         data = request.json
@@ -372,26 +613,39 @@ def analyze_flight():
             conn.close()
             return jsonify({'message': 'No video recording for this flight'}), 400
             
-        full_video_path = os.path.join(UPLOAD_FOLDER, video_path)
+        full_video_path = video_storage.resolve(video_path)
         
         # Проверяем существование файла
-        if not os.path.exists(full_video_path):
+        if not full_video_path:
             conn.close()
             return jsonify({'message': 'Video file not found'}), 404
         
+        options = analysis_options(multi_face=request_flag('multi_face', MULTI_FACE_FLIGHT_ANALYSIS))
+        if work_queue is not None:
+            conn.close()
+            return queued_analysis_response(video_path, request.current_user['id'], flight_id,
+                                            extra={'from_code': flight['from_code'],
+                                                   'to_code': flight['to_code']},
+                                            **options)
+        
         # Анализируем видео рейса
         try:
-            level, percent = analyze_source(full_video_path, is_video_file=True)
+            with log_context(job_id=video_path):
+                result = analyze_source(full_video_path, is_video_file=True,
+                                        return_report=True, record_timeline=True, **options)
+            level, percent = result['level'], result['percent']
             
             # Сохраняем результат анализа
             conn.execute(
                 '''INSERT INTO fatigue_analysis 
-                   (user_id, fatigue_level, neural_network_score, video_path, analysis_date, flight_id) 
-                   VALUES (?, ?, ?, ?, datetime('now'), ?)''',
-                (request.current_user['id'], level, percent / 100, video_path, flight_id)
+                   (user_id, fatigue_level, neural_network_score, video_path, analysis_date, flight_id, model_version) 
+                   VALUES (?, ?, ?, ?, datetime('now'), ?, ?)''',
+                (request.current_user['id'], level, percent / 100, video_path, flight_id,
+                 result['model_version'])
             )
-            conn.commit()
             analysis_id = conn.execute('SELECT last_insert_rowid()').fetchone()[0]
+            save_timeline(conn, analysis_id, result.get('timeline', []))
+            conn.commit()
             
             # Получаем данные о рейсе
             flight_data = dict(flight)
@@ -407,26 +661,81 @@ def analyze_flight():
                 'from_code': flight_data['from_code'],
                 'to_code': flight_data['to_code'],
                 'resolution': '1280x720',  # Пример данных
-                'fps': 30  # Пример данных
+                'fps': 30,  # Пример данных
+                'analyzed_fraction': result['analyzed_fraction'],
+                'stopped_early': result['stopped_early'],
+                'identities': result.get('identities', [])
             })
             
         except Exception as e:
             conn.close()
-            print(f"Flight analysis error: {str(e)}")
-            import traceback
-            traceback.print_exc()
+            logger.error(f"Flight analysis error: {str(e)}", exc_info=True)
             return jsonify({'message': f'Error analyzing flight video: {str(e)}'}), 500
             
     except Exception as e:
-        print(f"General flight error: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.error(f"General flight error: {str(e)}", exc_info=True)
         return jsonify({'message': f'Server error: {str(e)}'}), 500
 
+# Маршрут для получения состояния задачи из очереди анализа
+@app.route('/api/fatigue/jobs/<int:job_id>', methods=['GET'])
+@token_required
+def get_analysis_job(job_id):
+    if work_queue is None:
+        return jsonify({'message': 'Analysis queue is disabled'}), 404
+    try:
+        job = work_queue.get(job_id)
+        if job is None or job['payload'].get('user_id') != request.current_user['id']:
+            return jsonify({'message': 'Job not found'}), 404
+        
+        response = {'job_id': job_id, 'status': job['status'], 'attempts': job['attempts'],
+                    'video_path': job['payload']['video_path']}
+        if job['status'] == 'done':
+            response.update(analysis_job_result(job))
+        elif job['error']:
+            response['error'] = job['error']
+        return jsonify(response)
+        
+    except Exception as e:
+        logger.error(f"Job status error: {str(e)}")
+        return jsonify({'message': f'Error loading job: {str(e)}'}), 500
+
+# Маршрут для получения ряда оценок анализа, свернутого до нужного числа точек
+@app.route('/api/fatigue/analysis/<int:analysis_id>/timeline', methods=['GET'])
+@token_required
+def get_analysis_timeline(analysis_id):
+    try:
+        points = min(max(request.args.get('points', 200, type=int), 1), 5000)
+        
+        conn = get_db_connection()
+        owner = conn.execute('SELECT user_id FROM fatigue_analysis WHERE analysis_id = ?',
+                             (analysis_id,)).fetchone()
+        # Ряд оценок виден владельцу анализа, врачам и администраторам
+        if owner is None or (owner['user_id'] != request.current_user['id'] and
+                             request.current_user['role'] not in ('admin', 'medical')):
+            conn.close()
+            return jsonify({'message': 'Timeline not found'}), 404
+        timeline = load_timeline(conn, analysis_id)
+        conn.close()
+        
+        if timeline is None:
+            return jsonify({'message': 'Timeline not found'}), 404
+            
+        result = downsample(timeline, points)
+        result['analysis_id'] = analysis_id
+        result['samples'] = len(timeline)
+        return jsonify(result)
+        
+    except Exception as e:
+        logger.error(f"Timeline error: {str(e)}")
+        return jsonify({'message': f'Error loading timeline: {str(e)}'}), 500
+
 # Маршрут для получения видеофайла
 @app.route('/api/video/<path:filename>')
 def get_video(filename):
-    return send_from_directory(UPLOAD_FOLDER, filename)
+    path = video_storage.resolve(filename)
+    if not path:
+        return jsonify({'message': 'Video file not found'}), 404
+    return send_from_directory(os.path.dirname(os.path.abspath(path)), os.path.basename(path))
 
 # Маршрут для сохранения отзыва об анализе
 @app.route('/api/fatigue/feedback', methods=['POST'])
@@ -467,9 +776,190 @@ def save_feedback():
         })
         
     except Exception as e:
-        print(f"Feedback error: {str(e)}")
+        logger.error(f"Feedback error: {str(e)}")
         return jsonify({'message': f'Error saving feedback: {str(e)}'}), 500
 
+# История когнитивных тестов пользователя
+@app.route('/api/cognitive-tests', methods=['GET'])
+@token_required
+def get_cognitive_tests():
+    conn = get_db_connection()
+    tests = conn.execute(
+        'SELECT test_id, test_date, test_type, score, duration, details, cooldown_end '
+        'FROM CognitiveTests WHERE employee_id = ? ORDER BY test_date DESC',
+        (request.current_user['id'],)
+    ).fetchall()
+    conn.close()
+    return jsonify([dict(test) for test in tests])
+
+# Начало когнитивного теста
+@app.route('/api/tests/start', methods=['POST'])
+@token_required
+def start_test():
+    data = request.get_json(silent=True) or {}
+    test_type = data.get('test_type')
+    if test_type not in TEST_TYPES:
+        return jsonify({'error': f'Unknown test type: {test_type}'}), 400
+
+    cooldown_end = test_sessions.cooldown(request.current_user['id'], test_type)
+    if cooldown_end:
+        return jsonify({'error': 'Test is in cooldown', 'cooldown_end': cooldown_end}), 403
+
+    session = test_sessions.start(request.current_user['id'], test_type)
+    return jsonify({
+        'test_id': session['session_id'],
+        'questions': [public_question(q) for q in session['questions']],
+        'current_question': 0,
+        'time_limit': TEST_TYPES[test_type]['time_limit'],
+        'total_questions': len(session['questions'])
+    })
+
+# Ответ на один вопрос: обрабатывается в памяти, в БД попадает фоновой записью
+@app.route('/api/tests/answer', methods=['POST'])
+@token_required
+def answer_test_question():
+    data = request.get_json(silent=True) or {}
+    if not data.get('test_id') or not data.get('question_id') or 'answer' not in data:
+        return jsonify({'error': 'Missing test_id, question_id or answer'}), 400
+    try:
+        progress = test_sessions.answer(request.current_user['id'], data['test_id'],
+                                        data['question_id'], data['answer'])
+    except TestSessionError as e:
+        return jsonify({'error': str(e)}), e.status
+    return jsonify(progress)
+
+# Завершение теста и подсчет результата
+@app.route('/api/tests/submit', methods=['POST'])
+@token_required
+def submit_test():
+    data = request.get_json(silent=True) or {}
+    if not data.get('test_id'):
+        return jsonify({'error': 'Missing test_id'}), 400
+    try:
+        summary = test_sessions.complete(request.current_user['id'], data['test_id'],
+                                         data.get('answers') or {})
+    except TestSessionError as e:
+        return jsonify({'error': str(e)}), e.status
+    return jsonify(summary)
+
+# Подробный результат теста с ошибками
+@app.route('/api/tests/results/<int:test_id>', methods=['GET'])
+@token_required
+def get_test_results(test_id):
+    conn = get_db_connection()
+    test = conn.execute(
+        'SELECT test_id, test_date, test_type, score, duration, details, cooldown_end '
+        'FROM CognitiveTests WHERE test_id = ? AND employee_id = ?',
+        (test_id, request.current_user['id'])
+    ).fetchone()
+    if not test:
+        conn.close()
+        return jsonify({'error': 'Test result not found'}), 404
+    mistakes = conn.execute(
+        'SELECT question, user_answer, correct_answer FROM TestMistakes WHERE test_id = ?',
+        (test_id,)
+    ).fetchall()
+    conn.close()
+
+    result = dict(test)
+    try:
+        result['details'] = json.loads(result['details']) if result['details'] else {}
+    except ValueError:
+        result['details'] = {}
+    result['mistakes'] = [dict(mistake) for mistake in mistakes]
+    return jsonify(result)
+
+# Проверка перезарядки теста
+@app.route('/api/tests/cooldown/<test_type>', methods=['GET'])
+@token_required
+def get_test_cooldown(test_type):
+    cooldown_end = test_sessions.cooldown(request.current_user['id'], test_type)
+    if cooldown_end:
+        return jsonify({'in_cooldown': True, 'cooldown_end': cooldown_end})
+    return jsonify({'in_cooldown': False})
+
+# Предполетная готовность экипажей всех рейсов в окне времени
+@app.route('/api/readiness', methods=['GET'])
+@token_required
+def get_crew_readiness():
+    if request.current_user['role'] not in ('admin', 'medical'):
+        return jsonify({'message': 'Access denied'}), 403
+    try:
+        start = datetime.fromisoformat(request.args['from']) if 'from' in request.args else datetime.now()
+        hours = min(max(float(request.args.get('hours', READINESS_WINDOW_HOURS)), 0.0), 24 * 14)
+    except ValueError:
+        return jsonify({'message': 'Invalid from or hours parameter'}), 400
+
+    conn = get_db_connection()
+    try:
+        flights = readiness_cache.get_window(conn, start, start + timedelta(hours=hours))
+    except sqlite3.Error as e:
+        logger.error(f"Readiness error: {str(e)}")
+        return jsonify({'message': f'Error loading readiness: {str(e)}'}), 500
+    finally:
+        conn.close()
+
+    return jsonify({
+        'from': start.isoformat(),
+        'hours': hours,
+        'flights': flights
+    })
+
+# Кто превысит пределы налета, если будет назначен на рейсы окна
+@app.route('/api/duty/risks', methods=['GET'])
+@token_required
+def get_duty_risks():
+    if request.current_user['role'] not in ('admin', 'medical'):
+        return jsonify({'message': 'Access denied'}), 403
+    try:
+        start = datetime.fromisoformat(request.args['from']) if 'from' in request.args else datetime.now()
+        hours = min(max(float(request.args.get('hours', READINESS_WINDOW_HOURS)), 0.0), 24 * 14)
+        employees = request.args.get('employees', '')
+        employee_ids = [int(value) for value in employees.split(',') if value] if employees else None
+    except ValueError:
+        return jsonify({'message': 'Invalid from, hours or employees parameter'}), 400
+    include_ok = request.args.get('include_ok', 'false').lower() in ('1', 'true', 'yes')
+
+    conn = get_db_connection()
+    try:
+        result = duty_risks(conn, start, start + timedelta(hours=hours), employee_ids=employee_ids,
+                            limits=DUTY_LIMITS, include_ok=include_ok)
+    except sqlite3.Error as e:
+        logger.error(f"Duty risk error: {str(e)}")
+        return jsonify({'message': f'Error checking duty time: {str(e)}'}), 500
+    finally:
+        conn.close()
+
+    return jsonify(dict(result, **{'from': start.isoformat(), 'hours': hours}))
+
+# Полнотекстовый поиск по комментариям к отзывам и заметкам к анализам
+@app.route('/api/search', methods=['GET'])
+@token_required
+def search_notes():
+    if request.current_user['role'] not in ('admin', 'medical'):
+        return jsonify({'message': 'Access denied'}), 403
+    text = request.args.get('q', '').strip()
+    if not text:
+        return jsonify({'message': 'Missing search query'}), 400
+    sources = [source for source in request.args.get('source', '').split(',') if source]
+    known = {spec[0] for spec in SEARCH_SOURCES}
+    if any(source not in known for source in sources):
+        return jsonify({'message': f"Unknown source, expected one of: {', '.join(sorted(known))}"}), 400
+    try:
+        page = int(request.args.get('page', 1))
+        per_page = int(request.args.get('per_page', 20))
+    except ValueError:
+        return jsonify({'message': 'Invalid page or per_page parameter'}), 400
+
+    conn = get_db_connection()
+    try:
+        return jsonify(search_texts(conn, text, sources=sources, page=page, per_page=per_page))
+    except sqlite3.Error as e:
+        logger.error(f"Search error: {str(e)}")
+        return jsonify({'message': f'Error searching: {str(e)}'}), 500
+    finally:
+        conn.close()
+
 # Получение данных пользователя
 @app.route('/api/user', methods=['GET'])
 @token_required
@@ -482,5 +972,9 @@ def get_user():
         }
     })
 
+# Маршруты фронтенда регистрируются последними: / и пути клиентского роутера
+if FRONTEND_DIST:
+    register_frontend(app, FRONTEND_DIST)
+
 if __name__ == '__main__':
     app.run(debug=True, port=5000)
@@ -1,5 +1,6 @@
 
 import subprocess
+import argparse
 import sys
 import webbrowser
 import time
@@ -8,15 +9,10 @@ import platform
 import logging
 from threading import Thread
 
-# Настройка логирования
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(),
-        logging.FileHandler("app.log")
-    ]
-)
+from neural_network.logging_setup import setup_logging
+
+# Логирование через очередь: консоль и app.log с ротацией (JSON) пишет фоновый поток
+setup_logging(log_file=os.environ.get('LOG_FILE', 'app.log'))
 
 logger = logging.getLogger("FatigueGuard")
 
@@ -74,12 +70,12 @@ def run_frontend():
         logger.error(f"Frontend error: {e}")
         sys.exit(1)
 
-def run_backend():
+def run_backend(port=5000, debug=True):
     """Запуск бэкенда"""
     try:
         logger.info("Starting backend server")
         from routes import app
-        app.run(host='0.0.0.0', port=5000, debug=True, use_reloader=False)
+        app.run(host='0.0.0.0', port=port, debug=debug, use_reloader=False)
     except Exception as e:
         logger.error(f"Backend error: {e}")
         sys.exit(1)
@@ -91,7 +87,7 @@ def open_browser():
     logger.info(f"Opening browser at {url}")
     webbrowser.open(url)
 
-def check_server_status():
+def check_server_status(backend_url="http://localhost:5000", frontend_url="http://localhost:8080"):
     """Проверка статуса серверов"""
     import requests
     max_retries = 10
@@ -100,7 +96,7 @@ def check_server_status():
     # Проверка бэкенда
     for i in range(max_retries):
         try:
-            response = requests.get("http://localhost:5000/api/status")
+            response = requests.get(f"{backend_url}/api/status")
             if response.status_code == 200:
                 logger.info("Backend server is running")
                 print("Backend server is running")
@@ -114,7 +110,7 @@ def check_server_status():
     # Проверка фронтенда
     for i in range(max_retries):
         try:
-            response = requests.get("http://localhost:8080")
+            response = requests.get(frontend_url)
             if response.status_code == 200:
                 logger.info("Frontend server is running")
                 print("Frontend server is running")
@@ -125,7 +121,41 @@ def check_server_status():
                 print("WARNING: Frontend server not responding")
             time.sleep(retry_delay)
 
+def run_production(dist_dir, port):
+    """Продакшен-режим: собранный фронтенд раздает Flask, Node.js не нужен"""
+    from frontend_assets import precompress
+    if not os.path.isfile(os.path.join(dist_dir, 'index.html')):
+        logger.error(f"Frontend build not found in {dist_dir}")
+        print(f"\nERROR: Frontend build not found in {dist_dir}")
+        print("Build it once with `npm run build` (Node.js is only needed for the build)\n")
+        sys.exit(1)
+    # Сжатые варианты обычно создаются при сборке; здесь дописываются недостающие
+    precompress(dist_dir)
+    os.environ['FRONTEND_DIST'] = dist_dir
+
+    status_thread = Thread(target=check_server_status,
+                           kwargs={'backend_url': f"http://localhost:{port}",
+                                   'frontend_url': f"http://localhost:{port}/"})
+    status_thread.daemon = True
+    status_thread.start()
+
+    print(f"\nServing FatigueGuard on http://localhost:{port}")
+    print("Press Ctrl+C to exit\n")
+    try:
+        run_backend(port=port, debug=False)
+    except KeyboardInterrupt:
+        logger.info("Application shutdown initiated")
+        sys.exit(0)
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="FatigueGuard launcher")
+    parser.add_argument('--production', action='store_true',
+                        help='Serve the built frontend (dist/) from the backend without the Vite dev server')
+    parser.add_argument('--dist', default=os.environ.get('FRONTEND_DIST') or 'dist',
+                        help='Frontend build directory (production mode)')
+    parser.add_argument('--port', type=int, default=int(os.environ.get('PORT', '5000')))
+    args = parser.parse_args()
+
     print("\n===== FatigueGuard Application =====\n")
     
     # Проверка зависимостей
@@ -134,6 +164,10 @@ if __name__ == "__main__":
     
     # Создаем директорию для видео
     os.makedirs('neural_network/data/video', exist_ok=True)
+
+    if args.production:
+        run_production(args.dist, args.port)
+        sys.exit(0)
     
     # Start backend in a separate thread
     backend_thread = Thread(target=run_backend)
@@ -0,0 +1,87 @@
+import axios from 'axios';
+
+export const API_URL = import.meta.env.DEV ? 'http://localhost:5000/api' : '/api';
+
+export const TOKEN_KEY = 'fatigue-guard-token';
+export const USER_KEY = 'fatigue-guard-user';
+export const REFRESH_TOKEN_KEY = 'fatigue-guard-refresh-token';
+
+// Shared API client: every request carries the access token, and an expired
+// token is renewed once with the refresh token before the request is retried
+export const apiClient = axios.create({
+  baseURL: API_URL,
+  headers: {
+    'Content-Type': 'application/json'
+  }
+});
+
+apiClient.interceptors.request.use(
+  (config) => {
+    const token = localStorage.getItem(TOKEN_KEY);
+    if (token) {
+      config.headers.Authorization = `Bearer ${token}`;
+    }
+    return config;
+  },
+  (error) => {
+    return Promise.reject(error);
+  }
+);
+
+export const clearSession = () => {
+  localStorage.removeItem(TOKEN_KEY);
+  localStorage.removeItem(USER_KEY);
+  localStorage.removeItem(REFRESH_TOKEN_KEY);
+};
+
+// Renews the access token with the stored refresh token; one request at a time
+let refreshPromise: Promise<string> | null = null;
+export const renewAccessToken = (): Promise<string> => {
+  if (!refreshPromise) {
+    const storedRefreshToken = localStorage.getItem(REFRESH_TOKEN_KEY);
+    refreshPromise = (storedRefreshToken
+      ? apiClient.post('/refresh-token', { refresh_token: storedRefreshToken }).then((response) => {
+          const { token, refresh_token } = response.data;
+          localStorage.setItem(TOKEN_KEY, token);
+          localStorage.setItem(REFRESH_TOKEN_KEY, refresh_token);
+          return token as string;
+        })
+      : Promise.reject(new Error('No refresh token found'))
+    ).finally(() => {
+      refreshPromise = null;
+    });
+  }
+  return refreshPromise;
+};
+
+apiClient.interceptors.response.use(
+  (response) => response,
+  async (error) => {
+    const original = error.config;
+    // Expired access token: renew it without re-entering the password and retry once
+    if (
+      error.response?.status === 401 &&
+      original &&
+      !original._retry &&
+      !original.url?.includes('/refresh-token') &&
+      !original.url?.includes('/login')
+    ) {
+      original._retry = true;
+      try {
+        const token = await renewAccessToken();
+        original.headers.Authorization = `Bearer ${token}`;
+        return apiClient(original);
+      } catch (refreshError) {
+        console.error('Token refresh failed:', refreshError);
+      }
+    }
+    if (error.response?.status === 401 && !original?.url?.includes('/login')) {
+      // The session cannot be renewed: back to the login page
+      clearSession();
+      if (!window.location.pathname.includes('/login')) {
+        window.location.href = '/login';
+      }
+    }
+    return Promise.reject(error);
+  }
+);
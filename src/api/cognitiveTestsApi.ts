@@ -1,49 +1,7 @@
 
-import axios from 'axios';
+import { apiClient } from './client';
 import { TestHistory, TestSession, TestResult, TestResultSummary } from '../types/cognitivetests';
 
-const API_URL = import.meta.env.DEV ? 'http://localhost:5000/api' : '/api';
-
-const apiClient = axios.create({
-  baseURL: API_URL,
-  headers: {
-    'Content-Type': 'application/json'
-  }
-});
-
-// Add authentication token to each request
-apiClient.interceptors.request.use(
-  (config) => {
-    const token = localStorage.getItem('fatigue-guard-token');
-    if (token) {
-      config.headers.Authorization = `Bearer ${token}`;
-    } else {
-      console.warn('Authentication token missing for API request');
-    }
-    return config;
-  },
-  (error) => {
-    return Promise.reject(error);
-  }
-);
-
-// Handle common response errors
-apiClient.interceptors.response.use(
-  (response) => response,
-  (error) => {
-    // Handle 401 unauthorized errors by redirecting to login page
-    if (error.response?.status === 401) {
-      console.error('Authentication error:', error.response?.data || error.message);
-      
-      // Only redirect to login if we're not already on the login page
-      if (!window.location.pathname.includes('/login')) {
-        window.location.href = '/login';
-      }
-    }
-    return Promise.reject(error);
-  }
-);
-
 export const cognitiveTestsApi = {
   getTestHistory: async (): Promise<TestHistory[]> => {
     const response = await apiClient.get('/cognitive-tests');
@@ -55,6 +13,15 @@ export const cognitiveTestsApi = {
     return response.data;
   },
 
+  submitAnswer: async (testId: string, questionId: string, answer: string): Promise<{ answered: number, total_questions: number }> => {
+    const response = await apiClient.post('/tests/answer', {
+      test_id: testId,
+      question_id: questionId,
+      answer: answer
+    });
+    return response.data;
+  },
+
   submitTest: async (testId: string, answers: Record<string, string>): Promise<TestResultSummary> => {
     const response = await apiClient.post('/tests/submit', {
       test_id: testId,
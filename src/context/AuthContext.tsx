@@ -1,7 +1,7 @@
 import React, { createContext, useContext, useState, useEffect } from "react";
 import { useNavigate } from "react-router-dom";
 import { toast } from "@/components/ui/use-toast";
-import axios from "axios";
+import { apiClient, renewAccessToken, REFRESH_TOKEN_KEY } from "@/api/client";
 
 export type UserRole = "pilot" | "admin" | "medical";
 
@@ -28,42 +28,6 @@ interface AuthContextType {
 
 const AuthContext = createContext<AuthContextType | undefined>(undefined);
 
-// Create axios instance with base URL
-const api = axios.create({
-  baseURL: 'http://localhost:5000/api',
-  headers: {
-    'Content-Type': 'application/json'
-  }
-});
-
-// Add request interceptor for JWT
-api.interceptors.request.use(
-  (config) => {
-    const token = localStorage.getItem('fatigue-guard-token');
-    if (token) {
-      config.headers.Authorization = `Bearer ${token}`;
-    }
-    return config;
-  },
-  (error) => {
-    return Promise.reject(error);
-  }
-);
-
-// Add response interceptor for error handling
-api.interceptors.response.use(
-  (response) => response,
-  async (error) => {
-    if (error.response?.status === 401) {
-      // Redirect to login on authentication error
-      localStorage.removeItem('fatigue-guard-token');
-      localStorage.removeItem('fatigue-guard-user');
-      window.location.href = '/login';
-    }
-    return Promise.reject(error);
-  }
-);
-
 export const AuthProvider: React.FC<{ children: React.ReactNode }> = ({ children }) => {
   const [user, setUser] = useState<User | null>(null);
   const [loading, setLoading] = useState(true);
@@ -72,14 +36,7 @@ export const AuthProvider: React.FC<{ children: React.ReactNode }> = ({ children
   // Function to refresh the token
   const refreshToken = async () => {
     try {
-      const token = localStorage.getItem('fatigue-guard-token');
-      if (!token) {
-        throw new Error('No token found');
-      }
-
-      const response = await api.post('/refresh-token');
-      const newToken = response.data.token;
-      localStorage.setItem('fatigue-guard-token', newToken);
+      await renewAccessToken();
     } catch (error) {
       console.error('Token refresh failed:', error);
       logout();
@@ -101,7 +58,7 @@ export const AuthProvider: React.FC<{ children: React.ReactNode }> = ({ children
             console.error('Stored user data is incomplete:', parsedUser);
             // Попытаемся получить информацию о пользователе с сервера через endpoint /user-profile
             try {
-              const response = await api.get('/user-profile');
+              const response = await apiClient.get('/user-profile');
               const userData = response.data;
               console.log('Fetched user profile data:', userData);
               
@@ -120,7 +77,7 @@ export const AuthProvider: React.FC<{ children: React.ReactNode }> = ({ children
           
           // Validate token on startup
           try {
-            await api.get('/validate-token');
+            await apiClient.get('/validate-token');
           } catch (error) {
             console.error('Token validation failed:', error);
             await logout();
@@ -140,13 +97,16 @@ export const AuthProvider: React.FC<{ children: React.ReactNode }> = ({ children
   const login = async (username: string, password: string): Promise<boolean> => {
     setLoading(true);
     try {
-      const response = await api.post('/login', { username, password });
+      const response = await apiClient.post('/login', { username, password });
       console.log('Login API response:', response.data);
       
-      const { token, user } = response.data;
+      const { token, refresh_token, user } = response.data;
 
       if (token && user) {
         localStorage.setItem('fatigue-guard-token', token);
+        if (refresh_token) {
+          localStorage.setItem(REFRESH_TOKEN_KEY, refresh_token);
+        }
         localStorage.setItem('fatigue-guard-user', JSON.stringify(user));
         setUser(user);
 
@@ -173,13 +133,14 @@ export const AuthProvider: React.FC<{ children: React.ReactNode }> = ({ children
 
   const logout = async () => {
     try {
-      await api.post('/logout');
+      await apiClient.post('/logout', { refresh_token: localStorage.getItem(REFRESH_TOKEN_KEY) });
     } catch (error) {
       console.error('Logout error:', error);
     } finally {
       setUser(null);
       localStorage.removeItem('fatigue-guard-token');
       localStorage.removeItem('fatigue-guard-user');
+      localStorage.removeItem(REFRESH_TOKEN_KEY);
       navigate('/login');
       toast({
         title: "Выход из системы",
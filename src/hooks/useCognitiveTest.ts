@@ -131,6 +131,11 @@ export const useCognitiveTest = () => {
       ...currentTestSession.answers,
       [questionId]: answer
     };
+
+    // Ответ сохраняется на сервере сразу, чтобы прогресс пережил перезагрузку страницы
+    cognitiveTestsApi
+      .submitAnswer(currentTestSession.testId, questionId, answer)
+      .catch((error) => console.error("Не удалось сохранить ответ:", error));
     
     const nextQuestion = currentTestSession.currentQuestion + 1;
     
@@ -1,6 +1,6 @@
 import { useState } from 'react';
 import { toast } from '@/components/ui/use-toast';
-import axios from 'axios';
+import { apiClient, API_URL } from '@/api/client';
 
 interface AnalysisResult {
   analysis_id?: number;
@@ -15,6 +15,12 @@ interface AnalysisResult {
   fps?: number;
 }
 
+interface AnalysisJob extends AnalysisResult {
+  job_id: number;
+  status: 'queued' | 'running' | 'done' | 'failed';
+  error?: string;
+}
+
 interface Flight {
   flight_id?: number;
   from_code?: string;
@@ -23,33 +29,6 @@ interface Flight {
   video_path?: string;
 }
 
-const API_BASE_URL = import.meta.env.PROD ? '/api' : 'http://localhost:5000/api';
-
-// Configure axios instance with proper base URL and auth token
-const apiClient = axios.create({
-  baseURL: API_BASE_URL,
-  headers: {
-    'Content-Type': 'application/json'
-  }
-});
-
-// Add authentication token to each request
-apiClient.interceptors.request.use(
-  (config) => {
-    const token = localStorage.getItem('fatigue-guard-token');
-    if (token) {
-      config.headers.Authorization = `Bearer ${token}`;
-    } else {
-      console.warn('No authentication token available for API request');
-    }
-    return config;
-  },
-  (error) => {
-    console.error('Request error:', error);
-    return Promise.reject(error);
-  }
-);
-
 export const useFatigueAnalysis = (onSuccess?: (result: AnalysisResult) => void) => {
   const [analysisResult, setAnalysisResult] = useState<AnalysisResult | null>(null);
   const [recordedBlob, setRecordedBlob] = useState<Blob | null>(null);
@@ -70,6 +49,41 @@ export const useFatigueAnalysis = (onSuccess?: (result: AnalysisResult) => void)
     });
   };
 
+  // С очередью анализа сервер отвечает 202 с job_id: результат забирается опросом задачи
+  const waitForJob = async (jobId: number): Promise<AnalysisJob> => {
+    let delay = 1000;
+    while (true) {
+      await new Promise(resolve => setTimeout(resolve, delay));
+      const response = await apiClient.get<AnalysisJob>(`/fatigue/jobs/${jobId}`);
+      if (response.data.status === 'done' || response.data.status === 'failed') {
+        return response.data;
+      }
+      delay = Math.min(delay * 1.5, 5000);
+    }
+  };
+
+  // Результат ответа анализа: сразу (200) или после завершения задачи из очереди (202)
+  const resolveAnalysis = async (status: number, data: any): Promise<AnalysisResult | null> => {
+    if (status !== 202 || !data?.job_id) {
+      return data;
+    }
+    setAnalysisProgress({
+      loading: true,
+      message: 'Видео в очереди на анализ...',
+      percent: 80,
+    });
+    const job = await waitForJob(data.job_id);
+    if (job.status === 'failed') {
+      toast({
+        title: "Ошибка анализа",
+        description: job.error || "Не удалось проанализировать видео",
+        variant: "destructive"
+      });
+      return null;
+    }
+    return job;
+  };
+
   const submitRecording = async (blob: Blob) => {
     try {
       // Validate the blob before proceeding
@@ -98,7 +112,7 @@ export const useFatigueAnalysis = (onSuccess?: (result: AnalysisResult) => void)
         percent: 60,
       });
 
-      console.log('Submitting video to API:', `${API_BASE_URL}/fatigue/analyze`);
+      console.log('Submitting video to API:', `${API_URL}/fatigue/analyze`);
       console.log('Video blob size:', blob.size);
       console.log('Video blob type:', blob.type);
       
@@ -117,33 +131,44 @@ export const useFatigueAnalysis = (onSuccess?: (result: AnalysisResult) => void)
           }
         });
 
+        const result = await resolveAnalysis(response.status, response.data);
+        if (!result) {
+          setAnalysisProgress({loading: false, message: '', percent: 0});
+          return;
+        }
+
         setAnalysisProgress({
           loading: false,
           message: '',
           percent: 100,
         });
 
-        if (response.data) {
-          console.log('API Response:', response.data);
-          setAnalysisResult(response.data);
-          if (onSuccess) onSuccess(response.data);
-        }
+        console.log('API Response:', result);
+        setAnalysisResult(result);
+        if (onSuccess) onSuccess(result);
       } catch (apiError: any) {
         console.error('API Error:', apiError);
         console.error('Error details:', apiError.response?.data || 'No response data');
         console.error('Status code:', apiError.response?.status);
         
+        // Токен уже не удалось обновить: клиент API сам переводит на страницу входа
         if (apiError.response?.status === 401) {
           toast({
             title: "Ошибка авторизации",
             description: "Необходимо выполнить вход в систему. Перенаправление на страницу входа...",
             variant: "destructive"
           });
-          
-          // Если ошибка авторизации, перенаправляем на страницу входа
-          setTimeout(() => {
-            window.location.href = '/login';
-          }, 2000);
+          return;
+        }
+
+        // Сервер перегружен анализом других видео - результат не подменяем демо-данными
+        if (apiError.response?.status === 429) {
+          setAnalysisProgress({loading: false, message: '', percent: 0});
+          toast({
+            title: "Сервер перегружен",
+            description: `Сейчас анализируются другие видео. Повторите попытку через ${apiError.response.headers?.['retry-after'] || 'несколько'} сек.`,
+            variant: "destructive"
+          });
           return;
         }
         
@@ -200,7 +225,7 @@ export const useFatigueAnalysis = (onSuccess?: (result: AnalysisResult) => void)
   // New helper function to check if server is running
   const checkServerStatus = async (): Promise<boolean> => {
     try {
-      await axios.get(`${API_BASE_URL}/status`, { timeout: 2000 });
+      await apiClient.get('/status', { timeout: 2000 });
       return true;
     } catch (error) {
       return false;
@@ -219,7 +244,7 @@ export const useFatigueAnalysis = (onSuccess?: (result: AnalysisResult) => void)
       formData.append('video', blob, `history_${Date.now()}.webm`);
       
       try {
-        console.log('Saving video to API:', `${API_BASE_URL}/fatigue/save-recording`);
+        console.log('Saving video to API:', `${API_URL}/fatigue/save-recording`);
         
         // Сохраняем запись в базу данных
         const response = await apiClient.post('/fatigue/save-recording', formData, {
@@ -280,22 +305,25 @@ export const useFatigueAnalysis = (onSuccess?: (result: AnalysisResult) => void)
       setAnalysisProgress(p => ({...p, percent: 40, message: 'Загрузка видео рейса...'}));
 
       try {
-        console.log('Analyzing flight with API:', `${API_BASE_URL}/fatigue/analyze-flight`, lastFlight);
+        console.log('Analyzing flight with API:', `${API_URL}/fatigue/analyze-flight`, lastFlight);
         
         // Реальный запрос к API для анализа последнего рейса
         const response = await apiClient.post('/fatigue/analyze-flight', {
           flight_id: lastFlight?.flight_id,
         });
 
-        setAnalysisProgress({loading: false, message: '', percent: 100});
-
-        console.log('Flight analysis response:', response.data);
-        
-        if (response.data) {
-          setAnalysisResult(response.data);
-          if (onSuccess) onSuccess(response.data);
+        const result = await resolveAnalysis(response.status, response.data);
+        if (!result) {
+          setAnalysisProgress({loading: false, message: '', percent: 0});
           return;
         }
+
+        setAnalysisProgress({loading: false, message: '', percent: 100});
+
+        console.log('Flight analysis response:', result);
+        setAnalysisResult(result);
+        if (onSuccess) onSuccess(result);
+        return;
       } catch (apiError: any) {
         console.error('API Error:', apiError);
         
@@ -307,6 +335,16 @@ export const useFatigueAnalysis = (onSuccess?: (result: AnalysisResult) => void)
           });
           return;
         }
+
+        if (apiError.response?.status === 429) {
+          setAnalysisProgress({loading: false, message: '', percent: 0});
+          toast({
+            title: "Сервер перегружен",
+            description: `Сейчас анализируются другие видео. Повторите попытку через ${apiError.response.headers?.['retry-after'] || 'несколько'} сек.`,
+            variant: "destructive"
+          });
+          return;
+        }
         
         toast({
           title: "Ошибка соединения с API",
@@ -1,31 +1,10 @@
 
 import { useQuery, useMutation, useQueryClient } from "@tanstack/react-query";
-import axios from "axios";
+import { apiClient } from "@/api/client";
 import { Feedback, FeedbackSubmission } from "@/types/feedback";
 import { useToast } from "@/hooks/use-toast";
 
-const FEEDBACK_API = "/api/feedback";
-
-const api = axios.create({
-  baseURL: 'http://localhost:5000',
-  withCredentials: true,
-  headers: {
-    'Content-Type': 'application/json',
-  }
-});
-
-api.interceptors.request.use(
-  (config) => {
-    const token = localStorage.getItem("authToken") || localStorage.getItem("fatigue-guard-token");
-    if (token) {
-      config.headers.Authorization = `Bearer ${token}`;
-    }
-    return config;
-  },
-  (error) => {
-    return Promise.reject(error);
-  }
-);
+const FEEDBACK_API = "/feedback";
 
 export function useFeedback() {
   const { toast } = useToast();
@@ -35,7 +14,7 @@ export function useFeedback() {
     queryKey: ["feedback"],
     queryFn: async () => {
       try {
-        const { data } = await api.get<Feedback[]>(FEEDBACK_API);
+        const { data } = await apiClient.get<Feedback[]>(FEEDBACK_API);
         return Array.isArray(data) ? data : [];
       } catch (error) {
         console.error("Error fetching feedback:", error);
@@ -78,7 +57,7 @@ export function useFeedback() {
           comments: feedback.comments
         };
         
-        const response = await api.post(FEEDBACK_API, requestData);
+        const response = await apiClient.post(FEEDBACK_API, requestData);
         return response.data;
       } catch (error) {
         throw error;
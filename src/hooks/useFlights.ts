@@ -1,6 +1,7 @@
 
 import { useQuery } from "@tanstack/react-query";
 import axios from "axios";
+import { apiClient } from "@/api/client";
 
 export interface FlightApi {
   flight_id: number;
@@ -16,32 +17,9 @@ export interface FlightApi {
   crew_name?: string;
 }
 
-// Create axios instance with base configuration
-const api = axios.create({
-  baseURL: 'http://localhost:5000',
-  withCredentials: true,
-  headers: {
-    'Content-Type': 'application/json',
-  }
-});
-
-// Add request interceptor for JWT
-api.interceptors.request.use(
-  (config) => {
-    const token = localStorage.getItem("authToken") || localStorage.getItem("fatigue-guard-token");
-    if (token) {
-      config.headers.Authorization = `Bearer ${token}`;
-    }
-    return config;
-  },
-  (error) => {
-    return Promise.reject(error);
-  }
-);
-
 const fetchFlights = async (): Promise<FlightApi[]> => {
   try {
-    const response = await api.get("/api/flights");
+    const response = await apiClient.get("/flights");
     
     if (!Array.isArray(response.data)) {
       if (response.data && Array.isArray(response.data.flights)) {
@@ -0,0 +1,493 @@
+
+import re
+import time
+import json
+import uuid
+import random
+import sqlite3
+import logging
+import threading
+from datetime import datetime, timedelta
+
+logger = logging.getLogger("TestSessions")
+
+# Параметры тестов: число вопросов, лимит времени (с) и перезарядка (мин)
+TEST_TYPES = {
+    'attention': {'questions': 10, 'time_limit': 300, 'cooldown_minutes': 30},
+    'memory': {'questions': 8, 'time_limit': 300, 'cooldown_minutes': 30},
+    'reaction': {'questions': 10, 'time_limit': 120, 'cooldown_minutes': 15},
+    'cognitive': {'questions': 10, 'time_limit': 420, 'cooldown_minutes': 60},
+}
+
+# Колонки, которых нет в исходной схеме TestSessions/CognitiveTests
+SESSION_COLUMNS = {'answers': 'TEXT', 'last_activity': 'REAL'}
+TEST_COLUMNS = {'cooldown_end': 'TEXT'}
+
+# Результаты, которые не удалось записать из-за нарушения ограничений схемы
+DEAD_LETTER_TABLE = 'test_result_dead_letters'
+
+_TEST_TYPE_CHECK = re.compile(r'CHECK\s*\(\s*test_type\s+IN\s*\([^)]*\)\s*\)', re.IGNORECASE)
+
+
+def _options(rng: random.Random, correct: int, spread: int = 5) -> list:
+    options = {correct}
+    while len(options) < 4:
+        options.add(correct + rng.randint(-spread, spread))
+    return [str(option) for option in rng.sample(sorted(options), 4)]
+
+
+def _attention_question(rng: random.Random, index: int) -> dict:
+    symbols = rng.sample('АБВГДЕЖЗИКЛМН', 4)
+    target = symbols[0]
+    line = ''.join(rng.choice(symbols) for _ in range(30))
+    count = line.count(target)
+    return {'type': 'count', 'question': f'Сколько раз встречается символ «{target}»?',
+            'stimulus': line, 'options': _options(rng, count), 'correct_answer': str(count)}
+
+
+def _memory_question(rng: random.Random, index: int) -> dict:
+    digits = ''.join(str(rng.randint(0, 9)) for _ in range(4 + index // 2))
+    return {'type': 'sequence', 'question': 'Введите запомненную последовательность цифр',
+            'stimulus': digits, 'delay': 3000, 'correct_answer': digits}
+
+
+def _reaction_question(rng: random.Random, index: int) -> dict:
+    a, b = rng.randint(2, 20), rng.randint(2, 20)
+    return {'type': 'math', 'question': f'{a} + {b} = ?', 'options': _options(rng, a + b),
+            'correct_answer': str(a + b), 'time_limit': 10}
+
+
+def _cognitive_question(rng: random.Random, index: int) -> dict:
+    start, step = rng.randint(1, 10), rng.randint(2, 6)
+    if rng.random() < 0.5:
+        sequence = [start + step * i for i in range(5)]
+    else:
+        sequence = [start * (step // 2 + 1) ** i for i in range(5)]
+    answer = sequence.pop()
+    return {'type': 'pattern', 'question': f"Продолжите ряд: {', '.join(map(str, sequence))}, ?",
+            'options': _options(rng, answer, spread=max(5, answer // 5)), 'correct_answer': str(answer)}
+
+
+QUESTION_GENERATORS = {
+    'attention': _attention_question,
+    'memory': _memory_question,
+    'reaction': _reaction_question,
+    'cognitive': _cognitive_question,
+}
+
+
+def generate_questions(test_type: str, seed=None) -> list:
+    rng = random.Random(seed)
+    questions = []
+    for index in range(TEST_TYPES[test_type]['questions']):
+        question = QUESTION_GENERATORS[test_type](rng, index)
+        question['id'] = f'q{index + 1}'
+        questions.append(question)
+    return questions
+
+
+def public_question(question: dict) -> dict:
+    """Вопрос без правильного ответа для отправки клиенту"""
+    return {key: value for key, value in question.items() if key != 'correct_answer'}
+
+
+def _add_missing_columns(conn: sqlite3.Connection, table: str, columns: dict):
+    existing = [row[1] for row in conn.execute(f'PRAGMA table_info({table})')]
+    for name, column_type in columns.items():
+        if name not in existing:
+            conn.execute(f'ALTER TABLE {table} ADD COLUMN {name} {column_type}')
+
+
+def _migrate_test_type_check(conn: sqlite3.Connection):
+    """Пересоздает CognitiveTests, если CHECK на test_type не допускает все типы из TEST_TYPES.
+
+    В старых БД ограничение знает только attention/memory/reaction, и результат
+    теста cognitive нарушал бы его при каждой записи.
+    """
+    row = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'CognitiveTests'").fetchone()
+    match = _TEST_TYPE_CHECK.search(row[0]) if row else None
+    if match is None or all(f"'{test_type}'" in match.group(0) for test_type in TEST_TYPES):
+        return
+    allowed = ', '.join(f"'{test_type}'" for test_type in TEST_TYPES)
+    create_sql = row[0][:match.start()] + f'CHECK(test_type IN ({allowed}))' + row[0][match.end():]
+    create_sql = re.sub(r'^CREATE TABLE\s+("?)CognitiveTests\1', 'CREATE TABLE CognitiveTests_new', create_sql)
+    # Индексы и триггеры удаляются вместе со старой таблицей и создаются заново
+    dependents = [sql for (sql,) in conn.execute(
+        "SELECT sql FROM sqlite_master WHERE tbl_name = 'CognitiveTests' "
+        "AND type IN ('index', 'trigger') AND sql IS NOT NULL")]
+    columns = ', '.join(r[1] for r in conn.execute('PRAGMA table_info(CognitiveTests)'))
+    conn.commit()
+    conn.execute('BEGIN')
+    try:
+        conn.execute(create_sql)
+        conn.execute(f'INSERT INTO CognitiveTests_new ({columns}) SELECT {columns} FROM CognitiveTests')
+        conn.execute('DROP TABLE CognitiveTests')
+        conn.execute('ALTER TABLE CognitiveTests_new RENAME TO CognitiveTests')
+        for sql in dependents:
+            conn.execute(sql)
+        conn.execute('COMMIT')
+    except sqlite3.Error:
+        conn.execute('ROLLBACK')
+        raise
+    logger.info(f"CognitiveTests test_type check migrated to: {allowed}")
+
+
+def ensure_test_session_schema(conn: sqlite3.Connection):
+    """Создает таблицы тестов (если БД создана не через init_db) и недостающие колонки"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS TestSessions (
+            session_id TEXT PRIMARY KEY,
+            employee_id INTEGER NOT NULL,
+            test_type TEXT NOT NULL,
+            start_time TEXT NOT NULL,
+            questions TEXT NOT NULL
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS CognitiveTests (
+            test_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            employee_id INTEGER NOT NULL,
+            test_date TEXT NOT NULL,
+            test_type TEXT,
+            score REAL NOT NULL,
+            duration INTEGER NOT NULL,
+            details TEXT
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS TestMistakes (
+            mistake_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            test_id INTEGER NOT NULL,
+            question TEXT NOT NULL,
+            user_answer TEXT,
+            correct_answer TEXT NOT NULL
+        )
+    ''')
+    _add_missing_columns(conn, 'TestSessions', SESSION_COLUMNS)
+    conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS {DEAD_LETTER_TABLE} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id TEXT NOT NULL,
+            employee_id INTEGER NOT NULL,
+            payload TEXT NOT NULL,
+            error TEXT NOT NULL,
+            failed_at TEXT NOT NULL
+        )
+    ''')
+    _add_missing_columns(conn, 'CognitiveTests', TEST_COLUMNS)
+    _migrate_test_type_check(conn)
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_cognitive_tests_employee '
+                 'ON CognitiveTests (employee_id, test_type, test_date)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_test_mistakes_test ON TestMistakes (test_id)')
+    conn.commit()
+
+
+class TestSessionError(Exception):
+    """Сессия не найдена, истекла, принадлежит другому пользователю или ответ некорректен"""
+
+    def __init__(self, message: str, status: int = 400):
+        super().__init__(message)
+        self.status = status
+
+
+class TestSessionStore:
+    """Хранилище активных сессий когнитивных тестов.
+
+    Сессии живут в памяти: ответ на вопрос - это изменение словаря без обращения к БД.
+    Изменения раз в flush_interval секунд записываются в TestSessions одной транзакцией.
+    Завершенные тесты записываются в CognitiveTests/TestMistakes групповым коммитом:
+    одновременные завершения объединяются в одну транзакцию, каждый результат - в своей
+    точке сохранения. Сессия удаляется только вместе с записью ее результата, поэтому
+    повторная отправка после 503 получает тот же результат. Результат, нарушающий
+    ограничения схемы, переносится в test_result_dead_letters и не повторяется.
+    После перезапуска сессия, которой нет в памяти, подгружается из TestSessions.
+    """
+
+    def __init__(self, db_path: str, ttl: float = 3600, flush_interval: float = 2.0,
+                 result_timeout: float = 30.0):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.result_timeout = result_timeout
+        self._sessions = {}
+        self._dirty = set()
+        self._results = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def start(self, employee_id: int, test_type: str) -> dict:
+        if test_type not in TEST_TYPES:
+            raise TestSessionError(f'Unknown test type: {test_type}')
+        now = time.time()
+        session = {
+            'session_id': str(uuid.uuid4()),
+            'employee_id': employee_id,
+            'test_type': test_type,
+            'start_time': datetime.now().isoformat(),
+            'started': now,
+            'last_activity': now,
+            'questions': generate_questions(test_type),
+            'answers': {},
+            'persisted': False,
+        }
+        with self._lock:
+            self._sessions[session['session_id']] = session
+            self._dirty.add(session['session_id'])
+        return session
+
+    def _load(self, session_id: str):
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                'SELECT employee_id, test_type, start_time, questions, answers, last_activity '
+                'FROM TestSessions WHERE session_id = ?', (session_id,)
+            ).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            return None
+        started = datetime.fromisoformat(row[2]).timestamp()
+        return {
+            'session_id': session_id,
+            'employee_id': row[0],
+            'test_type': row[1],
+            'start_time': row[2],
+            'started': started,
+            'last_activity': row[5] or started,
+            'questions': json.loads(row[3]),
+            'answers': json.loads(row[4]) if row[4] else {},
+            'persisted': True,
+        }
+
+    def _get(self, session_id: str, employee_id: int) -> dict:
+        with self._lock:
+            session = self._sessions.get(session_id)
+        if session is None:
+            # Сессия начата до перезапуска сервера
+            session = self._load(session_id)
+            if session is not None:
+                with self._lock:
+                    session = self._sessions.setdefault(session_id, session)
+        if session is None:
+            raise TestSessionError('Test session not found', 404)
+        if session['employee_id'] != employee_id:
+            raise TestSessionError('Test session belongs to another user', 403)
+        if time.time() - session['last_activity'] > self.ttl:
+            raise TestSessionError('Test session expired', 410)
+        return session
+
+    def answer(self, employee_id: int, session_id: str, question_id: str, answer: str) -> dict:
+        session = self._get(session_id, employee_id)
+        if not any(q['id'] == question_id for q in session['questions']):
+            raise TestSessionError(f'Unknown question: {question_id}')
+        with self._lock:
+            if session.get('result') is not None:
+                raise TestSessionError('Test session already completed', 409)
+            session['answers'][question_id] = str(answer)
+            session['last_activity'] = time.time()
+            self._dirty.add(session_id)
+        return {'answered': len(session['answers']), 'total_questions': len(session['questions'])}
+
+    def complete(self, employee_id: int, session_id: str, answers: dict = None) -> dict:
+        """Подсчитывает результат, записывает его и возвращает сводку с test_id"""
+        session = self._get(session_id, employee_id)
+        with self._lock:
+            result = session.get('result')
+            if result is None:
+                # Повторная отправка ждет тот же результат, а не создает второй
+                session['answers'].update({str(k): str(v) for k, v in (answers or {}).items()})
+                result = self._score(session)
+                session['result'] = result
+                self._dirty.discard(session_id)
+                self._results.append(result)
+        self.flush()
+        if not result['done'].wait(self.result_timeout):
+            raise TestSessionError('Failed to save test result', 503)
+        if result['error']:
+            raise TestSessionError('Failed to save test result', 500)
+        return dict(result['summary'], test_id=result['test_id'])
+
+    @staticmethod
+    def _score(session: dict) -> dict:
+        settings = TEST_TYPES[session['test_type']]
+        mistakes = []
+        error_analysis = {}
+        for question in session['questions']:
+            user_answer = session['answers'].get(question['id'])
+            if user_answer is None or user_answer.strip() != question['correct_answer']:
+                mistakes.append((question['question'], user_answer, question['correct_answer']))
+                error_analysis[question['type']] = error_analysis.get(question['type'], 0) + 1
+        total = len(session['questions'])
+        correct = total - len(mistakes)
+        now = datetime.now()
+        score = round(correct / total * 100, 1) if total else 0.0
+        cooldown_end = (now + timedelta(minutes=settings['cooldown_minutes'])).isoformat()
+        return {
+            'session_id': session['session_id'],
+            'row': (session['employee_id'], now.isoformat(), session['test_type'], score,
+                    int(time.time() - session['started']),
+                    json.dumps({'total_questions': total, 'correct_answers': correct,
+                                'error_analysis': error_analysis}, ensure_ascii=False),
+                    cooldown_end),
+            'mistakes': mistakes,
+            'summary': {'score': score, 'total_questions': total, 'correct_answers': correct,
+                        'cooldown_end': cooldown_end},
+            'done': threading.Event(),
+            'test_id': None,
+            'error': None,
+        }
+
+    def flush(self):
+        """Записывает накопленные изменения одной транзакцией"""
+        with self._flush_lock:
+            with self._lock:
+                dirty = [self._sessions[sid] for sid in self._dirty if sid in self._sessions]
+                new_rows = [(s['session_id'], s['employee_id'], s['test_type'], s['start_time'],
+                             json.dumps(s['questions'], ensure_ascii=False))
+                            for s in dirty if not s['persisted']]
+                update_rows = [(json.dumps(s['answers'], ensure_ascii=False), s['last_activity'],
+                                s['session_id']) for s in dirty]
+                results = self._results
+                self._dirty = set()
+                self._results = []
+            if not (dirty or results):
+                return
+
+            written, failed = [], []
+            conn = self._connect()
+            try:
+                with conn:
+                    conn.executemany(
+                        'INSERT OR IGNORE INTO TestSessions '
+                        '(session_id, employee_id, test_type, start_time, questions) VALUES (?, ?, ?, ?, ?)',
+                        new_rows
+                    )
+                    conn.executemany(
+                        'UPDATE TestSessions SET answers = ?, last_activity = ? WHERE session_id = ?',
+                        update_rows
+                    )
+                    for result in results:
+                        outcome = self._write_result(conn, result)
+                        (written if isinstance(outcome, int) else failed).append((result, outcome))
+            except sqlite3.Error as e:
+                logger.error(f"Test session flush failed: {str(e)}")
+                # Изменения вернутся в очередь и будут записаны следующей попыткой
+                with self._lock:
+                    self._dirty.update(s['session_id'] for s in dirty
+                                       if s['session_id'] in self._sessions)
+                    self._results = results + self._results
+                return
+            finally:
+                conn.close()
+
+            with self._lock:
+                for session in dirty:
+                    session['persisted'] = True
+                for result, _ in written + failed:
+                    self._sessions.pop(result['session_id'], None)
+            for result, test_id in written:
+                result['test_id'] = test_id
+                result['done'].set()
+            for result, error in failed:
+                result['error'] = error
+                result['done'].set()
+
+    def _write_result(self, conn: sqlite3.Connection, result: dict):
+        """Записывает результат и удаляет его сессию; возвращает test_id или текст ошибки.
+
+        Нарушение ограничений откатывает только этот результат: он переносится в
+        test_result_dead_letters, сессия удаляется, остальные записи группы сохраняются.
+        """
+        conn.execute('SAVEPOINT test_result')
+        try:
+            cursor = conn.execute(
+                'INSERT INTO CognitiveTests (employee_id, test_date, test_type, score, '
+                'duration, details, cooldown_end) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                result['row']
+            )
+            test_id = cursor.lastrowid
+            conn.executemany(
+                'INSERT INTO TestMistakes (test_id, question, user_answer, correct_answer) '
+                'VALUES (?, ?, ?, ?)',
+                [(test_id,) + mistake for mistake in result['mistakes']]
+            )
+            conn.execute('DELETE FROM TestSessions WHERE session_id = ?', (result['session_id'],))
+            conn.execute('RELEASE test_result')
+            return test_id
+        except sqlite3.IntegrityError as e:
+            conn.execute('ROLLBACK TO test_result')
+            conn.execute('RELEASE test_result')
+            error = str(e)
+        logger.error(f"Test result for session {result['session_id']} moved to dead letters: {error}")
+        conn.execute(
+            f'INSERT INTO {DEAD_LETTER_TABLE} (session_id, employee_id, payload, error, failed_at) '
+            'VALUES (?, ?, ?, ?, ?)',
+            (result['session_id'], result['row'][0],
+             json.dumps({'row': result['row'], 'mistakes': result['mistakes']}, ensure_ascii=False),
+             error, datetime.now().isoformat())
+        )
+        conn.execute('DELETE FROM TestSessions WHERE session_id = ?', (result['session_id'],))
+        return error
+
+    def expire(self):
+        """Удаляет брошенные сессии из памяти и из БД"""
+        deadline = time.time() - self.ttl
+        with self._lock:
+            # Сессии с результатом в очереди на запись удалит flush
+            expired = [sid for sid, s in self._sessions.items()
+                       if s['last_activity'] < deadline and s.get('result') is None]
+            for sid in expired:
+                self._sessions.pop(sid)
+                self._dirty.discard(sid)
+        conn = self._connect()
+        try:
+            with conn:
+                conn.executemany('DELETE FROM TestSessions WHERE session_id = ?', [(sid,) for sid in expired])
+                # Сессии, брошенные до перезапуска и так и не загруженные в память
+                conn.execute('DELETE FROM TestSessions WHERE COALESCE(last_activity, 0) < ? '
+                             'AND start_time < ?',
+                             (deadline, datetime.fromtimestamp(deadline).isoformat()))
+        except sqlite3.Error as e:
+            logger.error(f"Test session expiry failed: {str(e)}")
+        finally:
+            conn.close()
+        return len(expired)
+
+    def cooldown(self, employee_id: int, test_type: str):
+        """Время окончания перезарядки теста или None"""
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                'SELECT MAX(cooldown_end) FROM CognitiveTests WHERE employee_id = ? AND test_type = ?',
+                (employee_id, test_type)
+            ).fetchone()
+        finally:
+            conn.close()
+        if row and row[0] and row[0] > datetime.now().isoformat():
+            return row[0]
+        return None
+
+    def _run(self):
+        last_expiry = time.time()
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+                if time.time() - last_expiry > min(self.ttl, 300):
+                    self.expire()
+                    last_expiry = time.time()
+            except Exception as e:
+                logger.error(f"Test session writer error: {str(e)}")
+
+    def start_background_flush(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='test-session-writer', daemon=True)
+            self._thread.start()
+
+    def close(self):
+        self._stop.set()
+        self.flush()
@@ -0,0 +1,338 @@
+import re
+import html
+import json
+import time
+import sqlite3
+import logging
+
+logger = logging.getLogger("TextSearch")
+
+# Источники поиска: (имя, таблица, ключ, текстовая колонка, дата, дополнительные поля)
+SEARCH_SOURCES = [
+    ('feedback', 'Feedback', 'feedback_id', 'comments', 'created_at',
+     ('entity_type', 'entity_id', 'rating')),
+    ('analysis', 'FatigueAnalysis', 'analysis_id', 'notes', 'analysis_date',
+     ('flight_id', 'fatigue_level', 'neural_network_score')),
+]
+
+# unicode61 разбивает кириллицу на слова и приводит к нижнему регистру; "ё" он не
+# сводит к "е", поэтому текст индексируется через представление с заменой ё -> е.
+# Префиксные индексы ускоряют короткие префиксные запросы
+FTS_OPTIONS = "tokenize='unicode61', prefix='2 3'"
+
+MAX_PER_PAGE = 100
+# Общее число совпадений считается не дальше этого предела
+MAX_COUNT = 10000
+
+# Маркеры snippet(): управляющие символы не встречаются в тексте и не
+# экранируются, их заменяют на разметку после экранирования HTML
+MARK_OPEN, MARK_CLOSE, ELLIPSIS = '\x02', '\x03', '\x04'
+SNIPPET_TOKENS = 16
+
+# Окончания для облегченного стемминга запроса, от длинных к коротким: слово
+# ищется по префиксу основы, так что "задержка" находит "задержки", "задержку"
+RU_ENDINGS = sorted((
+    'иями', 'ями', 'ами', 'остью', 'ости', 'ость', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими',
+    'ешь', 'ете', 'ишь', 'ите', 'ать', 'ять', 'ить', 'еть', 'ться', 'тся', 'лся', 'лась',
+    'ий', 'ый', 'ой', 'ая', 'яя', 'ое', 'ее', 'ые', 'ие', 'ия', 'ов', 'ев', 'ей',
+    'ам', 'ям', 'ах', 'ях', 'ом', 'ем', 'ую', 'юю', 'ть', 'ла', 'ли', 'ло',
+    'а', 'я', 'о', 'е', 'ы', 'и', 'у', 'ю', 'ь', 'й'), key=len, reverse=True)
+MIN_STEM = 3
+
+_CYRILLIC = re.compile('[а-я]')
+_TERMS = re.compile(r'"([^"]*)"|(\w+\*?)')
+
+
+def _index_name(source: str) -> str:
+    return f'{source}_search'
+
+
+def _normalized(expression: str) -> str:
+    return f"replace(replace({expression}, 'ё', 'е'), 'Ё', 'Е')"
+
+
+def normalize_text(text: str) -> str:
+    return text.replace('ё', 'е').replace('Ё', 'Е')
+
+
+def ensure_text_search_schema(conn: sqlite3.Connection):
+    """Создает индексы FTS5 по текстам отзывов и заметок и триггеры синхронизации.
+
+    Индекс хранит только токены (external content): текст для snippet() читается
+    из представления над исходной таблицей. Триггеры обновляют индекс в той же
+    транзакции, что и запись, поэтому он согласован и при записи из других
+    процессов. Новый индекс заполняется существующими строками.
+    """
+    tables = {row[0].lower() for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    for source, table, key, column, _, _ in SEARCH_SOURCES:
+        if table.lower() not in tables:
+            continue
+        index = _index_name(source)
+        conn.execute(f'CREATE VIEW IF NOT EXISTS {index}_content AS '
+                     f'SELECT {key}, {_normalized(column)} AS body FROM {table}')
+        created = index not in tables
+        conn.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS {index} USING fts5("
+                     f"body, content='{index}_content', content_rowid='{key}', {FTS_OPTIONS})")
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {index}_insert AFTER INSERT ON {table}
+            BEGIN
+                INSERT INTO {index} (rowid, body) VALUES (NEW.{key}, {_normalized(f'NEW.{column}')});
+            END
+        ''')
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {index}_delete AFTER DELETE ON {table}
+            BEGIN
+                INSERT INTO {index} ({index}, rowid, body)
+                VALUES ('delete', OLD.{key}, {_normalized(f'OLD.{column}')});
+            END
+        ''')
+        # Изменение оценки или других полей индекс не трогает
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {index}_update AFTER UPDATE OF {key}, {column} ON {table}
+            BEGIN
+                INSERT INTO {index} ({index}, rowid, body)
+                VALUES ('delete', OLD.{key}, {_normalized(f'OLD.{column}')});
+                INSERT INTO {index} (rowid, body) VALUES (NEW.{key}, {_normalized(f'NEW.{column}')});
+            END
+        ''')
+        if created:
+            conn.execute(f"INSERT INTO {index} ({index}) VALUES ('rebuild')")
+            logger.info(f"Search index {index} built")
+    conn.commit()
+
+
+def rebuild_text_search(conn: sqlite3.Connection):
+    """Перестраивает индексы по исходным таблицам и объединяет их сегменты"""
+    for source, *_ in SEARCH_SOURCES:
+        index = _index_name(source)
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (index,)).fetchone():
+            conn.execute(f"INSERT INTO {index} ({index}) VALUES ('rebuild')")
+            conn.execute(f"INSERT INTO {index} ({index}) VALUES ('optimize')")
+    conn.commit()
+
+
+def stem(word: str) -> str:
+    """Облегченный стемминг русского слова: отбрасывает окончание, если остается основа"""
+    if not _CYRILLIC.search(word):
+        return word
+    for ending in RU_ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM:
+            return word[:-len(ending)]
+    return word
+
+
+def build_match_query(text: str) -> str:
+    """Переводит строку поиска в запрос FTS5.
+
+    Слова в кавычках ищутся фразой, слово со звездочкой - по префиксу,
+    русские слова - по префиксу основы, остальные - точно. Все части
+    должны встретиться в тексте. Синтаксис FTS5 из ввода не передается,
+    поэтому ошибок разбора запроса не бывает. Пустая строка - нет слов.
+    """
+    parts = []
+    for phrase, word in _TERMS.findall(normalize_text(text).lower()):
+        if phrase:
+            tokens = re.findall(r'\w+', phrase)
+            if tokens:
+                parts.append('"' + ' '.join(tokens) + '"')
+        elif word.endswith('*'):
+            parts.append(f'"{word[:-1]}"*')
+        elif _CYRILLIC.search(word):
+            parts.append(f'"{stem(word)}"*')
+        else:
+            parts.append(f'"{word}"')
+    return ' '.join(parts)
+
+
+def highlight(snippet: str, original: str) -> str:
+    """HTML фрагмента с <mark> вокруг совпадений.
+
+    snippet() возвращает текст представления (ё заменена на е); замена
+    посимвольная, поэтому фрагмент находится в нормализованном тексте и
+    переносится на исходный.
+    """
+    plain = snippet.replace(MARK_OPEN, '').replace(MARK_CLOSE, '').replace(ELLIPSIS, '')
+    start = normalize_text(original or '').find(plain) if plain else -1
+    if start >= 0:
+        chars = []
+        position = start
+        for char in snippet:
+            if char in (MARK_OPEN, MARK_CLOSE, ELLIPSIS):
+                chars.append(char)
+            else:
+                chars.append(original[position])
+                position += 1
+        snippet = ''.join(chars)
+    return (html.escape(snippet)
+            .replace(MARK_OPEN, '<mark>').replace(MARK_CLOSE, '</mark>').replace(ELLIPSIS, '…'))
+
+
+def _source_query(source: str, table: str, key: str, column: str, date_column: str, fields: tuple) -> str:
+    index = _index_name(source)
+    details = ', '.join(f"'{field}', s.{field}" for field in fields)
+    # ORDER BY rank выполняет сам FTS5, поэтому snippet() считается только для
+    # возвращенных строк, а не для всех совпадений
+    return f'''
+        SELECT rank, s.{key}, s.employee_id, s.{date_column},
+               snippet({index}, 0, '{MARK_OPEN}', '{MARK_CLOSE}', '{ELLIPSIS}', {SNIPPET_TOKENS}),
+               s.{column}, json_object({details})
+        FROM {index} JOIN {table} s ON s.{key} = {index}.rowid
+        WHERE {index} MATCH ? AND {index}.rowid > ?
+        ORDER BY rank LIMIT ?
+    '''
+
+
+def search(conn: sqlite3.Connection, text: str, sources=None, page: int = 1, per_page: int = 20) -> dict:
+    """Ищет по отзывам и заметкам к анализам, результаты упорядочены по bm25.
+
+    sources ограничивает источники (feedback, analysis). Если совпадений в
+    источнике больше MAX_COUNT, ранжируются только MAX_COUNT самых новых
+    (total_capped=True): так время запроса не растет с размером таблицы
+    даже для слов, которые есть в каждой второй записи.
+    """
+    started = time.perf_counter()
+    query = build_match_query(text)
+    per_page = min(max(int(per_page), 1), MAX_PER_PAGE)
+    page = max(int(page), 1)
+    result = {'query': text, 'match': query, 'page': page, 'per_page': per_page,
+              'total': 0, 'total_capped': False, 'results': []}
+    if not query:
+        return result
+
+    existing = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    needed = page * per_page
+    rows = []
+    for spec in SEARCH_SOURCES:
+        source = spec[0]
+        index = _index_name(source)
+        if (sources and source not in sources) or index not in existing:
+            continue
+        # Обход по rowid в обратном порядке не требует сортировки: граница отсекает старые совпадения
+        boundary = conn.execute(f'SELECT rowid FROM {index} WHERE {index} MATCH ? '
+                                f'ORDER BY rowid DESC LIMIT 1 OFFSET ?', (query, MAX_COUNT)).fetchone()
+        if boundary is not None:
+            result['total'] += MAX_COUNT
+            result['total_capped'] = True
+        else:
+            boundary = (0,)
+            result['total'] += conn.execute(f'SELECT COUNT(*) FROM {index} WHERE {index} MATCH ?',
+                                            (query,)).fetchone()[0]
+        if needed <= MAX_COUNT:
+            rows.extend((source, row) for row in conn.execute(
+                _source_query(*spec), (query, boundary[0], needed)))
+
+    # Страница из лучших строк всех источников
+    rows.sort(key=lambda item: item[1][0])
+    for source, (rank, row_id, employee_id, date, snippet, original, fields) in \
+            rows[(page - 1) * per_page:needed]:
+        result['results'].append({
+            'source': source, 'id': row_id, 'employee_id': employee_id, 'date': date,
+            # bm25 отрицателен, чем меньше - тем релевантнее
+            'score': round(-rank, 4),
+            'snippet': highlight(snippet, original),
+            'details': json.loads(fields),
+        })
+    result['elapsed_ms'] = round((time.perf_counter() - started) * 1000, 2)
+    return result
+
+
+def _synthetic_vocabulary(rng, size: int = 20000) -> list:
+    # Частые слова отзывов и хвост редких псевдослов: частоты слов в тексте убывают примерно по Ципфу
+    common = ['рейс', 'задержка', 'пилот', 'экипаж', 'отдых', 'смена', 'часов', 'плохо', 'хорошо',
+              'мало', 'долго', 'вылет', 'посадка', 'нормально', 'самочувствие', 'внимание', 'кофе',
+              'ночной', 'перелет', 'устал', 'спал', 'сон', 'сонливость', 'усталость', 'задержки',
+              'головная', 'боль', 'турбулентность', 'реакция', 'медленная', 'глаза', 'всё', 'ещё']
+    letters = 'абвгдежзиклмнопрстуфхцчшыэюя'
+    tail = [''.join(rng.choice(letters) for _ in range(rng.randint(4, 10))) for _ in range(size)]
+    return common + tail
+
+
+def _synthetic_text(rng, vocabulary: list, weights: list) -> str:
+    return ' '.join(rng.choices(vocabulary, cum_weights=weights, k=rng.randint(5, 25)))
+
+
+def benchmark(rows: int = 1000000, queries: int = 50, path: str = None) -> dict:
+    """Заполняет временную базу синтетическими отзывами и сравнивает FTS5 с LIKE"""
+    import os
+    import random
+    import tempfile
+    import itertools
+    import statistics
+
+    rng = random.Random(1)
+    vocabulary = _synthetic_vocabulary(rng)
+    weights = list(itertools.accumulate(1.0 / (rank + 10) for rank in range(len(vocabulary))))
+    workdir = tempfile.mkdtemp(prefix='text-search-')
+    path = path or os.path.join(workdir, 'search.db')
+    conn = sqlite3.connect(path)
+    conn.execute('''CREATE TABLE Feedback (
+        feedback_id INTEGER PRIMARY KEY AUTOINCREMENT, employee_id INTEGER NOT NULL,
+        entity_type TEXT NOT NULL, entity_id INTEGER NOT NULL, rating INTEGER NOT NULL,
+        comments TEXT, created_at TEXT DEFAULT CURRENT_TIMESTAMP)''')
+    conn.execute('''CREATE TABLE FatigueAnalysis (
+        analysis_id INTEGER PRIMARY KEY AUTOINCREMENT, employee_id INTEGER, flight_id INTEGER,
+        fatigue_level TEXT, neural_network_score REAL, analysis_date TEXT, notes TEXT)''')
+    ensure_text_search_schema(conn)
+    # Редкое слово встречается примерно в одной записи из 10000
+    rare = 'гипоксия'
+
+    started = time.perf_counter()
+    batch = 10000
+    for offset in range(0, rows, batch):
+        conn.executemany(
+            'INSERT INTO Feedback (employee_id, entity_type, entity_id, rating, comments) VALUES (?, ?, ?, ?, ?)',
+            [(rng.randint(1, 500), 'flight', rng.randint(1, 20000), rng.randint(1, 5),
+              _synthetic_text(rng, vocabulary, weights) + (f' {rare}' if rng.random() < 0.0001 else ''))
+             for _ in range(min(batch, rows - offset))])
+        conn.commit()
+    insert_sec = time.perf_counter() - started
+
+    def timed(function, repeat: int) -> dict:
+        samples = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            value = function()
+            samples.append((time.perf_counter() - start) * 1000)
+        samples.sort()
+        return {'p50_ms': round(statistics.median(samples), 2),
+                'p95_ms': round(samples[int(len(samples) * 0.95) - 1 if len(samples) > 1 else 0], 2),
+                'value': value}
+
+    report = {'rows': rows, 'insert_rows_per_sec': round(rows / insert_sec),
+              'db_mb': round(os.path.getsize(path) / 1024 / 1024, 1), 'queries': {}}
+    for text in (rare, 'задержка', 'сон', '"головная боль"', 'турбулентность ночной', 'гипок*'):
+        measured = timed(lambda: search(conn, text)['total'], queries)
+        report['queries'][text] = {'total': measured.pop('value'), **measured}
+    # Та же выборка первой страницы через LIKE - полный просмотр таблицы
+    like = timed(lambda: len(conn.execute(
+        'SELECT feedback_id FROM Feedback WHERE comments LIKE ? LIMIT 20', (f'%{rare}%',)).fetchall()),
+        max(1, queries // 10))
+    report['like_rare_term'] = {'rows': like.pop('value'), **like}
+    conn.close()
+    os.remove(path)
+    os.rmdir(workdir)
+    return report
+
+
+if __name__ == '__main__':
+    import argparse
+    from neural_network.logging_setup import setup_logging
+
+    parser = argparse.ArgumentParser(description='Full-text search index over feedback and analysis notes')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    rebuild_parser = subparsers.add_parser('rebuild', help='Create missing indexes, rebuild and optimize them')
+    rebuild_parser.add_argument('--db', default='database/database.db')
+    benchmark_parser = subparsers.add_parser('benchmark', help='Measure query latency on synthetic rows')
+    benchmark_parser.add_argument('--rows', type=int, default=1000000)
+    benchmark_parser.add_argument('--queries', type=int, default=50)
+    args = parser.parse_args()
+
+    setup_logging(log_file=False)
+    if args.command == 'rebuild':
+        connection = sqlite3.connect(args.db)
+        ensure_text_search_schema(connection)
+        rebuild_text_search(connection)
+        connection.close()
+        print(f"Search indexes rebuilt in {args.db}")
+    else:
+        print(json.dumps(benchmark(args.rows, args.queries), indent=2, ensure_ascii=False))
@@ -0,0 +1,99 @@
+
+import sqlite3
+import numpy as np
+
+# Компактная запись одного кадра: секунда видео, оценка (NaN - нет оценки), лицо найдено.
+# 7 байт на отсчет: четырехчасовой полет при анализе каждого 5-го кадра 30 FPS занимает ~600 КБ.
+TIMELINE_DTYPE = np.dtype([('t', '<f4'), ('score', '<f2'), ('face', 'u1')])
+
+TIMELINE_TABLE = 'fatigue_timelines'
+
+
+def ensure_timeline_table(conn: sqlite3.Connection):
+    conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS {TIMELINE_TABLE} (
+            analysis_id INTEGER PRIMARY KEY,
+            sample_count INTEGER NOT NULL,
+            duration REAL NOT NULL,
+            data BLOB NOT NULL
+        )
+    ''')
+    conn.commit()
+
+
+def encode_timeline(samples) -> np.ndarray:
+    """Преобразует список (секунда, оценка, лицо) в упакованный массив"""
+    timeline = np.empty(len(samples), dtype=TIMELINE_DTYPE)
+    if len(samples):
+        t, score, face = zip(*samples)
+        timeline['t'] = t
+        timeline['score'] = score
+        timeline['face'] = face
+    return timeline
+
+
+def save_timeline(conn: sqlite3.Connection, analysis_id: int, samples):
+    """Сохраняет ряд оценок анализа; коммит выполняет вызывающий код"""
+    timeline = encode_timeline(samples)
+    duration = float(timeline['t'][-1]) if len(timeline) else 0.0
+    conn.execute(
+        f'INSERT OR REPLACE INTO {TIMELINE_TABLE} (analysis_id, sample_count, duration, data) '
+        f'VALUES (?, ?, ?, ?)',
+        (analysis_id, len(timeline), duration, sqlite3.Binary(timeline.tobytes()))
+    )
+    return len(timeline)
+
+
+def load_timeline(conn: sqlite3.Connection, analysis_id: int):
+    row = conn.execute(f'SELECT data FROM {TIMELINE_TABLE} WHERE analysis_id = ?',
+                       (analysis_id,)).fetchone()
+    if row is None:
+        return None
+    return np.frombuffer(row[0], dtype=TIMELINE_DTYPE)
+
+
+def downsample(timeline: np.ndarray, points: int) -> dict:
+    """Сворачивает ряд в не более чем points интервалов равной длительности.
+
+    Для каждого непустого интервала возвращаются min/max/mean оценки и доля
+    кадров с найденным лицом. Все вычисления векторные, без циклов по отсчетам.
+    """
+    points = max(1, int(points))
+    if not len(timeline):
+        return {'duration': 0.0, 'bucket_sec': 0.0, 'points': []}
+
+    t = timeline['t'].astype(np.float64)
+    duration = float(t[-1])
+    bucket_sec = duration / points if duration > 0 else 1.0
+    buckets = np.minimum((t / bucket_sec).astype(np.int64), points - 1)
+
+    counts = np.bincount(buckets, minlength=points)
+    faces = np.bincount(buckets, weights=timeline['face'], minlength=points)
+
+    score = timeline['score'].astype(np.float32)
+    valid = ~np.isnan(score)
+    valid_buckets = buckets[valid]
+    valid_scores = score[valid]
+    score_counts = np.bincount(valid_buckets, minlength=points)
+    sums = np.bincount(valid_buckets, weights=valid_scores, minlength=points)
+
+    mins = np.full(points, np.nan)
+    maxs = np.full(points, np.nan)
+    if len(valid_scores):
+        # Отсчеты упорядочены по времени, поэтому каждый интервал - непрерывный отрезок
+        starts = np.flatnonzero(np.r_[True, valid_buckets[1:] != valid_buckets[:-1]])
+        present = valid_buckets[starts]
+        mins[present] = np.minimum.reduceat(valid_scores, starts)
+        maxs[present] = np.maximum.reduceat(valid_scores, starts)
+
+    result = []
+    for index in np.flatnonzero(counts):
+        has_score = score_counts[index] > 0
+        result.append({
+            't': round(index * bucket_sec, 2),
+            'min': round(float(mins[index]), 3) if has_score else None,
+            'max': round(float(maxs[index]), 3) if has_score else None,
+            'mean': round(float(sums[index] / score_counts[index]), 3) if has_score else None,
+            'face_ratio': round(float(faces[index] / counts[index]), 3),
+        })
+    return {'duration': round(duration, 2), 'bucket_sec': round(bucket_sec, 3), 'points': result}
@@ -0,0 +1,329 @@
+
+import os
+import json
+import time
+import sqlite3
+import logging
+import argparse
+import multiprocessing
+
+import numpy as np
+
+from video_storage import VideoStorage
+
+logger = logging.getLogger("TrainingExport")
+
+ANALYSIS_TABLE = 'fatigue_analysis'
+INDEX_FILE = 'index.json'
+
+# Размер входа модели, должен совпадать с neural_network.predict.FACE_SIZE
+FACE_SIZE = 48
+
+# Описание одного примера в meta-файле шарда
+META_DTYPE = np.dtype([
+    ('analysis_id', np.int64), ('feedback_seq', np.int64), ('frame', np.int32),
+    ('label', np.float32), ('feedback_score', np.float32), ('neural_network_score', np.float32),
+])
+
+# Рабочий процесс: детектор создается один раз на процесс
+_worker_detector = None
+
+
+def ensure_feedback_sequence(conn: sqlite3.Connection):
+    """Нумерует отзывы по порядку поступления для инкрементального экспорта.
+
+    Каждое выставление или изменение feedback_score получает следующий номер
+    feedback_seq, поэтому экспорт выбирает по индексу только новые отзывы,
+    в том числе к старым анализам.
+    """
+    try:
+        columns = [row[1] for row in conn.execute(f'PRAGMA table_info({ANALYSIS_TABLE})')]
+    except sqlite3.OperationalError:
+        return
+    if not columns:
+        return
+    if 'feedback_seq' not in columns:
+        conn.execute(f'ALTER TABLE {ANALYSIS_TABLE} ADD COLUMN feedback_seq INTEGER')
+    conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{ANALYSIS_TABLE}_feedback_seq '
+                 f'ON {ANALYSIS_TABLE} (feedback_seq)')
+    # Отзывы, записанные до появления триггеров, нумеруются в порядке анализов
+    unnumbered = [row[0] for row in conn.execute(
+        f'SELECT analysis_id FROM {ANALYSIS_TABLE} '
+        f'WHERE feedback_score IS NOT NULL AND feedback_seq IS NULL ORDER BY analysis_id')]
+    if unnumbered:
+        base = conn.execute(f'SELECT COALESCE(MAX(feedback_seq), 0) FROM {ANALYSIS_TABLE}').fetchone()[0]
+        conn.executemany(f'UPDATE {ANALYSIS_TABLE} SET feedback_seq = ? WHERE analysis_id = ?',
+                         [(base + i + 1, analysis_id) for i, analysis_id in enumerate(unnumbered)])
+    for event in ('INSERT', 'UPDATE OF feedback_score'):
+        name = f"trg_{ANALYSIS_TABLE}_feedback_seq_{event.split()[0].lower()}"
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {name} AFTER {event} ON {ANALYSIS_TABLE}
+            WHEN NEW.feedback_score IS NOT NULL
+            BEGIN
+                UPDATE {ANALYSIS_TABLE}
+                SET feedback_seq = (SELECT COALESCE(MAX(feedback_seq), 0) + 1 FROM {ANALYSIS_TABLE})
+                WHERE analysis_id = NEW.analysis_id;
+            END
+        ''')
+    conn.commit()
+
+
+def feedback_label(feedback_score: float, nn_score: float, threshold: float = 0.5):
+    """Метка усталости (1 - устал) по оценке системы пользователем от 1 до 5.
+
+    4-5 звезд подтверждают вывод модели, 1-2 - опровергают его, 3 - неинформативна
+    (возвращается None, пример пропускается).
+    """
+    if feedback_score is None or nn_score is None:
+        return None
+    predicted = 1.0 if nn_score >= threshold else 0.0
+    if feedback_score >= 4:
+        return predicted
+    if feedback_score <= 2:
+        return 1.0 - predicted
+    return None
+
+
+def iter_labelled(conn: sqlite3.Connection, after_seq: int = 0, chunk: int = 256):
+    """Построчно выдает анализы с отзывом, появившимся после after_seq"""
+    cursor = conn.execute(f'''
+        SELECT analysis_id, feedback_seq, video_path, feedback_score, neural_network_score
+        FROM {ANALYSIS_TABLE}
+        WHERE feedback_seq > ? AND feedback_score IS NOT NULL
+          AND video_path IS NOT NULL AND video_path != ''
+        ORDER BY feedback_seq
+    ''', (after_seq,))
+    while True:
+        rows = cursor.fetchmany(chunk)
+        if not rows:
+            break
+        for row in rows:
+            yield dict(zip(('analysis_id', 'feedback_seq', 'video_path',
+                            'feedback_score', 'neural_network_score'), row))
+
+
+def _init_worker(threads: int):
+    global _worker_detector
+    import cv2
+    from neural_network.face_detection import FaceDetector
+
+    cv2.setNumThreads(threads)
+    _worker_detector = FaceDetector(min_detection_confidence=0.7)
+
+
+def extract_faces(job: dict) -> dict:
+    """Извлекает до max_faces кропов лица, равномерно распределенных по видео.
+
+    Кроп берется как при анализе: прямоугольник самого крупного лица без полей,
+    масштабированный до FACE_SIZE, каналы в порядке BGR.
+    """
+    import cv2
+
+    result = {'job': job, 'faces': None, 'frames': None, 'error': None}
+    if job.get('skip'):
+        return result
+    cap = cv2.VideoCapture(job['path'])
+    try:
+        if not cap.isOpened():
+            result['error'] = 'Failed to open video'
+            return result
+        total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        step = max(1, total // job['max_faces']) if total > 0 else 5
+        faces, frames = [], []
+        frame_index = 0
+        while len(faces) < job['max_faces'] and cap.grab():
+            frame_index += 1
+            if frame_index % step:
+                continue
+            ret, frame = cap.retrieve()
+            if not ret:
+                break
+            detected = [face for face in _worker_detector.detect(frame) if face[2] > 10 and face[3] > 10]
+            if not detected:
+                continue
+            x, y, width, height, _ = max(detected, key=lambda face: face[2] * face[3])
+            faces.append(cv2.resize(frame[y:y+height, x:x+width], (FACE_SIZE, FACE_SIZE)))
+            frames.append(frame_index)
+        if faces:
+            result['faces'] = np.stack(faces)
+            result['frames'] = np.asarray(frames, dtype=np.int32)
+    except Exception as e:
+        result['error'] = str(e)
+    finally:
+        cap.release()
+    return result
+
+
+class ShardWriter:
+    """Копит примеры и сбрасывает их шардами faces-NNNNN.npy / meta-NNNNN.npy.
+
+    Шарды пишутся через временный файл и переименование, индекс обновляется
+    после каждого шарда, поэтому прерванный экспорт продолжается с последнего
+    записанного отзыва.
+    """
+
+    def __init__(self, out_dir: str, shard_size: int = 4096):
+        self.out_dir = out_dir
+        self.shard_size = shard_size
+        os.makedirs(out_dir, exist_ok=True)
+        self.index = load_index(out_dir)
+        self._faces = []
+        self._meta = []
+        self._pending = 0
+        self._max_seq = self.index['last_feedback_seq']
+
+    def add(self, faces: np.ndarray, meta: np.ndarray, feedback_seq: int):
+        self._faces.append(faces)
+        self._meta.append(meta)
+        self._pending += len(faces)
+        self._max_seq = max(self._max_seq, feedback_seq)
+        if self._pending >= self.shard_size:
+            self.flush()
+
+    def mark_seen(self, feedback_seq: int):
+        # Отзывы без примеров (нет лица, нейтральная оценка) тоже не нужно выбирать снова
+        self._max_seq = max(self._max_seq, feedback_seq)
+
+    def flush(self):
+        if self._pending:
+            number = len(self.index['shards'])
+            names = {'faces': f'faces-{number:05d}.npy', 'meta': f'meta-{number:05d}.npy'}
+            for key, parts in (('faces', self._faces), ('meta', self._meta)):
+                tmp_path = os.path.join(self.out_dir, names[key] + '.tmp')
+                with open(tmp_path, 'wb') as tmp:
+                    np.save(tmp, np.concatenate(parts))
+                os.replace(tmp_path, os.path.join(self.out_dir, names[key]))
+            self.index['shards'].append(dict(names, count=self._pending, created_at=time.time()))
+            self.index['samples'] += self._pending
+            logger.info(f"Wrote shard {names['faces']} with {self._pending} faces")
+            self._faces, self._meta, self._pending = [], [], 0
+        self.index['last_feedback_seq'] = self._max_seq
+        save_index(self.out_dir, self.index)
+
+
+def load_index(out_dir: str) -> dict:
+    path = os.path.join(out_dir, INDEX_FILE)
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as index_file:
+            return json.load(index_file)
+    return {
+        'version': 1, 'face_size': FACE_SIZE, 'channels': 'BGR', 'dtype': 'uint8',
+        'label': '1 - fatigued, 0 - alert; feedback 4-5 confirms the model, 1-2 inverts it',
+        'last_feedback_seq': 0, 'samples': 0, 'shards': []
+    }
+
+
+def save_index(out_dir: str, index: dict):
+    tmp_path = os.path.join(out_dir, INDEX_FILE + '.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as index_file:
+        json.dump(index, index_file, indent=2)
+    os.replace(tmp_path, os.path.join(out_dir, INDEX_FILE))
+
+
+def load_dataset(out_dir: str, mmap: bool = True) -> list:
+    """Возвращает [(faces, meta)] по шардам; faces отображаются в память без чтения.
+
+    Если отзыв к анализу меняли, анализ попадает в несколько экспортов; в meta
+    остаются все примеры, а актуальные выбираются маской latest_mask().
+    """
+    index = load_index(out_dir)
+    return [(np.load(os.path.join(out_dir, shard['faces']), mmap_mode='r' if mmap else None),
+             np.load(os.path.join(out_dir, shard['meta'])))
+            for shard in index['shards']]
+
+
+def latest_mask(shards: list) -> list:
+    """Маски примеров из последнего отзыва каждого анализа"""
+    latest = {}
+    for _, meta in shards:
+        for analysis_id, seq in zip(meta['analysis_id'], meta['feedback_seq']):
+            if seq > latest.get(analysis_id, -1):
+                latest[analysis_id] = seq
+    return [np.fromiter((latest[a] == s for a, s in zip(meta['analysis_id'], meta['feedback_seq'])),
+                        dtype=bool, count=len(meta))
+            for _, meta in shards]
+
+
+def run_export(db_path: str, video_root: str, out_dir: str, workers: int = 0,
+               max_faces: int = 64, shard_size: int = 4096, limit: int = 0) -> dict:
+    """Экспортирует кропы лиц из видео анализов с новыми отзывами"""
+    storage = VideoStorage(video_root, db_path)
+    writer = ShardWriter(out_dir, shard_size=shard_size)
+    after_seq = writer.index['last_feedback_seq']
+
+    # Отзывы читает поток пула, который раздает задачи
+    conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+    ensure_feedback_sequence(conn)
+    summary = {'after_seq': after_seq, 'analyses': 0, 'skipped': 0, 'missing': 0, 'no_faces': 0,
+               'errors': 0, 'faces': 0, 'shards': 0, 'wall_sec': 0.0}
+    started = time.time()
+    shards_before = len(writer.index['shards'])
+
+    def jobs():
+        # Генератор читает пул в отдельном потоке, поэтому пропуски тоже идут через
+        # воркеры: так они учитываются в порядке отзывов вместе с остальными
+        for number, row in enumerate(iter_labelled(conn, after_seq)):
+            if limit and number >= limit:
+                return
+            label = feedback_label(row['feedback_score'], row['neural_network_score'])
+            path = storage.resolve(row['video_path']) if label is not None else None
+            skip = 'skipped' if label is None else 'missing' if not path else None
+            yield dict(row, path=path, label=label, max_faces=max_faces, skip=skip)
+
+    workers = workers or os.cpu_count() or 1
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    # spawn: MediaPipe плохо переносит fork; порядок результатов сохраняется,
+    # чтобы индекс всегда указывал на непрерывно обработанный префикс отзывов
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(workers, initializer=_init_worker, initargs=(threads,)) as pool:
+        for result in pool.imap(extract_faces, jobs(), chunksize=1):
+            job = result['job']
+            summary['analyses'] += 1
+            if job['skip']:
+                summary[job['skip']] += 1
+                writer.mark_seen(job['feedback_seq'])
+                continue
+            if result['error']:
+                summary['errors'] += 1
+                logger.error(f"Face extraction failed for {job['video_path']}: {result['error']}")
+                writer.mark_seen(job['feedback_seq'])
+                continue
+            if result['faces'] is None:
+                summary['no_faces'] += 1
+                writer.mark_seen(job['feedback_seq'])
+                continue
+            meta = np.zeros(len(result['faces']), dtype=META_DTYPE)
+            meta['analysis_id'] = job['analysis_id']
+            meta['feedback_seq'] = job['feedback_seq']
+            meta['frame'] = result['frames']
+            meta['label'] = job['label']
+            meta['feedback_score'] = job['feedback_score']
+            meta['neural_network_score'] = job['neural_network_score']
+            writer.add(result['faces'], meta, job['feedback_seq'])
+            summary['faces'] += len(meta)
+
+    writer.flush()
+    conn.close()
+    summary['shards'] = len(writer.index['shards']) - shards_before
+    summary['last_seq'] = writer.index['last_feedback_seq']
+    summary['wall_sec'] = round(time.time() - started, 2)
+    return summary
+
+
+if __name__ == '__main__':
+    from neural_network.logging_setup import setup_logging
+
+    parser = argparse.ArgumentParser(description='Export feedback-labelled face crops for retraining')
+    parser.add_argument('--db', default='database/database.db')
+    parser.add_argument('--videos', default='neural_network/data/video')
+    parser.add_argument('--output', default='neural_network/data/export')
+    parser.add_argument('--workers', type=int, default=0, help='Extraction processes (0 - CPU count)')
+    parser.add_argument('--max-faces', type=int, default=64, help='Face crops per video')
+    parser.add_argument('--shard-size', type=int, default=4096, help='Faces per shard')
+    parser.add_argument('--limit', type=int, default=0, help='Export at most this many analyses')
+    args = parser.parse_args()
+
+    setup_logging()
+    result = run_export(args.db, args.videos, args.output, workers=args.workers,
+                        max_faces=args.max_faces, shard_size=args.shard_size, limit=args.limit)
+    print(json.dumps(result, indent=2))
@@ -0,0 +1,254 @@
+
+import os
+import time
+import uuid
+import shutil
+import sqlite3
+import hashlib
+import logging
+import subprocess
+import threading
+
+logger = logging.getLogger("VideoStorage")
+
+# Таблицы и колонки, в которых хранятся ссылки на видеофайлы.
+# Такие файлы никогда не удаляются при вытеснении по квоте.
+REFERENCE_COLUMNS = [
+    ('recordings', 'video_path'),
+    ('fatigue_analysis', 'video_path'),
+    ('FatigueAnalysis', 'video_path'),
+    ('Flights', 'video_path'),
+    ('analysis_jobs', 'video_path'),
+]
+
+# Расширения промежуточных файлов (исходники до конвертации)
+INTERMEDIATE_EXTENSIONS = ('.webm',)
+
+
+class VideoConversionError(Exception):
+    pass
+
+
+class VideoStorage:
+    """Хранилище видео с шардированием, квотой на диск и фоновой очисткой.
+
+    Файлы раскладываются по подкаталогам ``<root>/ab/cd/<имя>``, где ``abcd`` -
+    первые символы md5 от имени файла. В БД по-прежнему хранится только имя
+    файла, путь к нему вычисляется через ``resolve``.
+    """
+
+    def __init__(self, root: str, db_path: str, quota_bytes: int = 0,
+                 min_age: float = 3600, gc_interval: float = 600):
+        self.root = root
+        self.db_path = db_path
+        self.quota_bytes = quota_bytes
+        self.min_age = min_age
+        self.gc_interval = gc_interval
+        self._gc_lock = threading.Lock()
+        self._gc_event = threading.Event()
+        self._gc_thread = None
+        self._ffmpeg_checked = False
+        os.makedirs(root, exist_ok=True)
+
+    # --- Пути ---
+
+    def shard_dir(self, filename: str) -> str:
+        digest = hashlib.md5(os.path.basename(filename).encode('utf-8')).hexdigest()
+        return os.path.join(self.root, digest[:2], digest[2:4])
+
+    def path_for(self, filename: str, create: bool = False) -> str:
+        directory = self.shard_dir(filename)
+        if create:
+            os.makedirs(directory, exist_ok=True)
+        return os.path.join(directory, os.path.basename(filename))
+
+    def resolve(self, filename: str):
+        """Возвращает путь к существующему файлу или None.
+
+        Поддерживаются и старые файлы, лежащие прямо в корне хранилища.
+        """
+        if not filename or os.path.basename(filename) != filename:
+            return None
+        sharded = self.path_for(filename)
+        if os.path.exists(sharded):
+            return sharded
+        legacy = os.path.join(self.root, filename)
+        if os.path.isfile(legacy):
+            return legacy
+        return None
+
+    def new_upload_path(self, extension: str = '.webm'):
+        filename = f"{uuid.uuid4()}{extension}"
+        return filename, self.path_for(filename, create=True)
+
+    def discard(self, *paths):
+        for path in paths:
+            if not path:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning(f"Failed to remove {path}: {str(e)}")
+
+    # --- Конвертация ---
+
+    def _check_ffmpeg(self):
+        if self._ffmpeg_checked:
+            return
+        try:
+            subprocess.run(["ffmpeg", "-version"], capture_output=True, check=True)
+        except (subprocess.SubprocessError, FileNotFoundError):
+            raise VideoConversionError('ffmpeg not found. Required for video conversion')
+        self._ffmpeg_checked = True
+
+    def convert_upload(self, source_path: str):
+        """Конвертирует загруженный webm в mp4 для OpenCV.
+
+        Исходный файл удаляется в любом случае, при ошибке удаляется и
+        недописанный результат. Возвращает (имя, путь) сконвертированного файла.
+        """
+        converted_filename = f"converted_{os.path.splitext(os.path.basename(source_path))[0]}.mp4"
+        converted_path = self.path_for(converted_filename, create=True)
+        try:
+            self._check_ffmpeg()
+            process = subprocess.run(
+                ["ffmpeg", "-y", "-i", source_path, "-c:v", "libx264",
+                 "-preset", "ultrafast", converted_path],
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE
+            )
+            if process.returncode != 0:
+                error_msg = process.stderr.decode('utf-8', errors='replace')
+                raise VideoConversionError(f'Video conversion failed: {error_msg[:200]}...')
+            if not os.path.exists(converted_path) or os.path.getsize(converted_path) == 0:
+                raise VideoConversionError('Converted video file is missing or empty')
+        except Exception:
+            self.discard(converted_path)
+            raise
+        finally:
+            self.discard(source_path)
+
+        return converted_filename, converted_path
+
+    # --- Сборка мусора ---
+
+    def referenced_videos(self) -> set:
+        names = set()
+        conn = sqlite3.connect(self.db_path)
+        try:
+            for table, column in REFERENCE_COLUMNS:
+                try:
+                    rows = conn.execute(
+                        f'SELECT DISTINCT {column} FROM {table} WHERE {column} IS NOT NULL'
+                    ).fetchall()
+                except sqlite3.OperationalError:
+                    # Таблицы может не быть в старых схемах БД
+                    continue
+                names.update(os.path.basename(row[0]) for row in rows if row[0])
+        finally:
+            conn.close()
+        return names
+
+    def _scan(self):
+        """Возвращает список (путь, размер, время последнего доступа) всех файлов."""
+        files = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                files.append((path, stat.st_size, max(stat.st_mtime, stat.st_atime)))
+        return files
+
+    def _migrate_legacy(self, files):
+        """Переносит файлы из корня хранилища в шарды."""
+        migrated = []
+        for path, size, last_used in files:
+            if os.path.dirname(path) == os.path.normpath(self.root):
+                target = self.path_for(os.path.basename(path), create=True)
+                try:
+                    shutil.move(path, target)
+                except OSError as e:
+                    logger.warning(f"Failed to move {path} to shard: {str(e)}")
+                    target = path
+                migrated.append((target, size, last_used))
+            else:
+                migrated.append((path, size, last_used))
+        return migrated
+
+    def collect_garbage(self) -> dict:
+        with self._gc_lock:
+            now = time.time()
+            files = self._migrate_legacy(self._scan())
+            referenced = self.referenced_videos()
+            stats = {'files': len(files), 'removed_intermediate': 0, 'evicted': 0, 'freed_bytes': 0}
+
+            remaining = []
+            for path, size, last_used in files:
+                # Свежие файлы могут еще загружаться или анализироваться
+                if now - last_used < self.min_age:
+                    remaining.append((path, size, last_used))
+                    continue
+                # Исходники после конвертации не нужны, пустые файлы - следы сбоев
+                if path.endswith(INTERMEDIATE_EXTENSIONS) or size == 0:
+                    self.discard(path)
+                    stats['removed_intermediate'] += 1
+                    stats['freed_bytes'] += size
+                else:
+                    remaining.append((path, size, last_used))
+
+            total = sum(size for _, size, _ in remaining)
+            if self.quota_bytes and total > self.quota_bytes:
+                candidates = sorted(
+                    (item for item in remaining
+                     if os.path.basename(item[0]) not in referenced
+                     and now - item[2] >= self.min_age),
+                    key=lambda item: item[2]
+                )
+                for path, size, _ in candidates:
+                    if total <= self.quota_bytes:
+                        break
+                    self.discard(path)
+                    total -= size
+                    stats['evicted'] += 1
+                    stats['freed_bytes'] += size
+                if total > self.quota_bytes:
+                    logger.warning(f"Video storage over quota: {total} > {self.quota_bytes} bytes, "
+                                   f"remaining files are referenced or too recent")
+
+            self._remove_empty_shards()
+            stats['total_bytes'] = total
+            logger.info(f"Video storage GC finished: {stats}")
+            return stats
+
+    def _remove_empty_shards(self):
+        for dirpath, _, _ in os.walk(self.root, topdown=False):
+            if os.path.normpath(dirpath) == os.path.normpath(self.root):
+                continue
+            if not os.listdir(dirpath):
+                try:
+                    os.rmdir(dirpath)
+                except OSError:
+                    pass
+
+    def request_gc(self):
+        """Просит фоновый поток выполнить очистку, не блокируя вызывающего."""
+        self._gc_event.set()
+
+    def start_background_gc(self):
+        if self._gc_thread and self._gc_thread.is_alive():
+            return
+        self._gc_thread = threading.Thread(target=self._gc_loop, name="video-gc", daemon=True)
+        self._gc_thread.start()
+
+    def _gc_loop(self):
+        while True:
+            self._gc_event.wait(self.gc_interval)
+            self._gc_event.clear()
+            try:
+                self.collect_garbage()
+            except Exception as e:
+                logger.error(f"Video storage GC error: {str(e)}")
@@ -0,0 +1,286 @@
+
+import os
+import json
+import time
+import uuid
+import sqlite3
+import logging
+from dataclasses import dataclass
+
+logger = logging.getLogger("WorkQueue")
+
+JOBS_TABLE = 'analysis_jobs'
+
+# Состояния задачи: queued -> running -> done | failed; истекшая аренда возвращает в queued
+STATUSES = ('queued', 'running', 'done', 'failed')
+
+
+class LeaseLost(Exception):
+    """Аренда задачи истекла и задача передана другому воркеру"""
+
+
+@dataclass
+class Job:
+    job_id: int
+    kind: str
+    payload: dict
+    attempts: int
+    lease_token: str
+    worker_id: str = None
+
+
+class WorkQueue:
+    """Очередь задач с арендой.
+
+    Воркер забирает задачу (claim) на lease_sec секунд и продлевает аренду
+    (heartbeat), пока работает. Если воркер пропал, аренда истекает и задача
+    снова выдается - до max_attempts попыток. Завершение принимается только
+    от держателя текущей аренды, поэтому результат задачи, переданной другому
+    воркеру, не записывается дважды.
+
+    Бэкенды регистрируются через register_backend и выбираются по схеме URL
+    в open_work_queue, так что SQLite можно заменить сетевым хранилищем.
+    """
+
+    def enqueue(self, kind: str, payload: dict, max_attempts: int = 3, video_path: str = None) -> int:
+        raise NotImplementedError
+
+    def claim(self, worker_id: str, lease_sec: float, kinds=None):
+        """Возвращает Job или None, если готовых задач нет"""
+        raise NotImplementedError
+
+    def heartbeat(self, job: Job, lease_sec: float) -> bool:
+        """Продлевает аренду; False - аренда уже потеряна"""
+        raise NotImplementedError
+
+    def complete(self, job: Job, result: dict, record=None) -> dict:
+        """Отмечает задачу выполненной и возвращает сохраненный результат.
+
+        record(conn) - запись результата в хранилище приложения; вызывается не
+        более одного раза на задачу, и его возвращаемое значение добавляется
+        к результату. Если аренда потеряна, выбрасывается LeaseLost.
+        """
+        raise NotImplementedError
+
+    def fail(self, job: Job, error: str, retry: bool = True, backoff: float = 5.0):
+        raise NotImplementedError
+
+    def get(self, job_id: int):
+        raise NotImplementedError
+
+    def stats(self) -> dict:
+        raise NotImplementedError
+
+
+def ensure_work_queue_schema(conn: sqlite3.Connection):
+    conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS {JOBS_TABLE} (
+            job_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            video_path TEXT,
+            status TEXT NOT NULL DEFAULT 'queued',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            max_attempts INTEGER NOT NULL DEFAULT 3,
+            available_at REAL NOT NULL,
+            worker_id TEXT,
+            lease_token TEXT,
+            lease_expires REAL,
+            result TEXT,
+            error TEXT,
+            created_at REAL NOT NULL,
+            finished_at REAL
+        )
+    ''')
+    # Выборка следующей задачи и поиск истекших аренд идут по индексу
+    conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{JOBS_TABLE}_ready '
+                 f'ON {JOBS_TABLE} (status, available_at, job_id)')
+    conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{JOBS_TABLE}_lease '
+                 f'ON {JOBS_TABLE} (status, lease_expires)')
+    conn.commit()
+
+
+class SQLiteWorkQueue(WorkQueue):
+    """Очередь в таблице analysis_jobs базы приложения.
+
+    Выдача задачи выполняется в транзакции BEGIN IMMEDIATE, так что
+    одновременные claim из разных процессов не получают одну задачу.
+    record в complete выполняется на том же соединении, поэтому атомарная
+    запись результата возможна, когда очередь лежит в базе приложения.
+    Подходит для воркеров на одном хосте или на хостах с общим диском,
+    где блокировки файлов SQLite работают надежно; время аренды берется
+    по часам воркеров, поэтому часы хостов должны быть синхронизированы.
+    """
+
+    def __init__(self, db_path: str, timeout: float = 30.0):
+        self.db_path = db_path
+        self.timeout = timeout
+        conn = self._connect()
+        try:
+            ensure_work_queue_schema(conn)
+        finally:
+            conn.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=self.timeout, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _transaction(self, conn: sqlite3.Connection):
+        conn.execute('BEGIN IMMEDIATE')
+
+    def enqueue(self, kind: str, payload: dict, max_attempts: int = 3, video_path: str = None) -> int:
+        now = time.time()
+        conn = self._connect()
+        try:
+            cursor = conn.execute(
+                f'''INSERT INTO {JOBS_TABLE}
+                   (kind, payload, video_path, max_attempts, available_at, created_at)
+                   VALUES (?, ?, ?, ?, ?, ?)''',
+                (kind, json.dumps(payload, ensure_ascii=False), video_path, max_attempts, now, now))
+            return cursor.lastrowid
+        finally:
+            conn.close()
+
+    def _expire_leases(self, conn: sqlite3.Connection, now: float):
+        # Задачи пропавших воркеров возвращаются в очередь, исчерпавшие попытки - в failed
+        conn.execute(f'''
+            UPDATE {JOBS_TABLE}
+            SET status = CASE WHEN attempts >= max_attempts THEN 'failed' ELSE 'queued' END,
+                error = 'Lease expired (worker ' || COALESCE(worker_id, '?') || ')',
+                finished_at = CASE WHEN attempts >= max_attempts THEN ? ELSE NULL END,
+                lease_token = NULL, worker_id = NULL
+            WHERE status = 'running' AND lease_expires < ?
+        ''', (now, now))
+
+    def claim(self, worker_id: str, lease_sec: float, kinds=None):
+        now = time.time()
+        conn = self._connect()
+        try:
+            self._transaction(conn)
+            self._expire_leases(conn, now)
+            query = f"SELECT * FROM {JOBS_TABLE} WHERE status = 'queued' AND available_at <= ?"
+            params = [now]
+            if kinds:
+                query += f" AND kind IN ({','.join('?' * len(kinds))})"
+                params.extend(kinds)
+            row = conn.execute(query + ' ORDER BY available_at, job_id LIMIT 1', params).fetchone()
+            if row is None:
+                conn.execute('COMMIT')
+                return None
+            token = uuid.uuid4().hex
+            conn.execute(f'''
+                UPDATE {JOBS_TABLE}
+                SET status = 'running', attempts = attempts + 1, worker_id = ?,
+                    lease_token = ?, lease_expires = ?
+                WHERE job_id = ?
+            ''', (worker_id, token, now + lease_sec, row['job_id']))
+            conn.execute('COMMIT')
+            return Job(job_id=row['job_id'], kind=row['kind'], payload=json.loads(row['payload']),
+                       attempts=row['attempts'] + 1, lease_token=token, worker_id=worker_id)
+        except Exception:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+
+    def heartbeat(self, job: Job, lease_sec: float) -> bool:
+        conn = self._connect()
+        try:
+            cursor = conn.execute(
+                f"UPDATE {JOBS_TABLE} SET lease_expires = ? "
+                f"WHERE job_id = ? AND lease_token = ? AND status = 'running'",
+                (time.time() + lease_sec, job.job_id, job.lease_token))
+            return cursor.rowcount == 1
+        finally:
+            conn.close()
+
+    def complete(self, job: Job, result: dict, record=None) -> dict:
+        conn = self._connect()
+        try:
+            self._transaction(conn)
+            held = conn.execute(
+                f"SELECT 1 FROM {JOBS_TABLE} WHERE job_id = ? AND lease_token = ? AND status = 'running'",
+                (job.job_id, job.lease_token)).fetchone()
+            if not held:
+                conn.execute('ROLLBACK')
+                raise LeaseLost(f"Lease on job {job.job_id} was lost")
+            # Результат приложения и статус задачи фиксируются одной транзакцией
+            if record is not None:
+                result = dict(result, **(record(conn) or {}))
+            conn.execute(f'''
+                UPDATE {JOBS_TABLE}
+                SET status = 'done', result = ?, error = NULL, lease_token = NULL, finished_at = ?
+                WHERE job_id = ?
+            ''', (json.dumps(result, ensure_ascii=False, default=str), time.time(), job.job_id))
+            conn.execute('COMMIT')
+            return result
+        except Exception:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+
+    def fail(self, job: Job, error: str, retry: bool = True, backoff: float = 5.0):
+        now = time.time()
+        conn = self._connect()
+        try:
+            # Повтор откладывается тем дольше, чем больше было попыток
+            conn.execute(f'''
+                UPDATE {JOBS_TABLE}
+                SET status = CASE WHEN ? AND attempts < max_attempts THEN 'queued' ELSE 'failed' END,
+                    available_at = ? + ? * attempts,
+                    finished_at = CASE WHEN ? AND attempts < max_attempts THEN NULL ELSE ? END,
+                    error = ?, lease_token = NULL, worker_id = NULL
+                WHERE job_id = ? AND lease_token = ? AND status = 'running'
+            ''', (retry, now, backoff, retry, now, error, job.job_id, job.lease_token))
+        finally:
+            conn.close()
+
+    def get(self, job_id: int):
+        conn = self._connect()
+        try:
+            row = conn.execute(f'SELECT * FROM {JOBS_TABLE} WHERE job_id = ?', (job_id,)).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            return None
+        job = dict(row)
+        job['payload'] = json.loads(job['payload'])
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        return job
+
+    def stats(self) -> dict:
+        conn = self._connect()
+        try:
+            counts = dict(conn.execute(
+                f'SELECT status, COUNT(*) FROM {JOBS_TABLE} GROUP BY status').fetchall())
+            workers = conn.execute(
+                f"SELECT COUNT(DISTINCT worker_id) FROM {JOBS_TABLE} WHERE status = 'running'").fetchone()[0]
+        finally:
+            conn.close()
+        stats = {status: counts.get(status, 0) for status in STATUSES}
+        stats['active_workers'] = workers
+        return stats
+
+
+_backends = {'sqlite': SQLiteWorkQueue}
+
+
+def register_backend(scheme: str, factory):
+    """Регистрирует бэкенд очереди: factory(адрес без схемы) -> WorkQueue"""
+    _backends[scheme] = factory
+
+
+def open_work_queue(url: str = None, default_db: str = 'database/database.db') -> WorkQueue:
+    """Открывает очередь по URL вида sqlite:///path/to.db (по умолчанию WORK_QUEUE_URL или БД приложения)"""
+    url = url or os.environ.get('WORK_QUEUE_URL') or f'sqlite:///{default_db}'
+    scheme, separator, address = url.partition('://')
+    if not separator or scheme not in _backends:
+        raise ValueError(f"Unsupported work queue URL: {url}")
+    if scheme == 'sqlite':
+        # sqlite:///relative/path и sqlite:////absolute/path, как в SQLAlchemy
+        address = address[1:] if address.startswith('/') else address
+    return _backends[scheme](address)